@@ -7,14 +7,38 @@ from .exact import *
 from .fitc import *
 from .basic import *
 from .dtc import *
+from .cg import *
+from .toeplitz import *
+from .kalman import *
+from .kronecker import *
+from .ski import *
+from .ssgp import *
+from .svgp import *
+from .vecchia import *
 
 from . import exact
 from . import fitc
 from . import basic
 from . import dtc
+from . import cg
+from . import toeplitz
+from . import kalman
+from . import kronecker
+from . import ski
+from . import ssgp
+from . import svgp
+from . import vecchia
 
 __all__ = []
 __all__ += exact.__all__
 __all__ += fitc.__all__
 __all__ += basic.__all__
 __all__ += dtc.__all__
+__all__ += cg.__all__
+__all__ += toeplitz.__all__
+__all__ += kalman.__all__
+__all__ += kronecker.__all__
+__all__ += ski.__all__
+__all__ += ssgp.__all__
+__all__ += svgp.__all__
+__all__ += vecchia.__all__
@@ -18,7 +18,9 @@ from mwhutils.random import rstate
 
 # local imports
 from ..utils.models import Parameterized
-from ._fourier import FourierSample
+from ..likelihoods import Gaussian
+from ..kernels._distances import Distances
+from ._fourier import FourierSample, PathwiseSample
 
 # exported symbols
 __all__ = ['GP']
@@ -36,20 +38,68 @@ class GP(Parameterized):
 
         `_update`: update internal statistics given all the data.
         `_posterior`: compute the full posterior for use with sampling.
-        `posterior`: compute the marginal posterior and its gradient.
-        `loglikelihood`: compute the loglikelihood of observed data.
+        `_marg_posterior`: compute the marginal posterior and its gradient.
+        `_loglikelihood`: compute the loglikelihood of observed data.
 
-    Additionally, the following method can be implemented for improved
+    The inputs are stored, and the kernel evaluated on them, in the precision
+    given by `dtype`. Setting this to `np.float32` roughly halves the memory
+    used by the kernel matrices, while any factorizations and solves are
+    still done in double precision after the noise is added.
+
+    By default the statistics are recomputed as soon as the data or the
+    hyperparameters change. If `lazy` is set to True they are instead marked
+    as stale and only recomputed once they are needed by `posterior`,
+    `loglikelihood`, or `sample`.
+
+    Additionally, the following methods can be implemented for improved
     performance in some circumstances:
 
         `_updateinc`: incremental update given new data.
+        `_updatedel`: incremental update given the removal of data.
+        `_updatemean`: update given a change in only the mean.
+        `_updatescale`: update given a change in only the signal and noise
+            variances which leaves their ratio fixed.
+        `_updategrad`: full update which also returns the loglikelihood and
+            its gradient, sharing the kernel evaluation between them.
     """
     def __init__(self, likelihood, kernel, mean):
         self._likelihood = likelihood
         self._kernel = kernel
         self._mean = float(mean)
-        self._X = None
-        self._y = None
+
+        # the data is stored in buffers whose capacity is doubled whenever
+        # they fill up, so that appending points rarely requires a copy. the
+        # data itself is given by the first `_n` rows; see `_X` and `_y`.
+        self._Xbuf = None
+        self._ybuf = None
+        self._n = 0
+
+        # cached distances between the training inputs. these don't depend on
+        # the hyperparameters so they only need to be recomputed when the data
+        # changes; see `_distances`.
+        self._dist = None
+
+        # flags for lazily updating the statistics; if _stale is true the data
+        # has changed and a full update is needed, otherwise if _hyper0 is not
+        # None the hyperparameters have changed from these values.
+        self._lazy = False
+        self._stale = False
+        self._hyper0 = None
+
+        # if not None only the most recent `_window` data points are kept.
+        self._window = None
+
+        # the precision of the inputs and hence of the kernel matrices.
+        self._dtype = np.dtype(float)
+
+        # quantities derived from the statistics which are only computed when
+        # needed, e.g. the weights used by `predict_mean`. this is cleared
+        # whenever the data or the hyperparameters change.
+        self._cache = {}
+
+        # the number of data points processed at once by any computations
+        # which are done in blocks to bound their memory use; see `blocksize`.
+        self._blocksize = 1000
 
         # record the number of hyperparameters. the additional +1 is due to the
         # mean hyperparameter.
@@ -58,8 +108,13 @@ class GP(Parameterized):
 
     def reset(self):
         """Remove all data from the model."""
-        self._X = None
-        self._y = None
+        self._Xbuf = None
+        self._ybuf = None
+        self._n = 0
+        self._dist = None
+        self._stale = False
+        self._hyper0 = None
+        self._cache = {}
 
     def __repr__(self):
         def indent(pre, text):
@@ -99,13 +154,199 @@ class GP(Parameterized):
         # FIXME: should set_hyper check the number of hyperparameters?
         a = self._likelihood.nhyper
         b = self._kernel.nhyper
+        hyper0 = self.get_hyper()
 
         self._likelihood.set_hyper(hyper[:a])
         self._kernel.set_hyper(hyper[a:a+b])
         self._mean = hyper[-1]
+        self._cache = {}
+
+        if self.ndata > 0:
+            if not self._lazy:
+                self._updatehyper(hyper0)
+            elif self._hyper0 is None:
+                self._hyper0 = hyper0
+
+    @property
+    def lazy(self):
+        """Whether updates to the sufficient statistics are deferred."""
+        return self._lazy
+
+    @lazy.setter
+    def lazy(self, lazy):
+        self._lazy = bool(lazy)
+        if not self._lazy:
+            self._refresh()
+
+    @property
+    def window(self):
+        """
+        The maximum number of data points kept by the model, or None. If this
+        is set the oldest data is removed whenever new data is added.
+        """
+        return self._window
+
+    @window.setter
+    def window(self, window):
+        self._window = None if (window is None) else int(window)
+        self._trim()
+
+    @property
+    def blocksize(self):
+        """
+        The number of data points processed at once by any computations which
+        are done in blocks, e.g. by accumulating over tiles of the kernel
+        matrix, in order to bound their memory use.
+        """
+        return self._blocksize
 
+    @blocksize.setter
+    def blocksize(self, blocksize):
+        blocksize = int(blocksize)
+        if blocksize < 1:
+            raise ValueError('the blocksize must be positive')
+        self._blocksize = blocksize
+
+    @property
+    def dtype(self):
+        """
+        The floating point type used to store the inputs and evaluate the
+        kernel, either `np.float64` (the default) or `np.float32`.
+        """
+        return self._dtype
+
+    @dtype.setter
+    def dtype(self, dtype):
+        dtype = np.dtype(dtype)
+        if dtype not in (np.float32, np.float64):
+            raise ValueError('the precision must be single or double')
+        if dtype == self._dtype:
+            return
+
+        self._dtype = dtype
+        self._cache = {}
         if self.ndata > 0:
+            self._Xbuf = self._Xbuf.astype(dtype)
+            self._dist = None
+            if self._lazy:
+                self._stale = True
+            else:
+                self._update()
+
+    def _transform(self, X):
+        """Format the inputs `X` as arrays in the model's precision."""
+        return self._kernel.transform(X).astype(self._dtype, copy=False)
+
+    def _trim(self):
+        """Remove the oldest data if there are more points than the window."""
+        if self._window is not None and self.ndata > self._window:
+            self.remove_data(slice(0, self.ndata - self._window))
+
+    def _refresh(self):
+        """
+        Bring the sufficient statistics up to date if they have been marked as
+        stale. This is a no-op unless the model is lazy.
+        """
+        if self._stale:
             self._update()
+        elif self._hyper0 is not None:
+            self._updatehyper(self._hyper0)
+        self._stale = False
+        self._hyper0 = None
+
+    def _updategrad(self):
+        """
+        Perform a full update and return the loglikelihood and its gradient,
+        or raise NotImplementedError if the model can't do this any faster
+        than `_update` followed by `_loglikelihood`.
+        """
+        raise NotImplementedError
+
+    def _updatehyper(self, hyper0):
+        """
+        Update the sufficient statistics after the hyperparameters have changed
+        from `hyper0`. If only the mean and/or the signal and noise variances
+        (scaled by the same amount) have changed this will use `_updatemean`
+        and `_updatescale` if they are implemented; otherwise the full
+        `_update` is performed.
+        """
+        hyper = self.get_hyper()
+        delta = hyper - hyper0
+        changed = (delta != 0)
+
+        # nothing to do if the hyperparameters haven't changed.
+        if not np.any(changed):
+            return
+
+        # the kernel matrix (including noise) is simply rescaled if the noise
+        # and the kernel's signal amplitude change by the same amount. we can
+        # only find these if the likelihood is Gaussian and the kernel's first
+        # parameter is its signal amplitude.
+        a = self._likelihood.nhyper
+        rescaled = (isinstance(self._likelihood, Gaussian) and
+                    self._kernel._params()[0][0] == 'sf' and
+                    changed[0] and
+                    np.isclose(delta[0], delta[a], rtol=1e-12, atol=1e-12))
+
+        # find whether anything other than the mean/scale has changed.
+        other = changed.copy()
+        other[-1] = False
+        if rescaled:
+            other[[0, a]] = False
+
+        if not np.any(other):
+            try:
+                if rescaled:
+                    self._updatescale(np.exp(2*delta[0]))
+                if changed[-1]:
+                    self._updatemean(hyper0[-1])
+                return
+            except NotImplementedError:
+                pass
+
+        self._update()
+
+    @property
+    def _X(self):
+        return None if (self._n == 0) else self._Xbuf[:self._n]
+
+    @property
+    def _y(self):
+        return None if (self._n == 0) else self._ybuf[:self._n]
+
+    def _append(self, X, y):
+        """
+        Append `X` and `y` to the data buffers, doubling their capacity if
+        there is not enough room.
+        """
+        n = self._n + len(X)
+        if self._Xbuf is None or n > len(self._Xbuf):
+            size = max(n, 2*self._n)
+            Xbuf = np.empty((size,) + X.shape[1:], X.dtype)
+            ybuf = np.empty((size,) + y.shape[1:], y.dtype)
+            Xbuf[:self._n] = self._X
+            ybuf[:self._n] = self._y
+            self._Xbuf = Xbuf
+            self._ybuf = ybuf
+
+        self._Xbuf[self._n:n] = X
+        self._ybuf[self._n:n] = y
+        self._n = n
+
+    def _delete(self, keep):
+        """
+        Remove the data not selected by the boolean mask `keep`. This writes
+        into new buffers (of the same capacity) so that any arrays previously
+        returned by `data` are left untouched.
+        """
+        n = np.sum(keep)
+        Xbuf = np.empty_like(self._Xbuf)
+        ybuf = np.empty_like(self._ybuf)
+        Xbuf[:n] = self._X[keep]
+        ybuf[:n] = self._y[keep]
+        self._Xbuf = Xbuf
+        self._ybuf = ybuf
+        self._n = n
 
     @property
     def ndata(self):
@@ -121,25 +362,64 @@ class GP(Parameterized):
         """
         Add new data to the GP model.
         """
-        X = self._kernel.transform(X)
+        X = self._transform(X)
         y = self._likelihood.transform(y)
 
-        if self._X is None:
-            self._X = X.copy()
-            self._y = y.copy()
+        # any cached distances are invalidated by the new data.
+        self._dist = None
+        self._cache = {}
+
+        if self._lazy:
+            self._append(X, y)
+            self._stale = True
+
+        elif self._X is None:
+            self._append(X, y)
             self._update()
 
         else:
             try:
                 self._updateinc(X, y)
-                self._X = np.r_[self._X, X]
-                self._y = np.r_[self._y, y]
+                self._append(X, y)
 
             except NotImplementedError:
-                self._X = np.r_[self._X, X]
-                self._y = np.r_[self._y, y]
+                self._append(X, y)
                 self._update()
 
+        self._trim()
+
+    def remove_data(self, idx):
+        """
+        Remove data from the GP model, where `idx` is anything which can be
+        used to index the data points (an integer, slice, boolean mask, etc.).
+        """
+        idx = np.unique(np.arange(self.ndata)[idx])
+        keep = np.ones(self.ndata, dtype=bool)
+        keep[idx] = False
+
+        if len(idx) == 0:
+            return
+
+        if not np.any(keep):
+            self.reset()
+            return
+
+        # any cached distances are invalidated by removing data.
+        self._dist = None
+        self._cache = {}
+
+        if self._lazy:
+            self._stale = True
+        else:
+            try:
+                self._updatedel(idx)
+            except NotImplementedError:
+                self._delete(keep)
+                self._update()
+                return
+
+        self._delete(keep)
+
     def sample(self, X, m=None, latent=True, rng=None):
         """
         Sample values from the posterior at points `X`. Given an `(n,d)`-array
@@ -151,7 +431,7 @@ class GP(Parameterized):
         will instead be returned corrupted by the observation noise. Finally
         `rng` can be used to seed the randomness.
         """
-        X = self._kernel.transform(X)
+        X = self._transform(X)
 
         # this boolean indicates whether we'll flatten the sample to return a
         # vector, or if we'll return a set of samples as an array.
@@ -167,6 +447,7 @@ class GP(Parameterized):
 
         # add a tiny amount to the diagonal to make the cholesky of Sigma
         # stable and then add this correlated noise onto mu to get the sample.
+        self._refresh()
         mu, Sigma = self._full_posterior(X)
         Sigma += 1e-10 * np.eye(n)
         f = mu[None] + np.dot(rng.normal(size=(m, n)), sla.cholesky(Sigma))
@@ -176,14 +457,86 @@ class GP(Parameterized):
 
         return f.ravel() if flatten else f
 
-    def posterior(self, X, grad=False):
+    def posterior(self, X, grad=False, blocksize=None, nworkers=None):
         """
         Return the marginal posterior. This should return the mean and variance
         of the given points, and if `grad == True` should return their
         derivatives with respect to the input location as well (i.e. a
         4-tuple).
+
+        If `blocksize` is given the points are evaluated in blocks of at most
+        this size and written into preallocated outputs, which bounds the
+        memory used by any intermediate terms. These blocks are evaluated
+        using a pool of `nworkers` threads if this is greater than 1.
+        """
+        self._refresh()
+        X = self._transform(X)
+
+        if blocksize is None or len(X) <= blocksize:
+            return self._marg_posterior(X, grad)
+
+        n = len(X)
+        out = (np.empty(n), np.empty(n))
+        if grad:
+            out += (np.empty(X.shape), np.empty(X.shape))
+
+        def run(i):
+            parts = self._marg_posterior(X[i:i+blocksize], grad)
+            for a, b in zip(out, parts):
+                a[i:i+blocksize] = b
+
+        # the posterior computations don't modify the model, and the bulk of
+        # the work is in numpy/scipy routines which release the GIL.
+        starts = xrange(0, n, blocksize)
+        if nworkers is None or nworkers <= 1:
+            for i in starts:
+                run(i)
+        else:
+            # NOTE: this is only imported here as on python 2 it requires the
+            # futures backport.
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(nworkers) as pool:
+                list(pool.map(run, starts))
+
+        return out
+
+    def predict_mean(self, X):
+        """
+        Return the posterior mean at `X`. Models which cache their predictive
+        weights can compute this without the cost of the variance.
+        """
+        self._refresh()
+        return self._predict_mean(self._transform(X))
+
+    def predict_var(self, X, rank=None):
         """
-        return self._marg_posterior(self._kernel.transform(X), grad)
+        Return the posterior variance at `X`. Models which cache the required
+        factors can compute this faster than `posterior`. If `rank` is given
+        such models may use a low-rank approximation instead, which can only
+        overestimate the variance.
+        """
+        self._refresh()
+        return self._predict_var(self._transform(X), rank)
+
+    def loglikelihood(self, grad=False):
+        """
+        Return the marginal loglikelihood of the data. If `grad == True` also
+        return the gradient with respect to the hyperparameters.
+        """
+        # if the statistics are stale let the model compute them along with
+        # the gradient, e.g. when optimizing a lazy model.
+        if grad and (self._stale or self._hyper0 is not None):
+            try:
+                lZ, dlZ = self._updategrad()
+            except NotImplementedError:
+                pass
+            else:
+                self._stale = False
+                self._hyper0 = None
+                return lZ, dlZ
+
+        self._refresh()
+        return self._loglikelihood(grad)
 
     def sample_fourier(self, N, rng=None):
         """
@@ -195,6 +548,52 @@ class GP(Parameterized):
                              self._likelihood, self._kernel, self._mean,
                              self._X, self._y, rng)
 
+    def sample_pathwise(self, N, rng=None):
+        """
+        Sample a function from the posterior by drawing a prior sample using N
+        random Fourier features and correcting it using the data, which
+        unlike `sample_fourier` is exact up to the prior approximation. This
+        requires that the model implements `_solve`; see `PathwiseSample` for
+        details on the returned function object.
+        """
+        self._refresh()
+        return PathwiseSample(N,
+                              self._likelihood, self._kernel.copy(),
+                              self._mean, self._X, self._y, self._solve, rng)
+
+    def _distances(self):
+        """
+        Return the cached `Distances` object used to evaluate the kernel on the
+        training inputs. Subclasses which evaluate the kernel against some
+        other set of fixed points should override this.
+        """
+        if self._dist is None:
+            self._dist = Distances(self._X)
+        return self._dist
+
+    def _blocks(self):
+        """Iterate over the slices defining each block of data points."""
+        for i in xrange(0, self.ndata, self._blocksize):
+            yield slice(i, i + self._blocksize)
+
+    def _solve(self, B):
+        """
+        Solve the system `(K + sn2 I) X = B` given by the kernel matrix of the
+        data plus noise using the current statistics.
+        """
+        raise NotImplementedError
+
+    # NOTE: the following methods default to computing the full marginal
+    # posterior and only need to be implemented if this can be avoided.
+
+    def _predict_mean(self, X):
+        """Compute the posterior mean at `X`."""
+        return self._marg_posterior(X)[0]
+
+    def _predict_var(self, X, rank=None):
+        """Compute the (possibly approximate) posterior variance at `X`."""
+        return self._marg_posterior(X)[1]
+
     @abstractmethod
     def _update(self):
         """
@@ -216,6 +615,32 @@ class GP(Parameterized):
         """
         raise NotImplementedError
 
+    def _updatedel(self, idx):
+        """
+        Update any internal parameters given that the data points with (sorted,
+        unique) indices `idx` will be removed. This method is called before the
+        data is removed from the internal data-store and like `_updateinc` need
+        not be implemented.
+        """
+        raise NotImplementedError
+
+    def _updatemean(self, mean0):
+        """
+        Update any internal parameters given that only the mean has changed,
+        where `mean0` is its previous value. Like `_updateinc` this need not
+        be implemented, in which case the full `_update` is performed.
+        """
+        raise NotImplementedError
+
+    def _updatescale(self, c):
+        """
+        Update any internal parameters given that both the kernel and the
+        noise variance have been scaled by the factor `c` (i.e. the kernel's
+        signal variance and the noise variance changed but not their ratio).
+        Like `_updateinc` this need not be implemented.
+        """
+        raise NotImplementedError
+
     @abstractmethod
     def _full_posterior(self, X):
         """
@@ -234,9 +659,10 @@ class GP(Parameterized):
         raise NotImplementedError
 
     @abstractmethod
-    def loglikelihood(self, grad=False):
+    def _loglikelihood(self, grad=False):
         """
-        Return the marginal loglikelihood of the data. If `grad == True` also
-        return the gradient with respect to the hyperparameters.
+        Compute the marginal loglikelihood of the data given up-to-date
+        sufficient statistics. If `grad` is True return the gradient with
+        respect to the hyperparameters as well.
         """
         raise NotImplementedError
@@ -12,7 +12,7 @@ import scipy.linalg as sla
 from mwhutils.random import rstate
 from ..likelihoods import Gaussian
 
-__all__ = ['FourierSample']
+__all__ = ['FourierSample', 'PathwiseSample']
 
 
 class FourierSample(object):
@@ -83,3 +83,54 @@ class FourierSample(object):
             return F[0], G[0]
         else:
             return self.get(x)[0]
+
+
+class PathwiseSample(FourierSample):
+    """
+    Sample from a Gaussian process posterior using Matheron's rule, i.e. a
+    prior sample approximated using random Fourier features which is then
+    corrected by an exact update in the space of the data.
+
+    Here `solve` should solve the system given by the kernel matrix of the
+    data plus noise. If `noise` is False then `y` is instead taken to be a
+    sample of the function itself at `X`, e.g. at a set of pseudo-inputs, and
+    `solve` should use the kernel matrix alone. Evaluating the sample takes
+    O(N + n) time per point.
+    """
+    def __init__(self, N, likelihood, kernel, mean, X, y, solve, rng=None,
+                 noise=True):
+        # the prior sample and the noise at the data must use the same rng.
+        rng = rstate(rng)
+        super(PathwiseSample, self).__init__(N, likelihood, kernel, mean,
+                                             None, None, rng)
+        self._kernel = kernel
+        self._X = X
+        self._v = None
+
+        if X is not None:
+            # the update weights are given by solving for the difference
+            # between the data and the prior sample plus noise.
+            r = y - super(PathwiseSample, self).get(X)
+            if noise:
+                r -= np.sqrt(likelihood.s2) * rng.randn(len(X))
+            self._v = solve(r)
+
+    def get(self, X, grad=False):
+        """
+        Evaluate the function at a collection of points.
+        """
+        X = np.array(X, ndmin=2, copy=False)
+        out = super(PathwiseSample, self).get(X, grad)
+
+        if self._X is None:
+            return out
+
+        F, G = out if grad else (out, None)
+        F = F + np.dot(self._v, self._kernel.get(self._X, X))
+
+        if not grad:
+            return F
+
+        G = G + np.einsum('ijk,i', self._kernel.grady(self._X, X), self._v)
+
+        return F, G
@@ -0,0 +1,254 @@
+"""
+Base class for exact GP inference using iterative methods, i.e. methods which
+only access the kernel matrix through matrix-vector products.
+"""
+
+from __future__ import division
+from __future__ import absolute_import
+from __future__ import print_function
+
+import numpy as np
+import scipy.linalg as sla
+
+from mwhutils.abc import abstractmethod
+from ._base import GP
+from ..likelihoods import Gaussian
+from ..utils.linalg import pivoted_cholesky, pcg, lanczos_quadrature
+
+__all__ = []
+
+
+class IterativeGP(GP):
+    """
+    Exact GP inference using preconditioned conjugate gradients.
+
+    Solves against the kernel matrix `K + sn2 I` are computed using PCG with a
+    preconditioner of the form `L L^T + sn2 I`, where `L` is a low-rank pivoted
+    Cholesky factor of `K`. The log-determinant is estimated using stochastic
+    Lanczos quadrature and the traces needed for the gradient by Hutchinson's
+    estimator, in both cases using the exact quantities for the preconditioner
+    as control variates. The probe vectors are drawn from a fixed seed so that
+    the loglikelihood is a deterministic function of the hyperparameters.
+
+    Subclasses must implement:
+
+        `_mvm`: multiply the (noise-free) kernel matrix by a set of vectors.
+        `_mvm_grad`: multiply each kernel gradient by a set of vectors.
+
+    and can override `_diag` and `_columns` (used to form the preconditioner)
+    or `_precond` itself if the kernel has more structure. If the kernel
+    matrix is itself an approximation `_diag_grad` should also be overridden
+    so that the gradient traces are consistent with `_mvm_grad`.
+    """
+    def __init__(self, likelihood, kernel, mean,
+                 rank=20, nprobe=10, tol=1e-8, maxiter=None, seed=0):
+        # NOTE: exact inference will only work with Gaussian likelihoods.
+        if not isinstance(likelihood, Gaussian):
+            raise ValueError('exact inference requires a Gaussian likelihood')
+
+        super(IterativeGP, self).__init__(likelihood, kernel, mean)
+
+        # parameters of the iterative methods.
+        self._rank = rank
+        self._nprobe = nprobe
+        self._tol = tol
+        self._maxiter = maxiter
+        self._seed = seed
+
+        # the preconditioner factor L, the cholesky R of sn2 I + L^T L, and the
+        # solution alpha = (K + sn2 I)^{-1} (y - mean).
+        self._L = None
+        self._R = None
+        self._alpha = None
+
+    def reset(self):
+        for attr in ('L', 'R', 'alpha'):
+            setattr(self, '_' + attr, None)
+        super(IterativeGP, self).reset()
+
+    @staticmethod
+    def _options(gp):
+        """
+        Return the parameters of the iterative methods used by `gp` as keyword
+        arguments, so that `from_gp` can keep them; if `gp` doesn't use
+        iterative methods return no arguments and hence the defaults.
+        """
+        if not isinstance(gp, IterativeGP):
+            return {}
+        return dict(rank=gp._rank, nprobe=gp._nprobe, tol=gp._tol,
+                    maxiter=gp._maxiter, seed=gp._seed)
+
+    @abstractmethod
+    def _mvm(self, V):
+        """
+        Compute the product `K V` of the kernel matrix evaluated at the
+        training inputs with the (n,t)-array `V`.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def _mvm_grad(self, V):
+        """
+        Compute the products `dK V` for the gradient of the kernel matrix with
+        respect to each kernel hyperparameter. Return a (nhyper,n,t)-array.
+        """
+        raise NotImplementedError
+
+    def _diag(self):
+        """Return the diagonal of the kernel matrix."""
+        return self._kernel.dget(self._X)
+
+    def _diag_grad(self):
+        """
+        Return the gradients of the diagonal of the kernel matrix wrt each
+        kernel hyperparameter, as a (nhyper,n)-array.
+        """
+        return np.array(list(self._kernel.dgrad(self._X)))
+
+    def _columns(self, idx):
+        """Return the columns of the kernel matrix indexed by `idx`."""
+        return self._kernel.get(self._X, self._X[idx])
+
+    def _precond(self):
+        """Return the low-rank factor `L` of the preconditioner."""
+        return pivoted_cholesky(self._diag(),
+                                lambda i: self._columns([i])[:, 0],
+                                self._rank)
+
+    def _matvec(self, V):
+        """Multiply by the kernel matrix plus noise."""
+        return self._mvm(V) + self._likelihood.s2 * V
+
+    def _psolve(self, V):
+        """Apply the inverse of the preconditioner using Woodbury."""
+        W = np.dot(self._L, sla.cho_solve((self._R, False),
+                                          np.dot(self._L.T, V)))
+        return (V - W) / self._likelihood.s2
+
+    def _solve(self, B, lanczos=False):
+        """
+        Solve `(K + sn2 I) X = B` for the (n,)- or (n,t)-array `B`; see `pcg`
+        for the `lanczos` argument.
+        """
+        B = np.asarray(B)
+        out = pcg(self._matvec, B.reshape(B.shape[0], -1), self._psolve,
+                  self._tol, self._maxiter, lanczos)
+        if lanczos:
+            return out[0].reshape(B.shape), out[1]
+        return out.reshape(B.shape)
+
+    def _update(self):
+        sn2 = self._likelihood.s2
+        self._L = self._precond()
+        self._R = sla.cholesky(sn2 * np.eye(self._L.shape[1]) +
+                               np.dot(self._L.T, self._L))
+        self._alpha = self._solve(self._y - self._mean)
+
+    def _updatemean(self, mean0):
+        self._alpha = self._solve(self._y - self._mean)
+
+    def _updatescale(self, c):
+        self._L *= np.sqrt(c)
+        self._R *= np.sqrt(c)
+        self._alpha /= c
+
+    def _full_posterior(self, X):
+        # grab the prior mean and covariance.
+        mu = np.full(X.shape[0], self._mean)
+        Sigma = self._kernel.get(X)
+
+        if self._X is not None:
+            K = self._kernel.get(self._X, X)
+            V = self._solve(K)
+            mu += np.dot(K.T, self._alpha)
+            Sigma -= np.dot(K.T, V)
+
+        return mu, Sigma
+
+    def _marg_posterior(self, X, grad=False):
+        # grab the prior mean and variance.
+        mu = np.full(X.shape[0], self._mean)
+        s2 = self._kernel.dget(X)
+
+        if self._X is not None:
+            K = self._kernel.get(self._X, X)
+            V = self._solve(K)
+            mu += np.dot(K.T, self._alpha)
+            s2 -= np.sum(K * V, axis=0)
+
+        if not grad:
+            return (mu, s2)
+
+        # Get the prior gradients. Note that this assumes a constant mean and
+        # stationary kernel.
+        dmu = np.zeros_like(X)
+        ds2 = np.zeros_like(X)
+
+        if self._X is not None:
+            dK = self._kernel.grady(self._X, X)
+            dmu += np.einsum('ijk,i', dK, self._alpha)
+            ds2 -= 2 * np.einsum('ijk,ij->jk', dK, V)
+
+        return (mu, s2, dmu, ds2)
+
+    def _loglikelihood(self, grad=False):
+        n = self.ndata
+        k = self._L.shape[1]
+        sn2 = self._likelihood.s2
+        r = self._y - self._mean
+
+        # probe vectors z ~ N(0, P), where P is the preconditioner.
+        rng = np.random.RandomState(self._seed)
+        Z = (np.dot(self._L, rng.randn(k, self._nprobe)) +
+             np.sqrt(sn2) * rng.randn(n, self._nprobe))
+
+        # solve against the probes; the Lanczos matrices correspond to the
+        # preconditioned system started from P^{-1/2} z, so that
+        # log|K + sn2 I| = log|P| + E[z^T P^{-1} z e_1^T log(T) e_1].
+        W, T = self._solve(Z, lanczos=True)
+        PZ = self._psolve(Z)
+        zPz = np.sum(Z * PZ, axis=0)
+
+        logdet = 2 * np.sum(np.log(self._R.diagonal()))
+        logdet += (n - k) * np.log(sn2)
+        logdet += np.mean([c * lanczos_quadrature(Tj)
+                           for c, Tj in zip(zPz, T)])
+
+        lZ = -0.5 * np.inner(r, self._alpha)
+        lZ -= 0.5 * logdet
+        lZ -= 0.5 * np.log(2 * np.pi) * n
+
+        if not grad:
+            return lZ
+
+        # tr((K + sn2 I)^{-1} dK) is estimated as tr(P^{-1} dK), which is
+        # computed exactly, plus a Hutchinson estimate of the remainder
+        # tr(((K + sn2 I)^{-1} - P^{-1}) dK) using the probes z ~ N(0, P).
+        D = W - PZ
+        LL = np.dot(self._L.T, self._L)
+
+        def trace(dtr, LdKL, Est):
+            tr = dtr - np.trace(sla.cho_solve((self._R, False), LdKL))
+            return tr / sn2 + np.mean(Est)
+
+        # derivative wrt the likelihood's noise term, ie dK = 2 sn2 I.
+        dlZ = [sn2 * np.inner(self._alpha, self._alpha) -
+               sn2 * trace(n, LL, np.sum(D * PZ, axis=0))]
+
+        # derivative wrt each kernel hyperparameter.
+        dK = self._mvm_grad(np.c_[self._alpha, PZ, self._L])
+        dtr = np.sum(self._diag_grad(), axis=1)
+
+        for dtr_, dK_ in zip(dtr, dK):
+            dKa = dK_[:, 0]
+            dKz = dK_[:, 1:1+self._nprobe]
+            dKL = dK_[:, 1+self._nprobe:]
+            dlZ.append(
+                0.5 * np.inner(self._alpha, dKa) -
+                0.5 * trace(dtr_, np.dot(self._L.T, dKL),
+                            np.sum(D * dKz, axis=0)))
+
+        # derivative wrt the mean.
+        dlZ.append(np.sum(self._alpha))
+
+        return lZ, np.array(dlZ)
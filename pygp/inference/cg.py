@@ -0,0 +1,52 @@
+"""
+Exact GP inference using conjugate gradients and matrix-free kernel products.
+"""
+
+from __future__ import division
+from __future__ import absolute_import
+from __future__ import print_function
+
+import numpy as np
+
+from ._iterative import IterativeGP
+
+__all__ = ['CGGP']
+
+
+class CGGP(IterativeGP):
+    """
+    Exact GP inference using conjugate gradients.
+
+    Products with the kernel matrix are computed in blocks of `blocksize`
+    rows, so memory use is O(blocksize * n) rather than the O(n^2) needed to
+    store the kernel matrix. See `IterativeGP` for the remaining arguments,
+    which control the preconditioner rank, number of probe vectors used in
+    stochastic estimates, and the CG tolerance.
+    """
+    def __init__(self, likelihood, kernel, mean,
+                 rank=20, nprobe=10, tol=1e-8, maxiter=None, seed=0):
+        super(CGGP, self).__init__(likelihood, kernel, mean,
+                                   rank, nprobe, tol, maxiter, seed)
+
+    @classmethod
+    def from_gp(cls, gp):
+        newgp = cls(gp._likelihood.copy(), gp._kernel.copy(), gp._mean,
+                    **cls._options(gp))
+        newgp.blocksize = gp.blocksize
+        if gp.ndata > 0:
+            X, y = gp.data
+            newgp.add_data(X, y)
+        return newgp
+
+    def _mvm(self, V):
+        out = np.empty_like(V)
+        for b in self._blocks():
+            out[b] = np.dot(self._kernel.get(self._X[b], self._X), V)
+        return out
+
+    def _mvm_grad(self, V):
+        out = np.empty((self._kernel.nhyper,) + V.shape)
+        for b in self._blocks():
+            for i, dK in enumerate(self._kernel.grad(self._X[b], self._X)):
+                out[i, b] = np.dot(dK, V)
+        return out
@@ -9,16 +9,23 @@ from __future__ import print_function
 
 import numpy as np
 import scipy.linalg as sla
-import itertools as it
 
 from ..likelihoods import Gaussian
+from ..kernels._distances import Distances
+from ..utils.linalg import cholupdate
 from ._base import GP
 
 __all__ = ['DTC']
 
 
 class DTC(GP):
-    """Deterministic training conditional approximation to GP inference."""
+    """
+    Deterministic training conditional approximation to GP inference.
+
+    The kernel between the pseudo-inputs and the data, and its gradients,
+    are evaluated in tiles of `blocksize` data points, so beyond a tile only
+    O(p^2) memory is needed for p pseudo-inputs.
+    """
 
     def __init__(self, likelihood, kernel, mean, U):
         # NOTE: exact inference will only work with Gaussian likelihoods.
@@ -28,16 +35,26 @@ class DTC(GP):
         super(DTC, self).__init__(likelihood, kernel, mean)
         # save the pseudo-input locations.
         self._U = np.array(U, ndmin=2, dtype=float, copy=True)
+        self._Udist = Distances(self._U)
 
         self._Ruu = None
         self._Rux = None
         self._a = None
 
+        # the sum of Kux over the data, which lets us update a when only the
+        # mean changes.
+        self._c = None
+
     @property
     def pseudoinputs(self):
         """The pseudo-input points."""
         return self._U
 
+    def _distances(self):
+        if self._dist is None:
+            self._dist = Distances(self._U, self._X)
+        return self._dist
+
     @classmethod
     def from_gp(cls, gp, U=None):
         if U is None:
@@ -46,6 +63,7 @@ class DTC(GP):
             else:
                 raise ValueError('gp has no pseudoinputs and none are given')
         newgp = cls(gp._likelihood.copy(), gp._kernel.copy(), gp._mean, U)
+        newgp.blocksize = gp.blocksize
         if gp.ndata > 0:
             X, y = gp.data
             newgp.add_data(X, y)
@@ -57,19 +75,47 @@ class DTC(GP):
 
         # choleskies of Kuu and (Kuu + Kfu * Kuf / sn2), respectively,
         # see Eq 20b of (Quinonero-Candela and Rasmussen, 2005)
-        Kuu = self._kernel.get(self._U)
+        Kuu = self._kernel.get(self._Udist)
         self._Ruu = sla.cholesky(Kuu + su2 * np.eye(p))
 
-        # formulate data-dependent problem
-        Kux = self._kernel.get(self._U, self._X)
-        S = Kuu + np.dot(Kux, Kux.T) / self._likelihood.s2
+        # formulate data-dependent problem, accumulating over tiles of data
+        # points.
+        S = Kuu + su2 * np.eye(p)
+        Kr = np.zeros(p)
+        self._c = np.zeros(p)
+        r = self._y - self._mean
+        dist = self._distances()
+        for b in self._blocks():
+            Kux = self._kernel.get(dist.block(slice(None), b))
+            S += np.dot(Kux, Kux.T) / self._likelihood.s2
+            Kr += np.dot(Kux, r[b])
+            self._c += np.sum(Kux, axis=1)
 
         # compute cholesky of data dependent problem
-        r = self._y - self._mean
-        self._Rux = sla.cholesky(S + su2 * np.eye(p))
-        self._a = sla.solve_triangular(self._Rux,
-                                       np.dot(Kux, r),
-                                       trans=True)
+        self._Rux = sla.cholesky(S)
+        self._a = sla.solve_triangular(self._Rux, Kr, trans=True)
+
+    def _updateinc(self, X, y):
+        # NOTE: the running statistics Kux*Kux^T and Kux*r are stored
+        # implicitly in the cholesky Rux and the vector Rux^T a, so adding k
+        # new points only requires a rank-k update of Rux.
+        Kux = self._kernel.get(self._U, X)
+        r = y - self._mean
+        Kr = np.dot(self._Rux.T, self._a) + np.dot(Kux, r)
+
+        self._Rux = cholupdate(self._Rux, Kux.T / np.sqrt(self._likelihood.s2))
+        self._a = sla.solve_triangular(self._Rux, Kr, trans=True)
+        self._c += np.sum(Kux, axis=1)
+
+    def _updatemean(self, mean0):
+        c = sla.solve_triangular(self._Rux, self._c, trans=True)
+        self._a -= (self._mean - mean0) * c
+
+    def _updatescale(self, c):
+        self._Ruu *= np.sqrt(c)
+        self._Rux *= np.sqrt(c)
+        self._a *= np.sqrt(c)
+        self._c *= c
 
     def _full_posterior(self, X):
         # grab the prior mean and covariance.
@@ -129,24 +175,54 @@ class DTC(GP):
 
         return (mu, s2, dmu, ds2)
 
-    def loglikelihood(self, grad=False):
+    def _predict_mean(self, X):
+        mu = np.full(X.shape[0], self._mean)
+        if self._X is not None:
+            if 'w' not in self._cache:
+                self._cache['w'] = sla.solve_triangular(self._Rux, self._a)
+                self._cache['w'] /= self._likelihood.s2
+            mu += np.dot(self._cache['w'], self._kernel.get(self._U, X))
+        return mu
+
+    def _predict_var(self, X, rank=None):
+        s2 = self._kernel.dget(X)
+        if self._X is not None:
+            # the variance is k(x,x) - k^T M k with M = Kuu^{-1} - S^{-1},
+            # where the inverses are given by the stored choleskys.
+            if 'M' not in self._cache:
+                I = np.eye(self._U.shape[0])
+                self._cache['M'] = (sla.cho_solve((self._Ruu, False), I) -
+                                    sla.cho_solve((self._Rux, False), I))
+            K = self._kernel.get(self._U, X)
+            s2 -= np.sum(K * np.dot(self._cache['M'], K), axis=0)
+        return s2
+
+    def _loglikelihood(self, grad=False):
         # noise hyperparameters
         sn2 = self._likelihood.s2
         su2 = sn2 * 1e-6
         ell = np.sqrt(sn2)
+        p = self._U.shape[0]
 
-        # get the rest of the kernels and the residual.
-        Kux = self._kernel.get(self._U, self._X)
-        r = self._y.copy() - self._mean
+        # the residual.
+        r = self._y - self._mean
         r /= ell
 
-        # the cholesky of Q.
-        V = sla.solve_triangular(self._Ruu, Kux, trans=True)
-        V /= ell
-
-        p = self._U.shape[0]
-        A = sla.cholesky(np.eye(p) + np.dot(V, V.T))
-        beta = sla.solve_triangular(A, V.dot(r), trans=True)
+        # the products of V, the cholesky of Q rescaled by ell, with itself
+        # and with the residual are accumulated over tiles of data points.
+        dist = self._distances()
+        VV = np.zeros((p, p))
+        Vr = np.zeros(p)
+        for b in self._blocks():
+            V = sla.solve_triangular(
+                self._Ruu, self._kernel.get(dist.block(slice(None), b)),
+                trans=True)
+            V /= ell
+            VV += np.dot(V, V.T)
+            Vr += np.dot(V, r[b])
+
+        A = sla.cholesky(np.eye(p) + VV)
+        beta = sla.solve_triangular(A, Vr, trans=True)
 
         lZ = -np.sum(np.log(np.diag(A))) - self.ndata * np.log(ell)
         lZ -= 0.5 * (np.inner(r, r) - np.inner(beta, beta))
@@ -155,16 +231,42 @@ class DTC(GP):
         if not grad:
             return lZ
 
-        alpha = (r - V.T.dot(sla.solve_triangular(A, beta)))
-        B = sla.solve_triangular(self._Ruu, V)
-        W = sla.solve_triangular(A, V, trans=True)
-        VW = np.dot(V, W.T)
-        BW = np.dot(B, W.T)
-        w = B.dot(alpha)
-        v = V.dot(alpha)
+        # these give V W^T, B W^T, w = B alpha, and v = V alpha without
+        # forming alpha.
+        gamma = sla.solve_triangular(A, beta)
+        VW = sla.solve_triangular(A, VV, trans=True).T
+        BW = sla.solve_triangular(self._Ruu, VW)
+        v = Vr - np.dot(VV, gamma)
+        w = sla.solve_triangular(self._Ruu, v)
 
         # allocate space for the gradients.
         dlZ = np.zeros(self.nhyper)
+        GB = np.zeros((p, p))
+        BB = 0
+
+        # the terms involving the kernel gradients are accumulated over tiles
+        # of data points, so that beyond the tile only O(p^2) memory is
+        # needed. these are -0.5 sum(M*G) where M = 2 dKux / ell - dKuu B,
+        # which is linear in the kernel gradients and so is given by
+        # contracting them with G and G B^T.
+        for b in self._blocks():
+            tile = dist.block(slice(None), b)
+            V = sla.solve_triangular(self._Ruu, self._kernel.get(tile),
+                                     trans=True)
+            V /= ell
+            B = sla.solve_triangular(self._Ruu, V)
+            W = sla.solve_triangular(A, V, trans=True)
+            alpha = r[b] - np.dot(V.T, gamma)
+            G = B - np.outer(w, alpha) - np.dot(BW, W)
+
+            BB += np.sum(B**2)
+            GB += np.dot(G, B.T)
+            dlZ[1:-1] -= self._kernel.grad_contract(G / ell, tile)
+
+            # gradient wrt the constant mean.
+            dlZ[-1] += np.sum(alpha) / ell
+
+        dlZ[1:-1] += 0.5 * self._kernel.grad_contract(GB, self._Udist)
 
         # gradient wrt the noise parameter.
         dlZ[0] = -(
@@ -175,25 +277,8 @@ class DTC(GP):
             + su2 * np.inner(w, w)
             # gradient of the log determinant term
             + self.ndata
-            - np.sum(V**2)
+            - np.trace(VV)
             + np.sum(VW**2)
-            - su2 * (np.sum(B**2) - np.sum(BW**2)))
-
-        # iterator over gradients of the kernels
-        dK = it.izip(
-            self._kernel.grad(self._U),
-            self._kernel.grad(self._U, self._X))
-
-        # gradient wrt the kernel hyperparameters.
-        i = 1
-        for i, (dKuu, dKux) in enumerate(dK, i):
-            M = 2 * dKux / ell - dKuu.dot(B)
-            dlZ[i] = -0.5 * (
-                - np.inner(w, np.dot(M, alpha))
-                + np.sum(M*B)
-                - np.sum(M.dot(W.T) * B.dot(W.T)))
-
-        # gradient wrt the constant mean.
-        dlZ[-1] = np.sum(alpha) / ell
+            - su2 * (BB - np.sum(BW**2)))
 
         return lZ, dlZ
@@ -10,9 +10,9 @@ from __future__ import print_function
 import numpy as np
 import scipy.linalg as sla
 
-from mwhutils.linalg import chol_update
 from ._base import GP
 from ..likelihoods import Gaussian
+from ..utils.linalg import cholupdate, lanczos
 
 __all__ = ['ExactGP']
 
@@ -24,42 +24,195 @@ class ExactGP(GP):
     This class implements exact inference for GPs. Note that exact inference
     only works with regression so an exception will be thrown if the given
     likelihood is not Gaussian.
+
+    The gradient of the loglikelihood is accumulated over tiles of the kernel
+    gradients with `blocksize` rows, so beyond the inverse kernel matrix only
+    O(blocksize * n) memory is needed. When a lazy model updates its
+    statistics along with the gradient, as during optimization, the kernel is
+    also evaluated in tiles and factored in place. If `keepgrad` is True the
+    kernel gradients are then evaluated along with the kernel and kept, up to
+    the size of the kernel matrix, rather than evaluated again for the
+    gradient.
+
+    Without a rank `predict_var` solves against the cholesky, which costs
+    O(n^2) time per test point. Given a rank r < n it instead caches r
+    Lanczos vectors of the kernel matrix (LOVE), after which each test point
+    costs O(r n). A rank of at least n caches the dense inverse of the
+    cholesky, which takes O(n^2) memory and O(n^2) time per test point.
     """
-    def __init__(self, likelihood, kernel, mean):
+    def __init__(self, likelihood, kernel, mean, keepgrad=False):
         # NOTE: exact inference will only work with Gaussian likelihoods.
         if not isinstance(likelihood, Gaussian):
             raise ValueError('exact inference requires a Gaussian likelihood')
 
         super(ExactGP, self).__init__(likelihood, kernel, mean)
-        self._R = None
-        self._a = None
+        self._keepgrad = bool(keepgrad)
+
+        # like the data the cholesky R and the vector a are stored at the
+        # start of buffers whose capacity is doubled when full. R is stored in
+        # fortran order with its leading dimension equal to its size, so that
+        # it is contiguous and can be passed to LAPACK without a copy. the
+        # part of R below the diagonal is always zero.
+        self._Rbuf = None
+        self._abuf = None
+        self._k = 0
 
     @classmethod
     def from_gp(cls, gp):
-        newgp = cls(gp._likelihood.copy(), gp._kernel.copy(), gp._mean)
+        keepgrad = gp._keepgrad if isinstance(gp, ExactGP) else False
+        newgp = cls(gp._likelihood.copy(), gp._kernel.copy(), gp._mean,
+                    keepgrad)
+        newgp.blocksize = gp.blocksize
         if gp.ndata > 0:
             X, y = gp.data
             newgp.add_data(X, y)
         return newgp
 
     def reset(self):
-        for attr in 'Ra':
-            setattr(self, '_' + attr, None)
+        self._Rbuf = None
+        self._abuf = None
+        self._k = 0
         super(ExactGP, self).reset()
 
+    @property
+    def _R(self):
+        k = self._k
+        return None if (k == 0) else self._Rbuf[:k*k].reshape(k, k, order='F')
+
+    @property
+    def _a(self):
+        return None if (self._k == 0) else self._abuf[:self._k]
+
+    def _resize(self, n, keep=True):
+        """
+        Resize the statistics to hold `n` points, doubling the capacity of the
+        buffers if needed. If `keep` is True the leading block of R and a is
+        kept and any new entries are zeroed; otherwise their contents are
+        left undefined.
+        """
+        k = self._k
+        if self._Rbuf is None or n > len(self._abuf):
+            size = max(n, 2*k)
+            Rbuf = np.empty(size*size)
+            abuf = np.empty(size)
+            if keep and k > 0:
+                Rbuf[:k*k] = self._Rbuf[:k*k]
+                abuf[:k] = self._abuf[:k]
+            self._Rbuf = Rbuf
+            self._abuf = abuf
+
+        if keep:
+            # changing the leading dimension moves each column of R, so when
+            # growing R these are moved starting from the last column, and
+            # from the first when shrinking, so that no column is overwritten
+            # before it has been moved.
+            m = min(k, n)
+            cols = xrange(m-1, 0, -1) if (n > k) else xrange(1, m)
+            for j in cols:
+                self._Rbuf[j*n:j*n+m] = self._Rbuf[j*k:j*k+m]
+            self._k = n
+            self._R[m:, :] = 0
+            self._R[:, m:] = 0
+            self._abuf[m:n] = 0
+        else:
+            self._k = n
+
     def _update(self):
-        sn2 = self._likelihood.s2
-        K = self._kernel.get(self._X) + sn2 * np.eye(len(self._X))
+        self._resize(self.ndata, keep=False)
+        self._R[...] = self._kernel.get(self._distances())
+        self._factor()
+
+    def _updategrad(self):
+        # the kernel is evaluated over the same tiles of rows used by
+        # _loglikelihood and written directly into the upper triangle of R,
+        # which is all that cholesky reads. if keepgrad is set the gradient
+        # tiles are evaluated along with it and kept while they take no more
+        # memory than K; past that, or otherwise, they are recomputed by
+        # grad_contract.
+        n = self.ndata
+        self._resize(n, keep=False)
+        R = self._R
+        dK = [] if self._keepgrad else None
+        size = 0
+        dist = self._distances()
+        for b in self._blocks():
+            i = b.start
+            tile = dist.block(b, slice(i, None))
+            if dK is None:
+                R[b, i:] = self._kernel.get(tile)
+            else:
+                Kb, dKb = self._kernel.get_with_grad(tile)
+                R[b, i:] = Kb
+                size += dKb.size
+                dK.append(dKb if (size <= n*n) else None)
+        self._factor()
+        return self._loglikelihood(True, dK)
+
+    def _factor(self):
+        """
+        Compute the cholesky of `K + sn2 I` in place given the kernel matrix
+        `K` on the training inputs, of which only the upper triangle is used,
+        written into `R`. Also compute the vector `a`.
+        """
+        n = self.ndata
+        R = self._R
+        self._Rbuf[:n*n:n+1] += self._likelihood.s2
+        sla.cholesky(R, overwrite_a=True, check_finite=False)
         r = self._y - self._mean
-        self._R = sla.cholesky(K)
-        self._a = sla.solve_triangular(self._R, r, trans=True)
+        self._abuf[:n] = sla.solve_triangular(R, r, trans=True)
 
     def _updateinc(self, X, y):
         sn2 = self._likelihood.s2
         Kss = self._kernel.get(X) + sn2 * np.eye(len(X))
         Kxs = self._kernel.get(self._X, X)
         r = y - self._mean
-        self._R, self._a = chol_update(self._R, Kxs, Kss, self._a, r)
+
+        # the new columns of R are given by a solve against the old factor
+        # and the cholesky of the schur complement, both of which are written
+        # directly into the buffer.
+        B = sla.solve_triangular(self._R, Kxs, trans=True)
+        C = sla.cholesky(Kss - np.dot(B.T, B))
+        c = sla.solve_triangular(C, r - np.dot(B.T, self._a), trans=True)
+
+        i = self._k
+        self._resize(i + len(X))
+        self._R[:i, i:] = B
+        self._R[i:, i:] = C
+        self._abuf[i:self._k] = c
+
+    def _updatedel(self, idx):
+        # the rows/columns before the first removed point are unchanged. after
+        # that the kept rows of R form a triangular matrix T and the removed
+        # rows E, and the remaining factor is a rank-k update of T by E.
+        i = idx[0]
+        keep = np.ones(self.ndata, dtype=bool)
+        keep[idx] = False
+        tail = i + np.flatnonzero(keep[i:])
+
+        T = self._R[np.ix_(tail, tail)]
+        E = self._R[np.ix_(idx, tail)]
+        Rt = cholupdate(T, E)
+
+        # the kept part of the residual is unchanged, i.e. R^T a is the same
+        # for each kept column, which gives a triangular solve for the tail.
+        Kr = np.dot(T.T, self._a[tail]) + np.dot(E.T, self._a[idx])
+        at = sla.solve_triangular(Rt, Kr, trans=True)
+
+        # the head of R is unchanged, so shrink R in place and overwrite the
+        # tail.
+        B = self._R[:i, tail]
+        self._resize(i + len(tail))
+        self._R[:i, i:] = B
+        self._R[i:, i:] = Rt
+        self._abuf[i:self._k] = at
+
+    def _updatemean(self, mean0):
+        r = self._y - self._mean
+        self._a[:] = sla.solve_triangular(self._R, r, trans=True)
+
+    def _updatescale(self, c):
+        self._Rbuf[:self._k**2] *= np.sqrt(c)
+        self._abuf[:self._k] /= np.sqrt(c)
 
     def _full_posterior(self, X):
         # grab the prior mean and covariance.
@@ -115,7 +268,54 @@ class ExactGP(GP):
 
         return (mu, s2, dmu, ds2)
 
-    def loglikelihood(self, grad=False):
+    def _solve(self, B):
+        return sla.cho_solve((self._R, False), B)
+
+    def _predict_mean(self, X):
+        mu = np.full(X.shape[0], self._mean)
+        if self._X is not None:
+            # the predictive weights K^{-1} (y - mean), so each point only
+            # requires a row of the kernel.
+            if 'alpha' not in self._cache:
+                self._cache['alpha'] = sla.solve_triangular(self._R, self._a)
+            mu += np.dot(self._cache['alpha'], self._kernel.get(self._X, X))
+        return mu
+
+    def _predict_var(self, X, rank=None):
+        s2 = self._kernel.dget(X)
+        if self._X is None:
+            return s2
+
+        # the variance reduction is ||S k||^2 where S^T S approximates the
+        # inverse kernel matrix. with no rank S is the inverse cholesky and
+        # nothing is cached, so this is a triangular solve.
+        n = self.ndata
+        Kxs = self._kernel.get(self._X, X)
+        if rank is None:
+            SK = sla.solve_triangular(self._R, Kxs, trans=True)
+            return s2 - np.sum(SK**2, axis=0)
+
+        # with a rank of at least n the inverse cholesky is cached. otherwise
+        # following LOVE (Pleiss et al, 2018) Q T^-1 Q^T is given by Lanczos
+        # iterations on the kernel matrix started from the residual, and S =
+        # L^-1 Q^T for T = L L^T. this can only underestimate the inverse.
+        rank = min(int(rank), n)
+        key = ('S', rank)
+        if key not in self._cache:
+            R = self._R
+            if rank == n:
+                S = sla.solve_triangular(R, np.eye(n), trans=True)
+            else:
+                r = self._y - self._mean
+                r = r if np.any(r) else np.ones(n)
+                Q, T = lanczos(lambda v: np.dot(R.T, np.dot(R, v)), r, rank)
+                S = sla.solve_triangular(sla.cholesky(T), Q.T, trans=True)
+            self._cache[key] = S
+
+        SK = np.dot(self._cache[key], Kxs)
+        return s2 - np.sum(SK**2, axis=0)
+
+    def _loglikelihood(self, grad=False, dK=None):
         lZ = -0.5 * np.inner(self._a, self._a)
         lZ -= 0.5 * np.log(2 * np.pi) * self.ndata
         lZ -= np.sum(np.log(self._R.diagonal()))
@@ -124,18 +324,39 @@ class ExactGP(GP):
         if not grad:
             return lZ
 
-        # intermediate terms.
+        # intermediate terms. the inverse of the kernel matrix is formed from
+        # its cholesky by potri, which only fills the upper triangle.
         alpha = sla.solve_triangular(self._R, self._a, trans=False)
-        Q = sla.cho_solve((self._R, False), np.eye(self.ndata))
-        Q -= np.outer(alpha, alpha)
+        potri, = sla.get_lapack_funcs(('potri',), (self._R,))
+        Q, info = potri(self._R, lower=False)
+
+        if info != 0:
+            raise sla.LinAlgError('failed to invert the kernel matrix')
+
+        # the kernel gradients are contracted with Q - alpha alpha^T one tile
+        # of rows at a time, using the gradient tiles dK computed by
+        # _updategrad where given. by symmetry only the upper triangle is
+        # needed, with the off-diagonal terms counted twice.
+        g = np.zeros(self._kernel.nhyper)
+        dist = self._distances()
+        for k, b in enumerate(self._blocks()):
+            i, j = b.start, min(b.stop, self.ndata)
+            T = 2 * (Q[b, i:] - np.outer(alpha[b], alpha[i:]))
+            D = T[:, :j-i]
+            D[np.tril_indices(j-i, -1)] = 0
+            D[np.diag_indices(j-i)] /= 2
+            if dK is None or dK[k] is None:
+                tile = dist.block(b, slice(i, None))
+                g += self._kernel.grad_contract(T, tile)
+            else:
+                g += np.tensordot(dK[k], T, 2)
 
         dlZ = np.r_[
             # derivative wrt the likelihood's noise term.
-            -self._likelihood.s2 * np.trace(Q),
+            -self._likelihood.s2 * (np.trace(Q) - np.inner(alpha, alpha)),
 
             # derivative wrt each kernel hyperparameter.
-            [-0.5*np.sum(Q*dK)
-             for dK in self._kernel.grad(self._X)],
+            -0.5 * g,
 
             # derivative wrt the mean.
             np.sum(alpha)]
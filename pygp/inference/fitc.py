@@ -8,10 +8,10 @@ from __future__ import print_function
 
 import numpy as np
 import scipy.linalg as sla
-import itertools as it
 
 from ._base import GP
 from ..likelihoods import Gaussian
+from ..kernels._distances import Distances
 
 __all__ = ['FITC']
 
@@ -19,6 +19,10 @@ __all__ = ['FITC']
 class FITC(GP):
     """
     GP inference using sparse pseudo-inputs.
+
+    The kernel between the pseudo-inputs and the data, and its gradients,
+    are evaluated in tiles of `blocksize` data points, so beyond a tile only
+    O(p^2) memory is needed for p pseudo-inputs.
     """
     def __init__(self, likelihood, kernel, mean, U):
         # NOTE: exact FITC inference will only work with Gaussian likelihoods.
@@ -29,6 +33,7 @@ class FITC(GP):
 
         # save the pseudo-input locations.
         self._U = np.array(U, ndmin=2, dtype=float, copy=True)
+        self._Udist = Distances(self._U)
 
         # sufficient statistics that we'll need.
         self._L = None
@@ -36,12 +41,14 @@ class FITC(GP):
         self._b = None
 
         # these are useful in computing the loglikelihood and updating the
-        # sufficient statistics.
+        # sufficient statistics. the vector c is the derivative of -a wrt the
+        # mean, which lets us update the statistics when only the mean changes.
         self._A = None
         self._a = None
+        self._c = None
 
     def reset(self):
-        for attr in 'LRbAa':
+        for attr in 'LRbAac':
             setattr(self, '_' + attr, None)
         super(FITC, self).reset()
 
@@ -50,6 +57,11 @@ class FITC(GP):
         """The pseudo-input points."""
         return self._U
 
+    def _distances(self):
+        if self._dist is None:
+            self._dist = Distances(self._U, self._X)
+        return self._dist
+
     @classmethod
     def from_gp(cls, gp, U=None):
         if U is None:
@@ -58,6 +70,7 @@ class FITC(GP):
             else:
                 raise ValueError('gp has no pseudoinputs and none are given')
         newgp = cls(gp._likelihood.copy(), gp._kernel.copy(), gp._mean, U)
+        newgp.blocksize = gp.blocksize
         if gp.ndata > 0:
             X, y = gp.data
             newgp.add_data(X, y)
@@ -68,17 +81,39 @@ class FITC(GP):
         su2 = sn2 / 1e6
 
         # kernel wrt the inducing points.
-        Kuu = self._kernel.get(self._U)
+        Kuu = self._kernel.get(self._Udist)
         p = self._U.shape[0]
 
         # cholesky for the information gain. note that we only need to compute
         # this once as it is independent from the data.
         self._L = sla.cholesky(Kuu + su2*np.eye(p))
 
+        # the statistics are accumulated over the data, so initialize them as
+        # if there was no data and add each tile of data points.
+        self._A = np.eye(p)
+        self._a = np.zeros(p)
+        self._c = np.zeros(p)
+        dist = self._distances()
+        for b in self._blocks():
+            self._accumulate(self._kernel.get(dist.block(slice(None), b)),
+                             self._X[b], self._y[b])
+
+    def _updateinc(self, X, y):
+        # L only depends on the inducing points so we only need to accumulate
+        # the statistics for the new data.
+        self._accumulate(self._kernel.get(self._U, X), X, y)
+
+    def _accumulate(self, Kux, X, y):
+        """
+        Add the contribution of data `X` and `y` to the statistics `A`, `a`,
+        and `c`, where `Kux` is the kernel between the inducing points and `X`,
+        and then update the posterior factors `R` and `b`.
+        """
+        sn2 = self._likelihood.s2
+
         # evaluate the kernel and residuals at the new points
-        Kux = self._kernel.get(self._U, self._X)
-        kxx = self._kernel.dget(self._X)
-        r = self._y - self._mean
+        kxx = self._kernel.dget(X)
+        r = y - self._mean
 
         # the cholesky of Q.
         V = sla.solve_triangular(self._L, Kux, trans=True)
@@ -89,16 +124,27 @@ class FITC(GP):
         V /= ell
         r /= ell
 
-        # NOTE: to update things incrementally all we need to do is store these
-        # components. A just needs to be initialized at the identity and then
-        # we just accumulate here.
-        self._A = np.eye(p) + np.dot(V, V.T)
-        self._a = np.dot(Kux, r)
+        # NOTE: A is initialized at the identity so we just accumulate here;
+        # this is a rank-k update where k is the number of new points.
+        self._A += np.dot(V, V.T)
+        self._a += np.dot(Kux, r)
+        self._c += np.dot(Kux, 1/ell)
 
         # update the posterior.
         self._R = np.dot(sla.cholesky(self._A), self._L)
         self._b = sla.solve_triangular(self._R, self._a, trans=True)
 
+    def _updatemean(self, mean0):
+        self._a -= (self._mean - mean0) * self._c
+        self._b = sla.solve_triangular(self._R, self._a, trans=True)
+
+    def _updatescale(self, c):
+        # scaling both the kernel and noise by c leaves A, a, and c unchanged
+        # so only the choleskys and b need to be rescaled.
+        self._L *= np.sqrt(c)
+        self._R *= np.sqrt(c)
+        self._b /= np.sqrt(c)
+
     def _full_posterior(self, X):
         mu = np.full(X.shape[0], self._mean)
         Sigma = self._kernel.get(X)
@@ -164,69 +210,108 @@ class FITC(GP):
 
         return (mu, s2, dmu, ds2)
 
-    def loglikelihood(self, grad=False):
+    def _predict_mean(self, X):
+        mu = np.full(X.shape[0], self._mean)
+        if self._X is not None:
+            if 'w' not in self._cache:
+                self._cache['w'] = sla.solve_triangular(self._R, self._b)
+            mu += np.dot(self._cache['w'], self._kernel.get(self._U, X))
+        return mu
+
+    def _predict_var(self, X, rank=None):
+        s2 = self._kernel.dget(X)
+        if self._X is not None:
+            # the variance is k(x,x) - k^T M k with M = Kuu^{-1} - A^{-1},
+            # where the inverses are given by the stored choleskys.
+            if 'M' not in self._cache:
+                I = np.eye(self._U.shape[0])
+                self._cache['M'] = (sla.cho_solve((self._L, False), I) -
+                                    sla.cho_solve((self._R, False), I))
+            K = self._kernel.get(self._U, X)
+            s2 -= np.sum(K * np.dot(self._cache['M'], K), axis=0)
+        return s2
+
+    def _loglikelihood(self, grad=False):
         # noise hyperparameters
         sn2 = self._likelihood.s2
         su2 = sn2 / 1e6
+        p = self._U.shape[0]
 
-        # get the rest of the kernels and the residual.
-        Kux = self._kernel.get(self._U, self._X)
-        kxx = self._kernel.dget(self._X)
-        r = self._y - self._mean
-
-        # the cholesky of Q.
-        V = sla.solve_triangular(self._L, Kux, trans=True)
-
-        # rescale everything by the diagonal matrix ell.
-        ell = np.sqrt(kxx + sn2 - np.sum(V**2, axis=0))
-        V /= ell
-        r /= ell
-
-        # Note this A corresponds to chol(A) from _update.
+        # Note this A corresponds to chol(A) from _update. the products of the
+        # rescaled cholesky of Q, V, with the residual and with itself are
+        # given by the statistics a and A, so beta and gamma = A^-1 beta are
+        # available without a pass over the data.
         A = sla.cholesky(self._A)
-        beta = sla.solve_triangular(A, V.dot(r), trans=True)
-        alpha = (r - V.T.dot(sla.solve_triangular(A, beta))) / ell
-
-        lZ = -np.sum(np.log(np.diag(A))) - np.sum(np.log(ell))
-        lZ -= 0.5 * (np.inner(r, r) - np.inner(beta, beta))
-        lZ -= 0.5 * ell.shape[0] * np.log(2*np.pi)
+        Vr = sla.solve_triangular(self._L, self._a, trans=True)
+        beta = sla.solve_triangular(A, Vr, trans=True)
+        gamma = sla.solve_triangular(A, beta)
+
+        lZ = -np.sum(np.log(np.diag(A))) + 0.5 * np.inner(beta, beta)
+        lZ -= 0.5 * self.ndata * np.log(2*np.pi)
+
+        if grad:
+            # the same holds for B W^T and w = B alpha, which are needed by
+            # every tile.
+            VV = self._A - np.eye(p)
+            BW = sla.solve_triangular(
+                self._L, sla.solve_triangular(A, VV, trans=True).T)
+            w = sla.solve_triangular(self._L, Vr - np.dot(VV, gamma))
+
+            # allocate space for the gradients.
+            dlZ = np.zeros(self.nhyper)
+            GB = np.zeros((p, p))
+
+        # the remaining terms are accumulated over tiles of data points, so
+        # that beyond the tile only O(p^2) memory is needed.
+        dist = self._distances()
+        for b in self._blocks():
+            tile = dist.block(slice(None), b)
+            X = self._X[b]
+
+            # the cholesky of Q, and everything rescaled by ell.
+            B = sla.solve_triangular(self._L, self._kernel.get(tile),
+                                     trans=True)
+            ell = np.sqrt(self._kernel.dget(X) + sn2 - np.sum(B**2, axis=0))
+            r = (self._y[b] - self._mean) / ell
+
+            lZ -= np.sum(np.log(ell)) + 0.5 * np.inner(r, r)
+
+            if not grad:
+                continue
+
+            V = B / ell
+            B = sla.solve_triangular(self._L, B)
+            W = sla.solve_triangular(A, V/ell, trans=True)
+            alpha = (r - np.dot(V.T, gamma)) / ell
+            v = 2*su2*np.sum(B**2, axis=0)
+            z = alpha**2 + np.sum(W**2, axis=0)
+
+            # gradient wrt the noise parameter.
+            dlZ[0] += (
+                - sn2 * (np.sum(1/ell**2) - np.sum(W**2) -
+                         np.inner(alpha, alpha))
+                + 0.5 * (np.inner(alpha, v*alpha) +
+                         np.inner(np.sum(W**2, axis=0), v)))
+
+            # gradient wrt the kernel hyperparameters. with M = 2 dKux - dKuu
+            # B and v = dkxx - sum(M*B, axis=0) every term is linear in the
+            # kernel gradients, so this reduces to contracting dKux and dKuu
+            # with fixed matrices and the diagonal gradients with z.
+            G = np.dot(BW, W) - B * z
+            GB += np.dot(G, B.T)
+            dlZ[1:-1] += 0.5 * np.array([np.dot(dkxx, z - 1/ell**2)
+                                         for dkxx in self._kernel.dgrad(X)])
+            dlZ[1:-1] += self._kernel.grad_contract(np.outer(w, alpha) + G,
+                                                    tile)
+
+            # gradient wrt the constant mean.
+            dlZ[-1] += np.sum(alpha)
 
         if not grad:
             return lZ
 
-        B = sla.solve_triangular(self._L, V*ell)
-        W = sla.solve_triangular(A, V/ell, trans=True)
-        w = B.dot(alpha)
-        v = 2*su2*np.sum(B**2, axis=0)
-
-        # allocate space for the gradients.
-        dlZ = np.zeros(self.nhyper)
-
-        # gradient wrt the noise parameter.
-        dlZ[0] = (
-            - sn2 * (np.sum(1/ell**2) - np.sum(W**2) - np.inner(alpha, alpha))
-            - su2 * (np.sum(w**2) + np.sum(B.dot(W.T)**2))
-            + 0.5 * (
-                np.inner(alpha, v*alpha) + np.inner(np.sum(W**2, axis=0), v)))
-
-        # iterator over gradients of the kernels
-        dK = it.izip(
-            self._kernel.grad(self._U),
-            self._kernel.grad(self._U, self._X),
-            self._kernel.dgrad(self._X))
-
-        # gradient wrt the kernel hyperparameters.
-        i = 1
-        for i, (dKuu, dKux, dkxx) in enumerate(dK, i):
-            M = 2*dKux - dKuu.dot(B)
-            v = dkxx - np.sum(M*B, axis=0)
-            dlZ[i] = (
-                - np.sum(dkxx/ell**2)
-                - np.inner(w, dKuu.dot(w) - 2*dKux.dot(alpha))
-                + np.inner(alpha, v*alpha) + np.inner(np.sum(W**2, axis=0), v)
-                + np.sum(M.dot(W.T) * B.dot(W.T))) / 2.0
-
-        # gradient wrt the constant mean.
-        dlZ[-1] = np.sum(alpha)
+        dlZ[0] -= su2 * (np.sum(w**2) + np.sum(BW**2))
+        dlZ[1:-1] -= 0.5 * self._kernel.grad_contract(np.outer(w, w) + GB,
+                                                      self._Udist)
 
         return lZ, dlZ
@@ -0,0 +1,558 @@
+"""
+Exact GP inference for one-dimensional inputs using the state-space form of
+Matern kernels, where the posterior can be found by Kalman filtering and
+smoothing.
+"""
+
+from __future__ import division
+from __future__ import absolute_import
+from __future__ import print_function
+
+import numpy as np
+import scipy.special as ss
+
+from ._base import GP
+from ..likelihoods import Gaussian
+from ..kernels import Matern
+from ..kernels._real import SumKernel
+
+__all__ = ['KalmanGP']
+
+
+### STATE-SPACE FORMS #########################################################
+
+def _matern(kernel):
+    """
+    Return the state-space form of a 1-D Matern kernel with `s = (d+1)/2`
+    states, i.e. the rate `lam` (repeated for each state), the feedback
+    matrix `F` of the SDE and its stationary covariance `Pinf`, along with the
+    derivatives of each with respect to the log signal amplitude and the log
+    lengthscale.
+    """
+    sf2 = np.exp(kernel._logsf*2)
+    ell = np.exp(np.ravel(kernel._logell)[0])
+    s = (kernel._d + 1) // 2
+    lam = np.sqrt(kernel._d) / ell
+
+    # F is the companion matrix of the polynomial (x + lam)^s.
+    k = np.arange(s)
+    c = ss.binom(s, k)
+    F = np.eye(s, k=1)
+    F[-1] = -c * lam**(s-k)
+    dF = np.zeros((s, s))
+    dF[-1] = -c * (s-k) * lam**(s-k-1)
+
+    # the stationary covariance (and its derivative wrt lam) over the
+    # function and its derivatives, divided by sf2.
+    if s == 1:
+        P = np.ones((1, 1))
+        dP = np.zeros((1, 1))
+    elif s == 2:
+        P = np.diag([1, lam**2])
+        dP = np.diag([0, 2*lam])
+    else:
+        P = np.array([[1, 0, -lam**2/3],
+                      [0, lam**2/3, 0],
+                      [-lam**2/3, 0, lam**4]])
+        dP = np.array([[0, 0, -2*lam/3],
+                       [0, 2*lam/3, 0],
+                       [-2*lam/3, 0, 4*lam**3]])
+
+    # since dlam/dlogell = -lam the derivatives wrt logell pick up a factor
+    # of -lam; only Pinf depends on sf.
+    dlam = np.array([np.zeros(s), np.full(s, -lam)])
+    dF = np.array([np.zeros((s, s)), -lam * dF])
+    dPinf = np.array([2 * sf2 * P, -lam * sf2 * dP])
+
+    return np.full(s, lam), F, sf2 * P, dlam, dF, dPinf
+
+
+def _statespace(kernel):
+    """
+    Return the state-space form of a 1-D Matern kernel or a sum of them. The
+    forms given by `_matern` for each part are concatenated into a single
+    block-diagonal model, along with the vector `H` which sums the first
+    state (i.e. the function value) of each block.
+    """
+    parts = kernel._parts if isinstance(kernel, SumKernel) else [kernel]
+    if not all(isinstance(p, Matern) and p.ndim == 1 for p in parts):
+        raise ValueError('Kalman inference requires a 1-D Matern kernel or '
+                         'a sum of such kernels')
+
+    forms = [_matern(p) for p in parts]
+    S = sum(len(f[0]) for f in forms)
+    nk = 2 * len(forms)
+
+    lam = np.zeros(S)
+    F = np.zeros((S, S))
+    Pinf = np.zeros((S, S))
+    H = np.zeros(S)
+    dlam = np.zeros((nk, S))
+    dF = np.zeros((nk, S, S))
+    dPinf = np.zeros((nk, S, S))
+
+    a = 0
+    for i, (l, f, p, dl, df, dp) in enumerate(forms):
+        b = a + len(l)
+        h = slice(2*i, 2*i+2)
+        lam[a:b] = l
+        F[a:b, a:b] = f
+        Pinf[a:b, a:b] = p
+        H[a] = 1
+        dlam[h, a:b] = dl
+        dF[h, a:b, a:b] = df
+        dPinf[h, a:b, a:b] = dp
+        a = b
+
+    return lam, F, Pinf, H, dlam, dF, dPinf
+
+
+def _transition(form, dt, grad=False):
+    """
+    Return the transition matrices `A = expm(F dt)` and the process noise
+    covariances `Q = Pinf - A Pinf A^T` for each step in the vector `dt`. If
+    `grad` is True also return their derivatives wrt each kernel
+    hyperparameter.
+
+    Each block of `F` has the single eigenvalue `-lam`, so `N = F + lam I` is
+    nilpotent and the exponential is the finite sum
+    `A = exp(-lam dt) sum_k (N dt)^k / k!`.
+    """
+    lam, F, Pinf, _, dlam, dF, dPinf = form
+    S = len(lam)
+    N = F + np.diag(lam)
+    E = np.exp(-np.outer(dt, lam))
+
+    # the powers N^k and coefficients dt^k / k! for k < S; any further terms
+    # are zero.
+    Nk = [np.eye(S)]
+    ck = [np.ones_like(dt)]
+    for k in xrange(1, S):
+        Nk.append(np.dot(Nk[-1], N))
+        ck.append(ck[-1] * dt / k)
+
+    A = E[:, :, None] * sum(c[:, None, None] * M for c, M in zip(ck, Nk))
+    At = A.swapaxes(1, 2)
+    Q = Pinf - np.matmul(np.matmul(A, Pinf), At)
+
+    if not grad:
+        return A, Q
+
+    # derivatives of the powers of N, using d(N^k) = d(N^{k-1}) N + N^{k-1} dN.
+    dN = dF + dlam[:, :, None] * np.eye(S)
+    dNk = [np.zeros_like(dN)]
+    for k in xrange(1, S):
+        dNk.append(np.matmul(dNk[-1], N) + np.matmul(Nk[k-1], dN))
+
+    dA = (-(dlam[:, None, :] * dt[None, :, None])[..., None] * A +
+          E[None, :, :, None] * sum(c[None, :, None, None] * dM[:, None]
+                                    for c, dM in zip(ck, dNk)))
+
+    D = np.matmul(np.matmul(dA, Pinf), At[None])
+    dQ = (dPinf[:, None] - D - D.swapaxes(2, 3) -
+          np.matmul(np.matmul(A[None], dPinf[:, None]), At[None]))
+
+    return A, Q, dA, dQ
+
+
+### FILTERING AND SMOOTHING ###################################################
+
+def _kalman(A, Q, idx, H, sn2, r, m, P):
+    """
+    Run the Kalman filter over the residuals `r` starting from the filtered
+    mean `m` and covariance `P` at the previous input, where the step into
+    the `i`th input uses the transition `A[idx[i]]` and noise `Q[idx[i]]`. Any
+    residual that is NaN is treated as unobserved.
+
+    Return the predicted and filtered means and covariances at each input,
+    along with the sum of the log innovation variances and the sum of the
+    squared innovations divided by their variances.
+    """
+    n, S = len(r), len(H)
+    mp = np.empty((n, S))
+    Pp = np.empty((n, S, S))
+    mf = np.empty((n, S))
+    Pf = np.empty((n, S, S))
+    logdet = 0.0
+    quad = 0.0
+
+    for i in xrange(n):
+        a = A[idx[i]]
+        m = np.dot(a, m)
+        P = np.dot(np.dot(a, P), a.T) + Q[idx[i]]
+        mp[i] = m
+        Pp[i] = P
+
+        if not np.isnan(r[i]):
+            PH = np.dot(P, H)
+            s = np.dot(H, PH) + sn2
+            v = r[i] - np.dot(H, m)
+            m = m + PH * (v / s)
+            P = P - np.outer(PH, PH) / s
+            logdet += np.log(s)
+            quad += v * v / s
+
+        mf[i] = m
+        Pf[i] = P
+
+    return mp, Pp, mf, Pf, logdet, quad
+
+
+def _kalman_grad(A, Q, dA, dQ, idx, H, sn2, dR, dr, r, Pinf, dPinf):
+    """
+    Return the gradient of the loglikelihood computed by the Kalman filter
+    started from the stationary distribution, by propagating the derivatives
+    of the filtered means and covariances. Here `dA`, `dQ` and `dPinf` give
+    the derivatives of the state-space model wrt each hyperparameter, and
+    `dR` and `dr` the derivatives of the noise variance and residuals.
+    """
+    S = len(H)
+    m = np.zeros(S)
+    P = Pinf
+    dm = np.zeros((len(dR), S))
+    dP = dPinf
+    dlZ = np.zeros(len(dR))
+
+    for i in xrange(len(r)):
+        a = A[idx[i]]
+        da = dA[:, idx[i]]
+
+        # predict.
+        D = np.matmul(np.matmul(da, P), a.T)
+        dP = (D + D.swapaxes(1, 2) + np.matmul(np.matmul(a, dP), a.T) +
+              dQ[:, idx[i]])
+        dm = np.dot(da, m) + np.dot(dm, a.T)
+        P = np.dot(np.dot(a, P), a.T) + Q[idx[i]]
+        m = np.dot(a, m)
+
+        # the innovation and its contribution to the gradient.
+        PH = np.dot(P, H)
+        dPH = np.dot(dP, H)
+        s = np.dot(H, PH) + sn2
+        ds = np.dot(dPH, H) + dR
+        v = r[i] - np.dot(H, m)
+        dv = dr - np.dot(dm, H)
+        dlZ -= 0.5 * (ds/s + 2*v*dv/s - v*v*ds/s**2)
+
+        # update.
+        k = PH / s
+        dk = dPH / s - np.outer(ds, k) / s
+        dm = dm + dk * v + np.outer(dv, k)
+        dP = dP - (ds[:, None, None] * np.outer(k, k) +
+                   s * (dk[:, :, None] * k[None, None, :] +
+                        k[None, :, None] * dk[:, None, :]))
+        m = m + k * v
+        P = P - s * np.outer(k, k)
+
+    return dlZ
+
+
+def _rts(A, idx, mp, Pp, mf, Pf, gains=False):
+    """
+    Run the Rauch-Tung-Striebel smoother given the output of `_kalman`,
+    returning the smoothed means and covariances. If `gains` is True also
+    return the smoother gains `G[i]` such that the cross-covariance between
+    the states at inputs `i` and `i+1` is `G[i] Ps[i+1]`.
+    """
+    n, S = mf.shape
+    ms = mf.copy()
+    Ps = Pf.copy()
+    G = np.zeros((max(n-1, 0), S, S))
+
+    for i in xrange(n-2, -1, -1):
+        g = np.linalg.solve(Pp[i+1], np.dot(A[idx[i+1]], Pf[i])).T
+        ms[i] += np.dot(g, ms[i+1] - mp[i+1])
+        Ps[i] += np.dot(np.dot(g, Ps[i+1] - Pp[i+1]), g.T)
+        G[i] = g
+
+    return (ms, Ps, G) if gains else (ms, Ps)
+
+
+### INFERENCE #################################################################
+
+class KalmanGP(GP):
+    """
+    Exact GP inference for 1-D inputs by Kalman filtering and smoothing.
+
+    Matern kernels with d in {1, 3, 5}, and sums of these, are the covariance
+    functions of linear time-invariant SDEs whose state holds the function
+    and its first (d-1)/2 derivatives. After sorting the inputs, conditioning
+    on the data is done by a Kalman filter and the posterior found by a
+    Rauch-Tung-Striebel smoother, each in O(n) time and memory. The gradient
+    of the loglikelihood is found by propagating the derivatives of the
+    filtered statistics.
+
+    If new data lies after all of the current inputs `add_data` continues
+    the filter from its last state, at O(1) cost per point. The smoother is
+    only run once the posterior is needed before the last input.
+    """
+    def __init__(self, likelihood, kernel, mean):
+        # NOTE: exact inference will only work with Gaussian likelihoods.
+        if not isinstance(likelihood, Gaussian):
+            raise ValueError('exact inference requires a Gaussian likelihood')
+
+        super(KalmanGP, self).__init__(likelihood, kernel, mean)
+
+        # the state-space form of the kernel; see _statespace.
+        self._form = _statespace(kernel)
+
+        # the sorted inputs and the predicted and filtered means/covariances
+        # at each are stored in the leading block of buffers whose capacity
+        # is doubled when full, as with the data.
+        self._bufs = None
+        self._k = 0
+
+        # the terms making up the loglikelihood, and the smoothed means and
+        # covariances which are None if they are out of date.
+        self._logdet = 0.0
+        self._quad = 0.0
+        self._ms = None
+        self._Ps = None
+
+    @classmethod
+    def from_gp(cls, gp):
+        newgp = cls(gp._likelihood.copy(), gp._kernel.copy(), gp._mean)
+        if gp.ndata > 0:
+            X, y = gp.data
+            newgp.add_data(X, y)
+        return newgp
+
+    def reset(self):
+        self._bufs = None
+        self._k = 0
+        self._logdet = 0.0
+        self._quad = 0.0
+        self._ms = None
+        self._Ps = None
+        super(KalmanGP, self).reset()
+
+    @property
+    def _stats(self):
+        """The sorted inputs and predicted/filtered means and covariances."""
+        return [buf[:self._k] for buf in self._bufs]
+
+    def _reserve(self, n):
+        """
+        Make sure the buffers can hold statistics for `n` points, doubling
+        their capacity if not.
+        """
+        if self._bufs is None or n > len(self._bufs[0]):
+            S = len(self._form[0])
+            size = max(n, 2*self._k)
+            bufs = [np.empty(size),
+                    np.empty((size, S)), np.empty((size, S, S)),
+                    np.empty((size, S)), np.empty((size, S, S))]
+            if self._k > 0:
+                for buf, stat in zip(bufs, self._stats):
+                    buf[:self._k] = stat
+            self._bufs = bufs
+
+    def _sorted(self):
+        """Return the sorted inputs and the corresponding residuals."""
+        order = np.argsort(self._X[:, 0], kind='mergesort')
+        return self._X[order, 0], self._y[order] - self._mean
+
+    def _extend(self, t, r):
+        """
+        Continue the filter from the last input (or the prior if there is
+        none) given sorted inputs `t` and residuals `r` which follow it.
+        """
+        _, _, Pinf, H = self._form[:4]
+        if self._k == 0:
+            t0, m, P = t[0], np.zeros(len(H)), Pinf
+        else:
+            t0, _, _, m, P = [stat[-1] for stat in self._stats]
+
+        dt, idx = np.unique(np.diff(np.r_[t0, t]), return_inverse=True)
+        A, Q = _transition(self._form, dt)
+        out = _kalman(A, Q, idx, H, self._likelihood.s2, r, m, P)
+
+        i, j = self._k, self._k + len(t)
+        self._reserve(j)
+        self._bufs[0][i:j] = t
+        for buf, stat in zip(self._bufs[1:], out[:4]):
+            buf[i:j] = stat
+
+        self._k = j
+        self._logdet += out[4]
+        self._quad += out[5]
+        self._ms = None
+        self._Ps = None
+
+    def _smooth(self):
+        """Run the smoother if the smoothed statistics are out of date."""
+        if self._ms is None:
+            t, mp, Pp, mf, Pf = self._stats
+            dt, idx = np.unique(np.diff(np.r_[t[0], t]), return_inverse=True)
+            A, _ = _transition(self._form, dt)
+            self._ms, self._Ps = _rts(A, idx, mp, Pp, mf, Pf)
+
+    def _update(self):
+        self._form = _statespace(self._kernel)
+        self._k = 0
+        self._logdet = 0.0
+        self._quad = 0.0
+        self._extend(*self._sorted())
+
+    def _updateinc(self, X, y):
+        # we can only continue the filter if the new data follows the old.
+        x = X[:, 0]
+        if np.min(x) < self._stats[0][-1]:
+            raise NotImplementedError
+
+        order = np.argsort(x, kind='mergesort')
+        self._extend(x[order], y[order] - self._mean)
+
+    def _updatescale(self, c):
+        # the gains, and hence the means, are unchanged and every covariance
+        # (including the innovation variances) is scaled by c.
+        self._form = _statespace(self._kernel)
+        self._bufs[2][:self._k] *= c
+        self._bufs[4][:self._k] *= c
+        if self._Ps is not None:
+            self._Ps *= c
+        self._logdet += self._k * np.log(c)
+        self._quad /= c
+
+    def _full_posterior(self, X):
+        # grab the prior mean and covariance.
+        mu = np.full(X.shape[0], self._mean)
+        Sigma = self._kernel.get(X)
+
+        if self._X is None:
+            return mu, Sigma
+
+        # insert the test points into the sorted data as unobserved inputs
+        # and filter/smooth over the merged sequence.
+        _, _, Pinf, H = self._form[:4]
+        n = self.ndata
+        t, r = self._sorted()
+        order = np.argsort(np.r_[t, X[:, 0]], kind='mergesort')
+        t = np.r_[t, X[:, 0]][order]
+        r = np.r_[r, np.full(len(X), np.nan)][order]
+
+        dt, idx = np.unique(np.diff(np.r_[t[0], t]), return_inverse=True)
+        A, Q = _transition(self._form, dt)
+        out = _kalman(A, Q, idx, H, self._likelihood.s2, r,
+                      np.zeros(len(H)), Pinf)
+        ms, Ps, G = _rts(A, idx, *out[:4], gains=True)
+
+        # the covariance between states at test points a < b is the product
+        # of the gains between them times the smoothed covariance at b. going
+        # backwards, Z holds the covariances between the current state and
+        # each later test point (times H) and R the product of the gains
+        # since the last test point.
+        Z = np.zeros((len(H), len(X)))
+        R = np.eye(len(H))
+        Sigma = np.zeros_like(Sigma)
+        for i in xrange(len(t)-1, -1, -1):
+            if i < len(t)-1:
+                R = np.dot(G[i], R)
+            if order[i] >= n:
+                a = order[i] - n
+                Z = np.dot(R, Z)
+                Z[:, a] = np.dot(Ps[i], H)
+                Sigma[a] = np.dot(H, Z)
+                mu[a] += np.dot(H, ms[i])
+                R = np.eye(len(H))
+
+        Sigma += Sigma.T - np.diag(Sigma.diagonal())
+
+        return mu, Sigma
+
+    def _marg_posterior(self, X, grad=False):
+        # grab the prior mean and variance.
+        mu = np.full(X.shape[0], self._mean)
+        s2 = self._kernel.dget(X)
+
+        if self._X is None:
+            if not grad:
+                return (mu, s2)
+            return (mu, s2, np.zeros_like(X), np.zeros_like(X))
+
+        _, F, Pinf, H = self._form[:4]
+        t, mp, Pp, mf, Pf = self._stats
+        x = X[:, 0]
+        S = len(H)
+
+        # predict the state at each test point from the filtered state at the
+        # last input at or before it, or from the prior if there is none.
+        k = np.searchsorted(t, x, side='right') - 1
+        prior = (k < 0)
+        kk = np.maximum(k, 0)
+        m0 = np.where(prior[:, None], 0, mf[kk])
+        P0 = np.where(prior[:, None, None], Pinf, Pf[kk])
+        A, Q = _transition(self._form, np.where(prior, 0, x - t[kk]))
+        m = np.einsum('nij,nj->ni', A, m0)
+        P = np.matmul(np.matmul(A, P0), A.swapaxes(1, 2)) + Q
+
+        # for points before the last input condition on the smoothed state at
+        # the next input j. with A2 the transition from x to input j and S the
+        # prediction of its covariance, the smoothed mean and covariance are
+        # m + B v and P + B W B^T where B = P A2^T and v, W only depend on j.
+        A2 = np.tile(np.eye(S), (len(x), 1, 1))
+        B = np.zeros_like(P)
+        v = np.zeros_like(m)
+        W = np.zeros_like(P)
+
+        inner = (k+1 < len(t))
+        if np.any(inner):
+            self._smooth()
+            j = k[inner] + 1
+            Si = np.linalg.inv(Pp[j])
+            A2[inner] = _transition(self._form, t[j] - x[inner])[0]
+            B[inner] = np.matmul(P[inner], A2[inner].swapaxes(1, 2))
+            v[inner] = np.einsum('nij,nj->ni', Si, self._ms[j] - mp[j])
+            W[inner] = np.matmul(np.matmul(Si, self._Ps[j] - Pp[j]), Si)
+
+        BW = np.matmul(B, W)
+        mu += np.dot(m + np.einsum('nij,nj->ni', B, v), H)
+        s2 = np.einsum('i,nij,j->n', H,
+                       P + np.matmul(BW, B.swapaxes(1, 2)), H)
+
+        if not grad:
+            return (mu, s2)
+
+        # since dA/dx = F A the predicted statistics have derivatives F m and
+        # F (P - Pinf) + (P - Pinf) F^T, and A2 has derivative -A2 F.
+        dP = np.matmul(F, P - Pinf)
+        dP += dP.swapaxes(1, 2)
+        dB = np.matmul(dP, A2.swapaxes(1, 2)) - np.matmul(B, F.T)
+        dm = np.dot(m, F.T) + np.einsum('nij,nj->ni', dB, v)
+        dBWB = np.matmul(np.matmul(dB, W), B.swapaxes(1, 2))
+        dP += dBWB + dBWB.swapaxes(1, 2)
+
+        dmu = np.dot(dm, H)[:, None]
+        ds2 = np.einsum('i,nij,j->n', H, dP, H)[:, None]
+
+        return (mu, s2, dmu, ds2)
+
+    def _loglikelihood(self, grad=False):
+        lZ = -0.5 * (self._logdet + self._quad +
+                     np.log(2 * np.pi) * self.ndata)
+
+        if not grad:
+            return lZ
+
+        _, _, Pinf, H, _, _, dPinf = self._form
+        sn2 = self._likelihood.s2
+        t, r = self._sorted()
+        dt, idx = np.unique(np.diff(np.r_[t[0], t]), return_inverse=True)
+        A, Q, dA_, dQ_ = _transition(self._form, dt, grad=True)
+
+        # pad the derivatives of the model wrt the kernel hyperparameters with
+        # those wrt the noise, which enters through the innovation variance,
+        # and the mean, which enters through the residuals.
+        nh = self.nhyper
+        dA = np.zeros((nh,) + A.shape)
+        dQ = np.zeros((nh,) + Q.shape)
+        dP0 = np.zeros((nh,) + Pinf.shape)
+        dA[1:-1] = dA_
+        dQ[1:-1] = dQ_
+        dP0[1:-1] = dPinf
+        dR = np.r_[2*sn2, np.zeros(nh-1)]
+        dr = np.r_[np.zeros(nh-1), -1]
+
+        dlZ = _kalman_grad(A, Q, dA, dQ, idx, H, sn2, dR, dr, r, Pinf, dP0)
+
+        return lZ, dlZ
@@ -0,0 +1,310 @@
+"""
+Exact GP inference for inputs on a Cartesian grid, where the kernel matrix of
+a kernel which factorizes over the input dimensions is a Kronecker product.
+"""
+
+from __future__ import division
+from __future__ import absolute_import
+from __future__ import print_function
+
+import numpy as np
+import scipy.linalg as sla
+import functools as ft
+
+from ._iterative import IterativeGP
+from ..kernels import SE
+from ..kernels._real import ProductKernel
+from ..utils.linalg import kron_mvm
+
+__all__ = ['KroneckerGP']
+
+
+def _separable(kernel):
+    """Return whether `kernel` is a product of kernels on each dimension."""
+    if kernel.ndim == 1 or isinstance(kernel, SE):
+        return True
+    if isinstance(kernel, ProductKernel):
+        return all(_separable(p) for p in kernel._parts)
+    return False
+
+
+def _nearest(g, x):
+    """Return the index of the nearest point of the sorted axis `g` to `x`."""
+    if len(g) == 1:
+        return np.zeros(len(x), dtype=int)
+    i = np.clip(np.searchsorted(g, x), 1, len(g)-1)
+    return i - ((x - g[i-1]) < (g[i] - x))
+
+
+def _contract(T, vecs):
+    """
+    Given an (n_1,...,n_D)-array `T` and a list of (m,n_i)-arrays `vecs`
+    return the m-vector with entries `sum T[i_1,...,i_D] prod_k v_k[j,i_k]`.
+    """
+    R = np.tensordot(vecs[0], T, (1, 0))
+    for v in vecs[1:]:
+        R = np.einsum('ij...,ij->i...', R, v)
+    return R
+
+
+class KroneckerGP(IterativeGP):
+    """
+    Exact GP inference for inputs on a Cartesian grid.
+
+    This assumes a kernel which is a product of kernels on each input
+    dimension, e.g. an `SE` kernel or a product of such kernels, so that on a
+    grid the kernel matrix is the Kronecker product of one factor per axis.
+    The axes are given by `grid`, a list of the coordinates along each
+    dimension, or are otherwise taken to be the unique values of the data. If
+    every grid point is observed exactly once each factor is eigendecomposed
+    separately, which gives the loglikelihood, its gradient and the posterior
+    in O(sum_i n_i^3 + N sum_i n_i) time. Otherwise the missing grid points
+    are masked out and inference falls back to the iterative methods of
+    `IterativeGP`, using Kronecker products with the kernel matrix.
+    """
+    def __init__(self, likelihood, kernel, mean, grid=None,
+                 rank=20, nprobe=10, tol=1e-8, maxiter=None, seed=0):
+        if not _separable(kernel):
+            raise ValueError('Kronecker inference requires a kernel which '
+                             'factorizes over the input dimensions')
+
+        super(KroneckerGP, self).__init__(likelihood, kernel, mean,
+                                          rank, nprobe, tol, maxiter, seed)
+
+        # the grid axes, if given, and the flat grid index of each data point.
+        self._grid = (None if (grid is None) else
+                      [np.sort(np.array(g, dtype=float, ndmin=1))
+                       for g in grid])
+        self._axes = None
+        self._idx = None
+        self._N = 0
+
+        # the kernel factor for each axis, where the kernel matrix on the grid
+        # is the Kronecker product of these times `_scale`. if the grid is
+        # complete also the eigenvectors of each factor and the eigenvalues of
+        # the full kernel matrix.
+        self._Ks = None
+        self._scale = None
+        self._Q = None
+        self._lam = None
+
+    def reset(self):
+        for attr in ('axes', 'idx', 'Ks', 'scale', 'Q', 'lam'):
+            setattr(self, '_' + attr, None)
+        self._N = 0
+        super(KroneckerGP, self).reset()
+
+    @classmethod
+    def from_gp(cls, gp, grid=None):
+        if grid is None and isinstance(gp, KroneckerGP):
+            grid = gp._grid
+        newgp = cls(gp._likelihood.copy(), gp._kernel.copy(), gp._mean, grid,
+                    **cls._options(gp))
+        if gp.ndata > 0:
+            X, y = gp.data
+            newgp.add_data(X, y)
+        return newgp
+
+    @property
+    def _complete(self):
+        """Whether the data covers every point of the grid exactly once."""
+        return self.ndata == self._N and self._lam is not None
+
+    def _setgrid(self):
+        """Find the grid axes and the grid index of each data point."""
+        if self._grid is not None:
+            axes = self._grid
+        else:
+            axes = [np.unique(x) for x in self._X.T]
+
+        idx = []
+        for g, x in zip(axes, self._X.T):
+            i = _nearest(g, x)
+            if not np.allclose(g[i], x, rtol=1e-8, atol=1e-8):
+                raise ValueError('inputs do not lie on the grid')
+            idx.append(i)
+
+        shape = [len(g) for g in axes]
+        self._axes = axes
+        self._idx = np.ravel_multi_index(idx, shape)
+        self._N = int(np.prod(shape))
+
+    def _points(self, i, x):
+        """
+        Return the points whose ith coordinate is given by `x` and whose
+        remaining coordinates are those of the first grid point.
+        """
+        Z = np.tile([g[0] for g in self._axes], (len(x), 1))
+        Z[:, i] = x
+        return Z
+
+    def _setfactors(self):
+        """
+        Compute the kernel factor along each axis. These are the kernel
+        evaluated along each axis through the first grid point, so each
+        includes the remaining dimensions' variances at that point; dividing
+        by the kernel variance there to the power D-1 removes these.
+        """
+        D = len(self._axes)
+        c = self._kernel.dget(self._points(0, self._axes[0][:1]))[0]
+        self._Ks = [self._kernel.get(self._points(i, g))
+                    for i, g in enumerate(self._axes)]
+        self._scale = c ** (1-D)
+
+    def _factor_grads(self):
+        """
+        Return the gradient of each kernel factor and the gradient of the log
+        of `_scale` wrt each kernel hyperparameter.
+        """
+        D = len(self._axes)
+        Z = self._points(0, self._axes[0][:1])
+        c = self._kernel.dget(Z)[0]
+        dc = np.array([dk[0] for dk in self._kernel.dgrad(Z)])
+        dKs = [np.array(list(self._kernel.grad(self._points(i, g))))
+               for i, g in enumerate(self._axes)]
+        return dKs, (1-D) * dc / c
+
+    def _scatter(self, V):
+        """Map an array over the data to an array over the grid."""
+        U = np.zeros((self._N,) + V.shape[1:])
+        np.add.at(U, self._idx, V)
+        return U
+
+    def _kron_grad(self, U):
+        """
+        Compute the products `dK U` for the gradient of the kernel matrix on
+        the grid wrt each kernel hyperparameter and the (N,t)-array `U`.
+        """
+        dKs, dlogscale = self._factor_grads()
+        KU = self._scale * kron_mvm(self._Ks, U)
+        out = np.empty((self._kernel.nhyper,) + U.shape)
+        for h in xrange(self._kernel.nhyper):
+            out[h] = dlogscale[h] * KU
+            for i, dK in enumerate(dKs):
+                Ks = self._Ks[:i] + [dK[h]] + self._Ks[i+1:]
+                out[h] += self._scale * kron_mvm(Ks, U)
+        return out
+
+    def _mvm(self, V):
+        U = self._scatter(V)
+        return self._scale * kron_mvm(self._Ks, U)[self._idx]
+
+    def _mvm_grad(self, V):
+        return self._kron_grad(self._scatter(V))[:, self._idx]
+
+    def _solve(self, B, lanczos=False):
+        if not self._complete or lanczos:
+            return super(KroneckerGP, self)._solve(B, lanczos)
+        B = np.asarray(B)
+        QtB = kron_mvm([Q.T for Q in self._Q], self._scatter(B))
+        w = (1 / (self._lam + self._likelihood.s2))
+        W = w.reshape((-1,) + (1,) * (B.ndim-1)) * QtB
+        return kron_mvm(self._Q, W)[self._idx]
+
+    def _update(self):
+        self._setgrid()
+        self._setfactors()
+
+        if self.ndata == self._N and np.all(np.bincount(self._idx) == 1):
+            eigs = [sla.eigh(K) for K in self._Ks]
+            lam = ft.reduce(np.multiply.outer, [w for w, _ in eigs])
+            self._Q = [V for _, V in eigs]
+            self._lam = np.maximum(self._scale * lam.ravel(), 0)
+            self._L = self._R = None
+            self._alpha = self._solve(self._y - self._mean)
+        else:
+            self._Q = self._lam = None
+            super(KroneckerGP, self)._update()
+
+    def _updatescale(self, c):
+        self._setfactors()
+        if self._complete:
+            self._lam *= c
+            self._alpha /= c
+        else:
+            super(KroneckerGP, self)._updatescale(c)
+
+    def _marg_posterior(self, X, grad=False):
+        if not self._complete:
+            return super(KroneckerGP, self)._marg_posterior(X, grad)
+
+        # the cross-kernel between the test points and the grid factorizes
+        # into one factor per axis, as does its projection onto the
+        # eigenvectors of the kernel matrix.
+        shape = [len(g) for g in self._axes]
+        Ks = [self._kernel.get(self._points(i, X[:, i]), self._points(i, g))
+              for i, g in enumerate(self._axes)]
+        Us = [np.dot(K, Q) for K, Q in zip(Ks, self._Q)]
+
+        A = self._scatter(self._alpha).reshape(shape)
+        W = (1 / (self._lam + self._likelihood.s2)).reshape(shape)
+        U2 = [U**2 for U in Us]
+
+        mu = self._mean + self._scale * _contract(A, Ks)
+        s2 = self._kernel.dget(X) - self._scale**2 * _contract(W, U2)
+
+        if not grad:
+            return (mu, s2)
+
+        # the derivative wrt the ith coordinate of each test point only
+        # changes the ith factor.
+        dmu = np.zeros_like(X)
+        ds2 = np.zeros_like(X)
+
+        for i, g in enumerate(self._axes):
+            dK = self._kernel.gradx(self._points(i, X[:, i]),
+                                    self._points(i, g))[:, :, i]
+            dU = np.dot(dK, self._Q[i])
+            dmu[:, i] = self._scale * _contract(
+                A, Ks[:i] + [dK] + Ks[i+1:])
+            ds2[:, i] = -2 * self._scale**2 * _contract(
+                W, U2[:i] + [Us[i] * dU] + U2[i+1:])
+
+        return (mu, s2, dmu, ds2)
+
+    def _loglikelihood(self, grad=False):
+        if not self._complete:
+            return super(KroneckerGP, self)._loglikelihood(grad)
+
+        n = self.ndata
+        sn2 = self._likelihood.s2
+        r = self._y - self._mean
+        w = 1 / (self._lam + sn2)
+
+        lZ = -0.5 * np.inner(r, self._alpha)
+        lZ += 0.5 * np.sum(np.log(w))
+        lZ -= 0.5 * np.log(2 * np.pi) * n
+
+        if not grad:
+            return lZ
+
+        # tr((K + sn2 I)^{-1} dK) for dK = K_1 x ... x dK_i x ... x K_D is
+        # the sum of w times the Kronecker product of the eigenvalues of each
+        # factor, but with the diagonal of Q_i^T dK_i Q_i in place of the ith.
+        shape = [len(g) for g in self._axes]
+        lams = [np.einsum('ij,ij->j', Q, np.dot(K, Q))
+                for K, Q in zip(self._Ks, self._Q)]
+        dKs, dlogscale = self._factor_grads()
+        W = w.reshape(shape)
+
+        trace = dlogscale * np.inner(w, self._lam)
+        for i, (dK, Q) in enumerate(zip(dKs, self._Q)):
+            for h in xrange(self._kernel.nhyper):
+                dlam = np.einsum('ij,ij->j', Q, np.dot(dK[h], Q))
+                vecs = [v[None] for v in lams[:i] + [dlam] + lams[i+1:]]
+                trace[h] += self._scale * _contract(W, vecs)[0]
+
+        a = self._scatter(self._alpha)
+        dKa = self._kron_grad(a)
+
+        dlZ = np.r_[
+            # derivative wrt the likelihood's noise term.
+            sn2 * (np.inner(self._alpha, self._alpha) - np.sum(w)),
+
+            # derivative wrt each kernel hyperparameter.
+            0.5 * np.dot(dKa, a) - 0.5 * trace,
+
+            # derivative wrt the mean.
+            np.sum(self._alpha)]
+
+        return lZ, dlZ
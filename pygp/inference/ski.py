@@ -0,0 +1,334 @@
+"""
+Structured kernel interpolation (KISS-GP), where the kernel is interpolated
+from its values on a regular grid of inducing points.
+"""
+
+from __future__ import division
+from __future__ import absolute_import
+from __future__ import print_function
+
+import numpy as np
+import scipy.sparse as sp
+import scipy.sparse.linalg as ssla
+import itertools as it
+
+from ._iterative import IterativeGP
+
+__all__ = ['SKI']
+
+
+def _cubic(t):
+    """
+    Return the weights of the cubic convolution kernel (Keys, 1981) for the
+    grid points at offsets -1, 0, 1, 2 from the points at fractional offsets
+    `t`, along with their derivatives wrt `t`.
+    """
+    W = 0.5 * np.c_[((2 - t)*t - 1)*t,
+                    (3*t - 5)*t*t + 2,
+                    ((4 - 3*t)*t + 1)*t,
+                    (t - 1)*t*t]
+    dW = 0.5 * np.c_[(4 - 3*t)*t - 1,
+                     (9*t - 10)*t,
+                     (8 - 9*t)*t + 1,
+                     (3*t - 2)*t]
+    return W, dW
+
+
+def _embed(c):
+    """
+    Return the FFT of the circulant embedding of a symmetric (multilevel)
+    Toeplitz matrix given the kernel `c` evaluated at each non-negative grid
+    offset, i.e. mirror `c` along each axis.
+    """
+    for i in xrange(c.ndim):
+        z = np.zeros_like(np.take(c, [0], axis=i))
+        r = np.flip(np.take(c, np.arange(1, c.shape[i]), axis=i), axis=i)
+        c = np.concatenate([c, z, r], axis=i)
+    return np.fft.rfftn(c)
+
+
+class SKI(IterativeGP):
+    """
+    Structured kernel interpolation (KISS-GP).
+
+    The kernel between inputs `x` and `x'` is approximated by `w(x)^T K w(x')`
+    where `K` is the kernel evaluated on a regular grid of inducing points and
+    `w(x)` are sparse cubic interpolation weights, with 4^d nonzeros for
+    d-dimensional inputs. For a stationary kernel `K` is (multilevel)
+    Toeplitz, so products with it are computed using FFTs in O(M log M) time
+    for M grid points, and solves use the iterative methods of `IterativeGP`.
+
+    The grid is given by `grid`, a list of regularly spaced coordinates along
+    each dimension (with at least 5 points each), or otherwise `gridsize`
+    points are placed along each dimension to cover the data. Predictions at
+    points outside of the grid are extrapolated.
+
+    The predictive mean only requires the sparse weights of each test point
+    and the cached product of the grid kernel with the interpolated `alpha`.
+    The exact variance requires a PCG solve for each test point, but given a
+    rank r `predict_var` instead caches r Lanczos vectors mapped to the grid
+    and costs O(4^d r) per test point.
+    """
+    def __init__(self, likelihood, kernel, mean, grid=None, gridsize=50,
+                 rank=20, nprobe=10, tol=1e-8, maxiter=None, seed=0):
+        super(SKI, self).__init__(likelihood, kernel, mean,
+                                  rank, nprobe, tol, maxiter, seed)
+
+        self._grid = None
+        if grid is not None:
+            self._grid = [np.array(g, dtype=float, ndmin=1) for g in grid]
+            if len(self._grid) != kernel.ndim:
+                raise ValueError('grid must have an axis for each dimension')
+            for g in self._grid:
+                if len(g) < 5 or not np.allclose(np.diff(g), g[1] - g[0]):
+                    raise ValueError('grid axes must be regularly spaced '
+                                     'with at least 5 points')
+        self._gridsize = gridsize
+
+        # the grid origin, spacing, and shape.
+        self._g0 = None
+        self._h = None
+        self._shape = None
+
+        # the FFT of the embedded grid kernel (and of its gradients, which are
+        # computed on demand), and the kernel between the points of an
+        # interpolation stencil (and its gradients) which is indexed by the
+        # offsets S between these points.
+        self._S = None
+        self._F = None
+        self._dF = None
+        self._T = None
+        self._dT = None
+
+        # the interpolation weights of the data.
+        self._vals = None
+        self._W = None
+
+    def reset(self):
+        for attr in ('g0', 'h', 'shape', 'S', 'F', 'dF', 'T', 'dT',
+                     'vals', 'W'):
+            setattr(self, '_' + attr, None)
+        super(SKI, self).reset()
+
+    @classmethod
+    def from_gp(cls, gp, grid=None):
+        gridsize = 50
+        if isinstance(gp, SKI):
+            grid = gp._grid if (grid is None) else grid
+            gridsize = gp._gridsize
+        newgp = cls(gp._likelihood.copy(), gp._kernel.copy(), gp._mean, grid,
+                    gridsize, **cls._options(gp))
+        if gp.ndata > 0:
+            X, y = gp.data
+            newgp.add_data(X, y)
+        return newgp
+
+    def _setgrid(self):
+        """Find the grid origin, spacing, and shape."""
+        if self._grid is not None:
+            self._g0 = np.array([g[0] for g in self._grid])
+            self._h = np.array([g[1] - g[0] for g in self._grid])
+            self._shape = tuple(len(g) for g in self._grid)
+        else:
+            # leave one grid point below the data and two above so that every
+            # interpolation stencil lies on the grid.
+            n = np.ones(self._kernel.ndim, dtype=int) * self._gridsize
+            lo = np.min(self._X, axis=0)
+            hi = np.max(self._X, axis=0)
+            h = np.where(hi > lo, (hi - lo) / (n - 4), 1.)
+            self._g0 = lo - h
+            self._h = h
+            self._shape = tuple(n)
+
+    def _setkernel(self):
+        """Evaluate the kernel on the grid and on an interpolation stencil."""
+        D = len(self._shape)
+        G = np.array([x.ravel() for x in np.meshgrid(
+            *[np.arange(n) for n in self._shape], indexing='ij')]).T
+        c = self._kernel.get(self._g0[None], self._g0 + G*self._h)
+        c = c.reshape(self._shape)
+
+        # offsets between the points of a stencil lie in {0,...,3}^D.
+        offs = np.array(list(it.product(xrange(4), repeat=D)))
+        self._S = tuple(np.abs(offs[:, None] - offs[None]).transpose(2, 0, 1))
+        self._F = _embed(c)
+        self._T = c[self._S]
+        self._dF = None
+        self._dT = None
+
+    def _setkernel_grad(self):
+        """Evaluate the kernel gradients on the grid, if needed."""
+        if self._dF is None:
+            G = np.array([x.ravel() for x in np.meshgrid(
+                *[np.arange(n) for n in self._shape], indexing='ij')]).T
+            dc = [dc.reshape(self._shape) for dc in
+                  self._kernel.grad(self._g0[None], self._g0 + G*self._h)]
+            self._dF = [_embed(c) for c in dc]
+            self._dT = [c[self._S] for c in dc]
+
+    def _stencil(self, X, grad=False):
+        """
+        Return the grid indices and interpolation weights for the points `X`
+        as (m,4^D)-arrays, and if `grad` is True a list of the derivatives of
+        the weights wrt each input dimension.
+        """
+        D = len(self._shape)
+        n = np.array(self._shape)
+        u = (X - self._g0) / self._h
+        i = np.clip(np.floor(u).astype(int), 1, n-3)
+        W, dW = zip(*[_cubic(t) for t in (u - i).T])
+
+        cols = []
+        vals = []
+        dvals = [[] for _ in xrange(D)]
+        for a in it.product(xrange(4), repeat=D):
+            cols.append(np.ravel_multi_index(
+                [i[:, d] + a[d] - 1 for d in xrange(D)], self._shape))
+            w = [W[d][:, a[d]] for d in xrange(D)]
+            vals.append(np.prod(w, axis=0))
+            for d in xrange(D):
+                dw = w[:d] + [dW[d][:, a[d]] / self._h[d]] + w[d+1:]
+                dvals[d].append(np.prod(dw, axis=0))
+
+        cols = np.array(cols).T
+        vals = np.array(vals).T
+        if not grad:
+            return cols, vals
+        return cols, vals, [np.array(dv).T for dv in dvals]
+
+    def _sparse(self, cols, vals):
+        """Form the sparse interpolation matrix given a stencil."""
+        m, k = cols.shape
+        rows = np.repeat(np.arange(m), k)
+        M = int(np.prod(self._shape))
+        return sp.csr_matrix((vals.ravel(), (rows, cols.ravel())), (m, M))
+
+    def _kuu(self, U, F=None):
+        """Multiply the (M,t)-array `U` by the kernel matrix on the grid."""
+        F = self._F if (F is None) else F
+        D = len(self._shape)
+        s = [2*n for n in self._shape]
+        V = np.reshape(U, self._shape + (-1,))
+        axes = tuple(xrange(D))
+        V = np.fft.irfftn(np.fft.rfftn(V, s, axes) * F[..., None], s, axes)
+        V = V[tuple(slice(0, n) for n in self._shape)]
+        return V.reshape(U.shape)
+
+    def _mvm(self, V):
+        return self._W.dot(self._kuu(self._W.T.dot(V)))
+
+    def _mvm_grad(self, V):
+        self._setkernel_grad()
+        U = self._W.T.dot(V)
+        return np.array([self._W.dot(self._kuu(U, dF)) for dF in self._dF])
+
+    def _diag(self):
+        return np.einsum('na,ab,nb->n', self._vals, self._T, self._vals)
+
+    def _diag_grad(self):
+        self._setkernel_grad()
+        return np.array([np.einsum('na,ab,nb->n', self._vals, dT, self._vals)
+                         for dT in self._dT])
+
+    def _columns(self, idx):
+        E = np.zeros((self.ndata, len(idx)))
+        E[idx, np.arange(len(idx))] = 1
+        return self._mvm(E)
+
+    def _update(self):
+        self._setgrid()
+        self._setkernel()
+        cols, self._vals = self._stencil(self._X)
+        self._W = self._sparse(cols, self._vals)
+        super(SKI, self)._update()
+
+    def _updatescale(self, c):
+        self._setkernel()
+        super(SKI, self)._updatescale(c)
+
+    def _grid_alpha(self):
+        """
+        Return the product of the grid kernel with the interpolated alpha,
+        which gives the predictive mean given the weights of the test points.
+        """
+        if 'Ka' not in self._cache:
+            self._cache['Ka'] = self._kuu(self._W.T.dot(self._alpha))
+        return self._cache['Ka']
+
+    def _cross(self, Ws):
+        """
+        Return the SKI cross-covariance between the data and the points with
+        interpolation matrix `Ws`.
+        """
+        return self._W.dot(self._kuu(Ws.T.toarray()))
+
+    def _full_posterior(self, X):
+        if self._X is None:
+            return super(SKI, self)._full_posterior(X)
+
+        Ws = self._sparse(*self._stencil(X))
+        Kxs = self._cross(Ws)
+        mu = self._mean + Ws.dot(self._grid_alpha())
+        Sigma = Ws.dot(self._kuu(Ws.T.toarray()))
+        Sigma -= np.dot(Kxs.T, self._solve(Kxs))
+
+        return mu, Sigma
+
+    def _marg_posterior(self, X, grad=False):
+        if self._X is None:
+            return super(SKI, self)._marg_posterior(X, grad)
+
+        stencil = self._stencil(X, grad)
+        cols, vals = stencil[:2]
+        Ws = self._sparse(cols, vals)
+        Kxs = self._cross(Ws)
+        G = self._kuu(self._W.T.dot(self._solve(Kxs)))
+        TW = np.dot(vals, self._T)
+
+        mu = self._mean + Ws.dot(self._grid_alpha())
+        s2 = np.sum(TW * vals, axis=1)
+        s2 -= np.asarray(Ws.multiply(G.T).sum(axis=1)).ravel()
+
+        if not grad:
+            return (mu, s2)
+
+        # the derivatives only involve the derivatives of the weights of the
+        # test points.
+        dmu = np.zeros_like(X)
+        ds2 = np.zeros_like(X)
+
+        for d, dv in enumerate(stencil[2]):
+            dWs = self._sparse(cols, dv)
+            dmu[:, d] = dWs.dot(self._grid_alpha())
+            ds2[:, d] = 2 * np.sum(TW * dv, axis=1)
+            ds2[:, d] -= 2 * np.asarray(dWs.multiply(G.T).sum(axis=1)).ravel()
+
+        return (mu, s2, dmu, ds2)
+
+    def _predict_mean(self, X):
+        if self._X is None:
+            return super(SKI, self)._predict_mean(X)
+        Ws = self._sparse(*self._stencil(X))
+        return self._mean + Ws.dot(self._grid_alpha())
+
+    def _predict_var(self, X, rank=None):
+        if self._X is None or rank is None or rank >= self.ndata:
+            return super(SKI, self)._predict_var(X, rank)
+
+        # the inverse of the kernel matrix is approximated by V diag(w)^-1
+        # V^T using its leading eigenpairs, found by Lanczos iterations using
+        # only products with the kernel, and which can only underestimate the
+        # inverse. the variance reduction is then ||S^T w(x)||^2 where S maps
+        # these eigenvectors to the grid.
+        key = ('S', int(rank))
+        if key not in self._cache:
+            n = self.ndata
+            A = ssla.LinearOperator((n, n), matvec=self._matvec, dtype=float)
+            w, V = ssla.eigsh(A, rank)
+            self._cache[key] = self._kuu(self._W.T.dot(V / np.sqrt(w)))
+
+        cols, vals = self._stencil(X)
+        Ws = self._sparse(cols, vals)
+        s2 = np.sum(np.dot(vals, self._T) * vals, axis=1)
+        s2 -= np.sum(Ws.dot(self._cache[key])**2, axis=1)
+        return s2
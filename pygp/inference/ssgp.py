@@ -0,0 +1,233 @@
+"""
+Sparse spectrum GP inference, where the kernel is approximated using a fixed
+set of random Fourier features.
+"""
+
+from __future__ import division
+from __future__ import absolute_import
+from __future__ import print_function
+
+import numpy as np
+import scipy.linalg as sla
+
+from ._base import GP
+from ..likelihoods import Gaussian
+from ..utils.linalg import cholupdate
+
+__all__ = ['SSGP']
+
+
+class SSGP(GP):
+    """
+    Sparse spectrum GP inference.
+
+    The kernel is approximated by `phi(x)^T phi(x')` where `phi` are `N`
+    random cosine features whose frequencies are sampled from the kernel's
+    spectral density, which makes the model a Bayesian linear regression on
+    these features. Fitting takes O(n N^2) time, the predictive mean O(N)
+    time per point and the variance O(N^2), and new data is added using rank
+    updates of the NxN system. The random draws underlying the features are
+    fixed by `seed`, so the features are deterministic functions of the
+    hyperparameters and the loglikelihood can be optimized as usual.
+
+    This requires a Gaussian likelihood and a kernel which implements
+    `sample_spectrum` and `grad_spectrum`, e.g. `SE` or `Matern`.
+    """
+    def __init__(self, likelihood, kernel, mean, N=100, seed=0):
+        if not isinstance(likelihood, Gaussian):
+            raise ValueError('sparse spectrum inference requires a Gaussian '
+                             'likelihood')
+
+        super(SSGP, self).__init__(likelihood, kernel, mean)
+
+        self._N = N
+        self._seed = seed
+
+        # the frequencies, phases, and amplitude of the features. these are
+        # only set when the statistics are computed.
+        self._W = None
+        self._b = None
+        self._a = None
+
+        # the cholesky of Phi^T Phi + sn2 I, the projections Phi^T y and
+        # Phi^T 1 of the outputs and of the constant mean, and the posterior
+        # mean of the feature weights.
+        self._R = None
+        self._Py = None
+        self._P1 = None
+        self._m = None
+
+        try:
+            self._setfeatures()
+        except NotImplementedError:
+            raise ValueError('sparse spectrum inference requires a kernel '
+                             'with a spectral density')
+
+    def reset(self):
+        for attr in ('W', 'b', 'a', 'R', 'Py', 'P1', 'm'):
+            setattr(self, '_' + attr, None)
+        super(SSGP, self).reset()
+
+    @classmethod
+    def from_gp(cls, gp, N=None):
+        if N is None:
+            N = gp._N if isinstance(gp, SSGP) else 100
+        newgp = cls(gp._likelihood.copy(), gp._kernel.copy(), gp._mean, N)
+        if gp.ndata > 0:
+            X, y = gp.data
+            newgp.add_data(X, y)
+        return newgp
+
+    def _setfeatures(self):
+        """Sample the features using the fixed random draws."""
+        rng = np.random.RandomState(self._seed)
+        W, alpha = self._kernel.sample_spectrum(self._N, rng)
+        self._W = W
+        self._b = rng.rand(self._N) * 2 * np.pi
+        self._a = np.sqrt(2 * alpha / self._N)
+
+    def _features(self, X, grad=False):
+        """
+        Evaluate the features at `X`, returning an (m,N)-array. If `grad` is
+        True also return the derivative of each feature wrt its argument, so
+        that its gradient wrt `X` is given by multiplying by `W`.
+        """
+        Z = np.dot(X, self._W.T) + self._b
+        Phi = self._a * np.cos(Z)
+        if not grad:
+            return Phi
+        return Phi, -self._a * np.sin(Z)
+
+    def _update(self):
+        self._setfeatures()
+        sn2 = self._likelihood.s2
+        Phi = self._features(self._X)
+        self._R = sla.cholesky(np.dot(Phi.T, Phi) + sn2 * np.eye(self._N))
+        self._Py = np.dot(Phi.T, self._y)
+        self._P1 = np.sum(Phi, axis=0)
+        self._updatemean(self._mean)
+
+    def _updateinc(self, X, y):
+        Phi = self._features(X)
+        if len(X) < self._N:
+            self._R = cholupdate(self._R, Phi)
+        else:
+            A = np.dot(self._R.T, self._R) + np.dot(Phi.T, Phi)
+            self._R = sla.cholesky(A)
+        self._Py += np.dot(Phi.T, y)
+        self._P1 += np.sum(Phi, axis=0)
+        self._updatemean(self._mean)
+
+    def _updatedel(self, idx):
+        # a downdate isn't guaranteed to be stable, so refactorize the NxN
+        # system which is still cheaper than a full update when n >> N.
+        Phi = self._features(self._X[idx])
+        A = np.dot(self._R.T, self._R) - np.dot(Phi.T, Phi)
+        self._R = sla.cholesky(A)
+        self._Py -= np.dot(Phi.T, self._y[idx])
+        self._P1 -= np.sum(Phi, axis=0)
+        self._updatemean(self._mean)
+
+    def _updatemean(self, mean0):
+        r = self._Py - self._mean * self._P1
+        self._m = sla.cho_solve((self._R, False), r)
+
+    def _updatescale(self, c):
+        self._a *= np.sqrt(c)
+        self._R *= np.sqrt(c)
+        self._Py *= np.sqrt(c)
+        self._P1 *= np.sqrt(c)
+        self._m /= np.sqrt(c)
+
+    def _full_posterior(self, X):
+        # the features are only kept up to date along with the statistics, so
+        # sample them again for the prior.
+        if self._X is None:
+            self._setfeatures()
+
+        Phi = self._features(X)
+        mu = np.full(X.shape[0], self._mean)
+
+        if self._X is None:
+            return mu, np.dot(Phi, Phi.T)
+
+        V = sla.solve_triangular(self._R, Phi.T, trans=True)
+        mu += np.dot(Phi, self._m)
+        Sigma = self._likelihood.s2 * np.dot(V.T, V)
+
+        return mu, Sigma
+
+    def _marg_posterior(self, X, grad=False):
+        if self._X is None:
+            self._setfeatures()
+
+        Phi, dPhi = self._features(X, True)
+        mu = np.full(X.shape[0], self._mean)
+
+        # with no data the posterior over the feature weights is the standard
+        # normal prior. otherwise its covariance is sn2 A^{-1}.
+        if self._X is None:
+            U = Phi.T
+            s2 = np.sum(Phi**2, axis=1)
+        else:
+            sn2 = self._likelihood.s2
+            U = sn2 * sla.cho_solve((self._R, False), Phi.T)
+            mu += np.dot(Phi, self._m)
+            s2 = np.sum(Phi.T * U, axis=0)
+
+        if not grad:
+            return (mu, s2)
+
+        dmu = np.zeros_like(X)
+        if self._X is not None:
+            dmu += np.dot(dPhi, self._m[:, None] * self._W)
+        ds2 = 2 * np.dot(U.T * dPhi, self._W)
+
+        return (mu, s2, dmu, ds2)
+
+    def _loglikelihood(self, grad=False):
+        n = self.ndata
+        N = self._N
+        sn2 = self._likelihood.s2
+        r = self._y - self._mean
+        Pr = self._Py - self._mean * self._P1
+        rr = np.inner(r, r)
+
+        lZ = -0.5 * (rr - np.inner(Pr, self._m)) / sn2
+        lZ -= np.sum(np.log(self._R.diagonal()))
+        lZ -= 0.5 * (n - N) * np.log(sn2)
+        lZ -= 0.5 * np.log(2 * np.pi) * n
+
+        if not grad:
+            return lZ
+
+        # the trace of the inverse of the NxN system and the squared norm of
+        # the weights.
+        Rinv = sla.solve_triangular(self._R, np.eye(N))
+        tr = np.sum(Rinv**2)
+        mm = np.inner(self._m, self._m)
+
+        # the derivative wrt the kernel is tr(G^T dPhi) where G = alpha m^T -
+        # Phi A^{-1}. the part due to the amplitude of the features simplifies
+        # to the terms below, leaving a pass over the data for the part due to
+        # their frequencies.
+        Phi, dPhi = self._features(self._X, True)
+        alpha = (r - np.dot(Phi, self._m)) / sn2
+        G = np.outer(alpha, self._m) - np.dot(np.dot(Phi, Rinv), Rinv.T)
+        C = np.dot((G * dPhi).T, self._X)
+        dW, dalpha = self._kernel.grad_spectrum(self._W)
+        dlogalpha = dalpha / (self._a**2 * N / 2)
+
+        dlZ = np.r_[
+            # derivative wrt the likelihood's noise term.
+            (rr - np.inner(Pr, self._m) - sn2 * mm) / sn2
+            - (n - N) - sn2 * tr,
+
+            # derivative wrt each kernel hyperparameter.
+            0.5 * dlogalpha * (mm - N + sn2 * tr)
+            + np.einsum('ij,hij->h', C, dW),
+
+            # derivative wrt the mean.
+            np.sum(alpha)]
+
+        return lZ, dlZ
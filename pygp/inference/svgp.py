@@ -0,0 +1,418 @@
+"""
+Stochastic variational inference for sparse pseudo-input GPs, which can be
+trained on minibatches of data too large to hold in memory.
+"""
+
+from __future__ import division
+from __future__ import absolute_import
+from __future__ import print_function
+
+import numpy as np
+import scipy.linalg as sla
+
+from mwhutils.random import rstate
+
+from ._base import GP
+from ._fourier import PathwiseSample
+from ..likelihoods import Gaussian
+from ..kernels._distances import Distances
+
+__all__ = ['SVGP']
+
+
+def _tril(A):
+    """
+    Return the lower triangle of `A` with its diagonal halved. If `A = L^-T
+    dK L^-1` for the upper cholesky `L` of `K` this is `L^-T dL^T`.
+    """
+    A = np.tril(A)
+    A[np.diag_indices_from(A)] *= 0.5
+    return A
+
+
+def _load(X):
+    """Memory-map `X` if it is the name of a `.npy` file."""
+    # this accepts both byte and unicode paths under python 2 and 3.
+    if isinstance(X, (bytes, type(u''))):
+        return np.load(X, mmap_mode='r')
+    return X
+
+
+class SVGP(GP):
+    """
+    Sparse variational GP inference using pseudo-inputs.
+
+    The posterior is approximated by `q(u) = N(L^T m, L^T S L)` for the
+    values `u` of the latent function at the pseudo-inputs, where `Kuu = L^T
+    L`. Data added using `add_data` is fit exactly, in which case `q` is
+    the optimal distribution of (Titsias, 2009) and the loglikelihood is the
+    collapsed variational bound.
+
+    Data too large to hold in memory can instead be given to `fit`, which
+    reads minibatches from arrays or `.npy` files using memory-mapping and
+    takes natural gradient steps on `q` and Adam steps on the
+    hyperparameters using the bound of (Hensman et al, 2013). This requires
+    O(b p + p^2) memory for minibatches of size b and p pseudo-inputs. The
+    data is not stored, so the bound can't be evaluated by `loglikelihood`
+    afterwards, and adding data later replaces the fitted `q`.
+    """
+    def __init__(self, likelihood, kernel, mean, U):
+        # NOTE: the natural gradient steps are only exact for Gaussian
+        # likelihoods.
+        if not isinstance(likelihood, Gaussian):
+            raise ValueError('exact inference requires a Gaussian likelihood')
+
+        super(SVGP, self).__init__(likelihood, kernel, mean)
+
+        # save the pseudo-input locations.
+        self._U = np.array(U, ndmin=2, dtype=float, copy=True)
+        self._Udist = Distances(self._U)
+
+        # the cholesky of Kuu.
+        self._L = None
+
+        # the natural parameters of q (in whitened coordinates) along with
+        # the cholesky R of its precision and its mean m. c is the derivative
+        # of -eta wrt the mean, which lets us update the statistics when only
+        # the mean changes.
+        self._Lam = None
+        self._eta = None
+        self._R = None
+        self._m = None
+        self._c = None
+
+    def reset(self):
+        for attr in ('L', 'Lam', 'eta', 'R', 'm', 'c'):
+            setattr(self, '_' + attr, None)
+        super(SVGP, self).reset()
+
+    @property
+    def pseudoinputs(self):
+        """The pseudo-input points."""
+        return self._U
+
+    def _distances(self):
+        if self._dist is None:
+            self._dist = Distances(self._U, self._X)
+        return self._dist
+
+    @classmethod
+    def from_gp(cls, gp, U=None):
+        if U is None:
+            if hasattr(gp, 'pseudoinputs'):
+                U = gp.pseudoinputs.copy()
+            else:
+                raise ValueError('gp has no pseudoinputs and none are given')
+        newgp = cls(gp._likelihood.copy(), gp._kernel.copy(), gp._mean, U)
+        if gp.ndata > 0:
+            X, y = gp.data
+            newgp.add_data(X, y)
+        return newgp
+
+    def _setchol(self):
+        """Compute the cholesky of Kuu."""
+        su2 = self._likelihood.s2 * 1e-6
+        Kuu = self._kernel.get(self._Udist)
+        self._L = sla.cholesky(Kuu + su2 * np.eye(len(self._U)))
+
+    def _setq(self):
+        """Compute the cholesky and mean of q from its natural parameters."""
+        self._R = sla.cholesky(self._Lam)
+        self._m = sla.cho_solve((self._R, False), self._eta)
+
+    def _whiten(self, Kux):
+        """Map the kernel between the pseudo-inputs and some points `X` to the
+        coordinates in which the prior on the pseudo-inputs is whitened."""
+        return sla.solve_triangular(self._L, Kux, trans=True)
+
+    def _accumulate(self, Kux, y, sign=1):
+        """
+        Add the contribution of data with outputs `y` to the statistics, where
+        `Kux` is the kernel between the pseudo-inputs and the data inputs, and
+        then update q. If `sign` is -1 remove their contribution instead.
+        """
+        sn2 = self._likelihood.s2
+        A = self._whiten(Kux)
+        self._Lam += sign * np.dot(A, A.T) / sn2
+        self._eta += sign * np.dot(A, y - self._mean) / sn2
+        self._c += sign * np.sum(A, axis=1) / sn2
+        self._setq()
+
+    def _update(self):
+        p = len(self._U)
+        self._setchol()
+        self._Lam = np.eye(p)
+        self._eta = np.zeros(p)
+        self._c = np.zeros(p)
+        self._accumulate(self._kernel.get(self._distances()), self._y)
+
+    def _updateinc(self, X, y):
+        self._accumulate(self._kernel.get(self._U, X), y)
+
+    def _updatedel(self, idx):
+        X = self._X[idx]
+        self._accumulate(self._kernel.get(self._U, X), self._y[idx], -1)
+
+    def _updatemean(self, mean0):
+        self._eta -= (self._mean - mean0) * self._c
+        self._setq()
+
+    def _updatescale(self, c):
+        # scaling both the kernel and noise by c leaves the precision of q
+        # unchanged, and its mean is scaled by the inverse of sqrt(c).
+        self._L *= np.sqrt(c)
+        self._eta /= np.sqrt(c)
+        self._c /= np.sqrt(c)
+        self._m /= np.sqrt(c)
+
+    def _grad_kernel(self, X, G, H, c):
+        """
+        Return the derivatives wrt each kernel hyperparameter of `tr(G^T dA) +
+        c sum(dkxx)` where `A` is the whitened kernel between the
+        pseudo-inputs and `X` and `H = G A^T`.
+        """
+        # sum(H * _tril(L^-T dKuu L^-1)) is the contraction of dKuu with
+        # L^-1 _tril(H) L^-T, so both terms are contractions of the kernel
+        # gradients.
+        LG = sla.solve_triangular(self._L, G)
+        Linv = sla.solve_triangular(self._L, np.eye(len(self._U)))
+        return (
+            self._kernel.grad_contract(LG, self._U, X) -
+            self._kernel.grad_contract(
+                np.dot(np.dot(Linv, _tril(H)), Linv.T), self._Udist) +
+            c * np.array([np.sum(dkxx) for dkxx in self._kernel.dgrad(X)]))
+
+    def _grad_jitter(self, H):
+        """
+        Return the derivative of `tr(G^T dA)` wrt the log noise due only to
+        the jitter added to Kuu, where `H = G A^T`.
+        """
+        su2 = self._likelihood.s2 * 1e-6
+        Linv = sla.solve_triangular(self._L, np.eye(len(self._U)))
+        return -np.sum(H * _tril(2 * su2 * np.dot(Linv.T, Linv)))
+
+    def _full_posterior(self, X):
+        mu = np.full(X.shape[0], self._mean)
+        Sigma = self._kernel.get(X)
+
+        if self._m is not None:
+            if self._X is None:
+                self._setchol()
+
+            # add on the contribution of q, whose covariance in whitened
+            # coordinates is R^-1 R^-T, and remove the prior over u.
+            A = self._whiten(self._kernel.get(self._U, X))
+            B = sla.solve_triangular(self._R, A, trans=True)
+            mu += np.dot(A.T, self._m)
+            Sigma += np.dot(B.T, B) - np.dot(A.T, A)
+
+        return mu, Sigma
+
+    def _marg_posterior(self, X, grad=False):
+        mu = np.full(X.shape[0], self._mean)
+        s2 = self._kernel.dget(X)
+
+        if self._m is not None:
+            if self._X is None:
+                self._setchol()
+            A = self._whiten(self._kernel.get(self._U, X))
+            B = sla.solve_triangular(self._R, A, trans=True)
+            mu += np.dot(A.T, self._m)
+            s2 += np.sum(B**2, axis=0) - np.sum(A**2, axis=0)
+
+        if not grad:
+            return (mu, s2)
+
+        # Get the prior gradients. Note that this assumes a constant mean and
+        # stationary kernel.
+        dmu = np.zeros_like(X)
+        ds2 = np.zeros_like(X)
+
+        if self._m is not None:
+            p = self._U.shape[0]
+            dK = self._kernel.grady(self._U, X)
+            dA = self._whiten(dK.reshape(p, -1))
+            dB = sla.solve_triangular(self._R, dA, trans=True)
+
+            dmu += np.dot(dA.T, self._m).reshape(X.shape)
+
+            dA = np.rollaxis(np.reshape(dA, (p,) + X.shape), 2)
+            dB = np.rollaxis(np.reshape(dB, (p,) + X.shape), 2)
+
+            ds2 += 2 * np.sum(dB * B, axis=1).T
+            ds2 -= 2 * np.sum(dA * A, axis=1).T
+
+        return (mu, s2, dmu, ds2)
+
+    def _loglikelihood(self, grad=False):
+        if self.ndata == 0:
+            raise ValueError('the bound requires data added with add_data, '
+                             'which fit does not store')
+
+        n = self.ndata
+        p = len(self._U)
+        sn2 = self._likelihood.s2
+
+        A = self._whiten(self._kernel.get(self._distances()))
+        r = self._y - self._mean
+        rr = np.inner(r, r)
+        mh = np.inner(self._m, self._eta)
+
+        # the part of the prior variance not explained by the pseudo-inputs.
+        t = np.sum(self._kernel.dget(self._X)) - np.sum(A**2)
+
+        lZ = -0.5 * (rr / sn2 - mh)
+        lZ -= np.sum(np.log(self._R.diagonal()))
+        lZ -= 0.5 * n * np.log(2 * np.pi * sn2)
+        lZ -= 0.5 * t / sn2
+
+        if not grad:
+            return lZ
+
+        # the derivative wrt the kernel is tr(G^T dA) for G = m alpha^T +
+        # (I - Lam^-1) A / sn2, where the second term includes the derivative
+        # of the trace term; H = G A^T simplifies using A A^T = sn2 (Lam - I).
+        Lam = self._Lam
+        Laminv = sla.cho_solve((self._R, False), np.eye(p))
+        mm = np.inner(self._m, self._m)
+        alpha = (r - np.dot(A.T, self._m)) / sn2
+        G = np.outer(self._m, alpha) + (A - np.dot(Laminv, A)) / sn2
+        H = np.outer(self._m, self._m) + Laminv + Lam - 2 * np.eye(p)
+
+        dlZ = np.r_[
+            # derivative wrt the likelihood's noise term.
+            (rr - sn2 * (mh + mm)) / sn2 - (n - p + np.trace(Laminv)) +
+            t / sn2 + self._grad_jitter(H),
+
+            # derivative wrt each kernel hyperparameter.
+            self._grad_kernel(self._X, G, H, -0.5 / sn2),
+
+            # derivative wrt the mean.
+            np.sum(alpha)]
+
+        return lZ, dlZ
+
+    def sample_pathwise(self, N, rng=None):
+        """
+        Sample a function from the posterior by drawing its values at the
+        pseudo-inputs from `q` and using these to correct a prior sample using
+        N random Fourier features. Unlike for other models this only uses `q`,
+        so it also samples from a model fit using `fit`.
+        """
+        self._refresh()
+        if self._m is None:
+            return super(SVGP, self).sample_pathwise(N, rng)
+        if self._X is None:
+            self._setchol()
+
+        # the values at the pseudo-inputs are L^T v for v ~ N(m, R^-1 R^-T)
+        # in the whitened coordinates.
+        rng = rstate(rng)
+        v = self._m + sla.solve_triangular(self._R, rng.randn(len(self._U)))
+        u = np.dot(self._L.T, v) + self._mean
+
+        def solve(r):
+            return sla.cho_solve((self._L, False), r)
+
+        return PathwiseSample(N,
+                              self._likelihood, self._kernel.copy(),
+                              self._mean, self._U, u, solve, rng, noise=False)
+
+    def _batchgrad(self, X, y, scale):
+        """
+        Return the gradient wrt the hyperparameters of the expected
+        loglikelihood of the data `X` and `y` under the current q, multiplied
+        by `scale`. For a minibatch scaled by n/b this is an unbiased estimate
+        of the gradient of the full bound, since its KL term doesn't depend on
+        the hyperparameters when q is whitened.
+        """
+        p = len(self._U)
+        sn2 = self._likelihood.s2
+        A = self._whiten(self._kernel.get(self._U, X))
+        S = sla.cho_solve((self._R, False), np.eye(p)) - np.eye(p)
+        SA = np.dot(S, A)
+        e = y - self._mean - np.dot(A.T, self._m)
+
+        # each point contributes -0.5 (log(2 pi sn2) + v/sn2), and the
+        # derivative of this wrt A is G.
+        v = e**2 + np.sum(A * SA, axis=0) + self._kernel.dget(X)
+        G = scale * (np.outer(self._m, e) - SA) / sn2
+        H = np.dot(G, A.T)
+
+        return np.r_[
+            # derivative wrt the likelihood's noise term.
+            scale * np.sum(v / sn2 - 1) + self._grad_jitter(H),
+
+            # derivative wrt each kernel hyperparameter.
+            self._grad_kernel(X, G, H, -0.5 * scale / sn2),
+
+            # derivative wrt the mean.
+            scale * np.sum(e) / sn2]
+
+    def fit(self, X, y, niter=1000, batchsize=100, rate=0.1, lr=0.01,
+            hyper=True, rng=None):
+        """
+        Fit the model to data `X` and `y`, which can be arrays (including
+        memory-mapped arrays) or the names of `.npy` files, by stochastic
+        variational inference. Each of `niter` iterations reads a random
+        minibatch of `batchsize` points and takes a natural gradient step of
+        size `rate` on `q` and, if `hyper` is True, an Adam step of size `lr`
+        on the hyperparameters.
+
+        This replaces any existing approximation, but the data is not stored
+        by the model so the model must not already hold any data. As a result
+        `loglikelihood` can't be evaluated afterwards, although the posterior
+        and `sample_pathwise` use the fitted `q`. Any data added later using
+        `add_data` replaces `q` by the exact fit to that data alone.
+        """
+        if self.ndata > 0:
+            raise ValueError('fit requires a model without any data')
+
+        rng = rstate(rng)
+        X = _load(X)
+        y = _load(y)
+        n = len(X)
+        p = len(self._U)
+        b = min(batchsize, n)
+
+        # start from the prior and with the Adam moments at zero.
+        self._setchol()
+        self._Lam = np.eye(p)
+        self._eta = np.zeros(p)
+        self._setq()
+        m1 = np.zeros(self.nhyper)
+        m2 = np.zeros(self.nhyper)
+
+        for i in xrange(1, niter+1):
+            # reading sorted indices keeps reads from a memory-map sequential.
+            if b == n:
+                idx = np.arange(n)
+            else:
+                idx = np.sort(rng.randint(n, size=b))
+            Xb = self._transform(X[idx])
+            yb = self._likelihood.transform(y[idx])
+
+            sn2 = self._likelihood.s2
+            A = self._whiten(self._kernel.get(self._U, Xb))
+            r = yb - self._mean
+
+            # for a Gaussian likelihood the optimal natural parameters given
+            # the minibatch are available in closed form, so the natural
+            # gradient step moves part of the way towards these.
+            Lam = np.eye(p) + (n / b) * np.dot(A, A.T) / sn2
+            eta = (n / b) * np.dot(A, r) / sn2
+            self._Lam = (1 - rate) * self._Lam + rate * Lam
+            self._eta = (1 - rate) * self._eta + rate * eta
+            self._setq()
+
+            if not hyper:
+                continue
+
+            # take an Adam step (ascending the bound) and keep the cholesky of
+            # Kuu up to date.
+            grad = self._batchgrad(Xb, yb, n / b)
+            m1 = 0.9 * m1 + 0.1 * grad
+            m2 = 0.999 * m2 + 0.001 * grad**2
+            step = (m1 / (1 - 0.9**i)) / (np.sqrt(m2 / (1 - 0.999**i)) + 1e-8)
+            self.set_hyper(self.get_hyper() + lr * step)
+            self._setchol()
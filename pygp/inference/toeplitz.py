@@ -0,0 +1,229 @@
+"""
+Exact GP inference for one-dimensional inputs on a regular grid, where the
+kernel matrix of a stationary kernel is Toeplitz.
+"""
+
+from __future__ import division
+from __future__ import absolute_import
+from __future__ import print_function
+
+import numpy as np
+
+from ._iterative import IterativeGP
+from ..utils.linalg import toeplitz_mvm, durbin
+
+__all__ = ['ToeplitzGP']
+
+
+def _lower_mvm(u, v):
+    """Multiply the lower-triangular Toeplitz matrix with column `u` by `v`."""
+    n = u.shape[0]
+    U = np.fft.rfft(u, 2*n).reshape((-1,) + (1,) * (v.ndim-1))
+    return np.fft.irfft(U * np.fft.rfft(v, 2*n, axis=0), 2*n, axis=0)[:n]
+
+
+def _correlate(u, v):
+    """Return the correlations `sum_p u[p] v[p+k]` for each lag `k`."""
+    n = u.shape[0]
+    F = np.conj(np.fft.rfft(u, 2*n)) * np.fft.rfft(v, 2*n)
+    return np.fft.irfft(F, 2*n)[:n]
+
+
+class ToeplitzGP(IterativeGP):
+    """
+    Exact GP inference for regularly spaced 1-D inputs.
+
+    This assumes a stationary kernel so that, if the inputs lie on a regular
+    grid, the kernel matrix is Toeplitz. The grid is given by `grid=(x0, h)`
+    or is otherwise detected from the data. If every grid point between the
+    smallest and largest input is observed exactly once the loglikelihood and
+    its gradient are computed exactly, using the Durbin recursion in O(n^2)
+    time and the Gohberg-Semencul formula for the inverse in O(n log n) time.
+    Otherwise the missing grid points are masked out and inference falls back
+    to the iterative methods of `IterativeGP`, using FFT-based products with
+    the kernel matrix.
+    """
+    def __init__(self, likelihood, kernel, mean, grid=None,
+                 rank=20, nprobe=10, tol=1e-8, maxiter=None, seed=0):
+        if kernel.ndim != 1:
+            raise ValueError('Toeplitz inference requires 1-D inputs')
+
+        super(ToeplitzGP, self).__init__(likelihood, kernel, mean,
+                                         rank, nprobe, tol, maxiter, seed)
+
+        # the grid, if given, and the grid indices of each data point.
+        self._grid = None if (grid is None) else tuple(map(float, grid))
+        self._x0 = None
+        self._h = None
+        self._idx = None
+        self._N = 0
+
+        # the first column of the kernel matrix on the grid; if the grid is
+        # complete also the first column of the inverse (with noise) and its
+        # log-determinant.
+        self._c = None
+        self._x = None
+        self._logdet = None
+
+    def reset(self):
+        for attr in ('x0', 'h', 'idx', 'c', 'x', 'logdet'):
+            setattr(self, '_' + attr, None)
+        self._N = 0
+        super(ToeplitzGP, self).reset()
+
+    @classmethod
+    def from_gp(cls, gp, grid=None):
+        if grid is None and isinstance(gp, ToeplitzGP):
+            grid = gp._grid
+        newgp = cls(gp._likelihood.copy(), gp._kernel.copy(), gp._mean, grid,
+                    **cls._options(gp))
+        if gp.ndata > 0:
+            X, y = gp.data
+            newgp.add_data(X, y)
+        return newgp
+
+    @property
+    def _complete(self):
+        """Whether the data covers every point of the grid exactly once."""
+        return self.ndata == self._N and self._x is not None
+
+    def _setgrid(self):
+        """Find the grid and the grid index of each data point."""
+        x = self._X[:, 0]
+        if self._grid is not None:
+            x0, h = self._grid
+        else:
+            d = np.diff(np.unique(x))
+            x0 = np.min(x)
+            h = np.min(d) if len(d) else 1.0
+
+        # the tolerance allows for inputs stored in single precision.
+        tol = max(1e-8, 8 * np.finfo(x.dtype).eps)
+        idx = np.round((x - x0) / h)
+        if np.any(idx < 0) or not np.allclose(x0 + idx*h, x,
+                                              rtol=tol, atol=tol*abs(h)):
+            raise ValueError('inputs do not lie on a regular grid')
+
+        # anchor the grid at the smallest input so that the points of a given
+        # grid which lie below the data don't count as missing.
+        k = np.min(idx)
+        self._x0 = x0 + k * h
+        self._h = h
+        self._idx = (idx - k).astype(int)
+        self._N = np.max(self._idx) + 1
+
+    def _column(self):
+        """Return the first column of the kernel on the grid."""
+        G = self._x0 + self._h * np.arange(self._N)[:, None]
+        return self._kernel.get(G[:1], G)[0]
+
+    def _column_grad(self):
+        """Return the gradients of `_column` wrt each kernel hyperparameter."""
+        G = self._x0 + self._h * np.arange(self._N)[:, None]
+        return np.array([dK[0] for dK in self._kernel.grad(G[:1], G)])
+
+    def _scatter(self, V):
+        """Map an array over the data to an array over the grid."""
+        U = np.zeros((self._N,) + V.shape[1:])
+        np.add.at(U, self._idx, V)
+        return U
+
+    def _mvm(self, V):
+        return toeplitz_mvm(self._c, self._scatter(V))[self._idx]
+
+    def _mvm_grad(self, V):
+        U = self._scatter(V)
+        return np.array([toeplitz_mvm(dc, U)[self._idx]
+                         for dc in self._column_grad()])
+
+    def _invmvm(self, V):
+        """
+        Multiply by the inverse of the (complete) kernel matrix using the
+        Gohberg-Semencul formula `T^{-1} = (A A^T - B B^T) / x0` where `A` and
+        `B` are lower-triangular Toeplitz matrices formed from the first
+        column `x` of the inverse.
+        """
+        x = self._x
+        xt = np.r_[0, x[:0:-1]]
+        AV = _lower_mvm(x, _lower_mvm(x, V[::-1])[::-1])
+        BV = _lower_mvm(xt, _lower_mvm(xt, V[::-1])[::-1])
+        return (AV - BV) / x[0]
+
+    def _invdiagsums(self):
+        """
+        Return the sums of each diagonal of the (complete) inverse kernel
+        matrix, ie `s[k] = sum_i T^{-1}[i, i+k]`.
+        """
+        n = self._N
+        k = np.arange(n)
+        p = np.arange(n)
+        x = self._x
+        xt = np.r_[0, x[:0:-1]]
+
+        # the k-th diagonal sum of L(u) L(u)^T is sum_p (n-k-p) u[p] u[p+k].
+        def sums(u):
+            return (n - k) * _correlate(u, u) - _correlate(p*u, u)
+
+        return (sums(x) - sums(xt)) / x[0]
+
+    def _solve(self, B, lanczos=False):
+        if not self._complete or lanczos:
+            return super(ToeplitzGP, self)._solve(B, lanczos)
+        return self._invmvm(self._scatter(np.asarray(B)))[self._idx]
+
+    def _update(self):
+        self._setgrid()
+        self._c = self._column()
+
+        if self.ndata == self._N and np.all(np.bincount(self._idx) == 1):
+            c = self._c.copy()
+            c[0] += self._likelihood.s2
+            self._x, self._logdet = durbin(c)
+            self._L = self._R = None
+            self._alpha = self._solve(self._y - self._mean)
+        else:
+            self._x = self._logdet = None
+            super(ToeplitzGP, self)._update()
+
+    def _updatescale(self, c):
+        self._c *= c
+        if self._complete:
+            self._x /= c
+            self._logdet += self._N * np.log(c)
+            self._alpha /= c
+        else:
+            super(ToeplitzGP, self)._updatescale(c)
+
+    def _loglikelihood(self, grad=False):
+        if not self._complete:
+            return super(ToeplitzGP, self)._loglikelihood(grad)
+
+        n = self.ndata
+        sn2 = self._likelihood.s2
+        r = self._y - self._mean
+
+        lZ = -0.5 * np.inner(r, self._alpha)
+        lZ -= 0.5 * self._logdet
+        lZ -= 0.5 * np.log(2 * np.pi) * n
+
+        if not grad:
+            return lZ
+
+        # the diagonal sums of Q = T^{-1} - alpha alpha^T, with alpha ordered
+        # by grid index. since each dK is symmetric Toeplitz with first column
+        # dc we then have tr(Q dK) = dc[0] s[0] + 2 sum_k dc[k] s[k].
+        a = self._scatter(self._alpha)
+        s = self._invdiagsums() - _correlate(a, a)
+        s[1:] *= 2
+
+        dlZ = np.r_[
+            # derivative wrt the likelihood's noise term.
+            -sn2 * s[0],
+
+            # derivative wrt each kernel hyperparameter.
+            -0.5 * np.dot(self._column_grad(), s),
+
+            # derivative wrt the mean.
+            np.sum(self._alpha)]
+
+        return lZ, dlZ
@@ -0,0 +1,298 @@
+"""
+Vecchia approximation to GP inference, where each observation is conditioned
+only on its nearest previously ordered neighbours.
+"""
+
+from __future__ import division
+from __future__ import absolute_import
+from __future__ import print_function
+
+import numpy as np
+import scipy.linalg as sla
+from scipy.spatial import cKDTree
+
+from ._base import GP
+from ..likelihoods import Gaussian
+from ..kernels._distances import Distances
+
+__all__ = ['VecchiaGP']
+
+
+def _neighbours(X, m, start=0):
+    """
+    Given ordered inputs `X` return an (n-start,m)-array whose ith row holds
+    the indices of the (at most) `m` nearest neighbours of `X[start+i]` among
+    the points preceding it, nearest first. Missing neighbours are given by
+    -1.
+    """
+    n = len(X)
+    nbrs = np.full((n-start, m), -1, dtype=int)
+
+    # the points are processed in blocks of ranks [lo, hi) with hi = 2*lo,
+    # querying a tree over the first hi points. at least half of these
+    # precede each point in the block, so few candidates are needed.
+    lo = start
+    while lo < n:
+        hi = min(n, max(2*lo, lo + 1))
+        tree = cKDTree(X[:hi])
+        rank = np.arange(lo, hi)
+        todo = np.arange(hi-lo)
+        k = 2*m + 1
+
+        # query the nearest candidates and keep those preceding each point,
+        # doubling the number of candidates for any points without enough.
+        while len(todo) > 0:
+            k = min(k, hi)
+            _, J = tree.query(X[rank[todo]], k)
+            J = J.reshape(len(todo), -1)
+            prev = J < rank[todo, None]
+            done = (np.sum(prev, axis=1) >= np.minimum(m, rank[todo]))
+            done |= (k == hi)
+
+            # move the preceding points to the front of each row, keeping
+            # them sorted by distance.
+            J, prev = J[done], prev[done]
+            i = np.argsort(~prev, axis=1, kind='mergesort')[:, :m]
+            J = np.where(np.take_along_axis(prev, i, 1),
+                         np.take_along_axis(J, i, 1), -1)
+            nbrs[lo - start + todo[done], :J.shape[1]] = J
+
+            todo = todo[~done]
+            k *= 2
+
+        lo = hi
+
+    return nbrs
+
+
+class VecchiaGP(GP):
+    """
+    Vecchia GP inference.
+
+    The data is ordered and the likelihood is factorized into the product of
+    the conditionals of each observation given the observations at its `m`
+    nearest previously ordered inputs, which are found using a KD-tree. This
+    is equivalent to a sparse approximation of the inverse cholesky of the
+    kernel matrix, and the loglikelihood and its gradient take O(n m^3) time.
+    The conditionals are independent of one another and are evaluated for
+    `blocksize` points at a time using batched linear algebra. Predictions
+    condition on the `m` nearest training inputs of each test point.
+
+    The data can be ordered randomly (using `seed`), by its first coordinate,
+    or in the order it was given by setting `order` to 'random', 'coord', or
+    'data'. Only the latter allows data to be added incrementally, as new
+    points are then simply ordered after the existing data.
+
+    Note that the neighbours are found using the Euclidean distance between
+    the raw inputs, so these should be scaled sensibly.
+    """
+    def __init__(self, likelihood, kernel, mean, m=10, order='random',
+                 seed=0):
+        if not isinstance(likelihood, Gaussian):
+            raise ValueError('vecchia inference requires a Gaussian '
+                             'likelihood')
+        if order not in ('random', 'coord', 'data'):
+            raise ValueError('unknown ordering')
+        if m < 1:
+            raise ValueError('the number of neighbours must be positive')
+
+        super(VecchiaGP, self).__init__(likelihood, kernel, mean)
+
+        self._m = int(m)
+        self._order = order
+        self._seed = seed
+
+        # the ordering of the data and the neighbours of each ordered point,
+        # both given as indices into the data. the KD-tree over the inputs
+        # used for prediction is only built once it is needed.
+        self._perm = None
+        self._nbrs = None
+        self._tree = None
+
+    @classmethod
+    def from_gp(cls, gp, m=None):
+        order, seed = 'random', 0
+        if isinstance(gp, VecchiaGP):
+            m = gp._m if (m is None) else m
+            order, seed = gp._order, gp._seed
+        m = 10 if (m is None) else m
+        newgp = cls(gp._likelihood.copy(), gp._kernel.copy(), gp._mean, m,
+                    order, seed)
+        newgp.blocksize = gp.blocksize
+        if gp.ndata > 0:
+            X, y = gp.data
+            newgp.add_data(X, y)
+        return newgp
+
+    def reset(self):
+        self._perm = None
+        self._nbrs = None
+        self._tree = None
+        super(VecchiaGP, self).reset()
+
+    def _update(self):
+        n = self.ndata
+        if self._order == 'random':
+            perm = np.random.RandomState(self._seed).permutation(n)
+        elif self._order == 'coord':
+            perm = np.argsort(self._X[:, 0], kind='mergesort')
+        else:
+            perm = np.arange(n)
+
+        nbrs = _neighbours(self._X[perm], self._m)
+        self._perm = perm
+        self._nbrs = np.where(nbrs < 0, -1, perm[nbrs])
+        self._tree = None
+
+    def _updateinc(self, X, y):
+        if self._order != 'data':
+            raise NotImplementedError
+
+        # the new points come after the existing data, so only their
+        # neighbours need to be found.
+        n = self.ndata
+        nbrs = _neighbours(np.r_[self._X, X], self._m, n)
+        self._perm = np.r_[self._perm, n + np.arange(len(X))]
+        self._nbrs = np.r_[self._nbrs, nbrs]
+        self._tree = None
+
+    def _updatehyper(self, hyper0):
+        # the ordering and the neighbours don't depend on the hyperparameters
+        # and nothing else is precomputed.
+        pass
+
+    def _updatemean(self, mean0):
+        pass
+
+    def _updatescale(self, c):
+        pass
+
+    def _neighbours(self, X):
+        """
+        Return the indices of the nearest training inputs to each point in
+        `X` as an (n,k)-array where k is the smaller of `m` and `ndata`.
+        """
+        if self._tree is None:
+            self._tree = cKDTree(self._X)
+        k = min(self._m, self.ndata)
+        _, J = self._tree.query(X, k)
+        return J.reshape(len(X), k)
+
+    def _full_posterior(self, X):
+        mu = np.full(X.shape[0], self._mean)
+        Sigma = self._kernel.get(X)
+
+        # condition jointly on the union of the test points' neighbours.
+        if self._X is not None:
+            J = np.unique(self._neighbours(X))
+            C = self._kernel.get(self._X[J])
+            C += self._likelihood.s2 * np.eye(len(J))
+            R = sla.cholesky(C)
+            V = sla.solve_triangular(R, self._kernel.get(self._X[J], X),
+                                     trans=True)
+            a = sla.solve_triangular(R, self._y[J] - self._mean, trans=True)
+            mu += np.dot(V.T, a)
+            Sigma -= np.dot(V.T, V)
+
+        return mu, Sigma
+
+    def _marg_posterior(self, X, grad=False):
+        mu = np.full(X.shape[0], self._mean)
+        s2 = self._kernel.dget(X)
+        dmu = np.zeros_like(X)
+        ds2 = np.zeros_like(X)
+
+        if self._X is not None:
+            sn2 = self._likelihood.s2
+            J = self._neighbours(X)
+            k = J.shape[1]
+
+            for i in xrange(0, len(X), self._blocksize):
+                b = slice(i, i + self._blocksize)
+
+                # the kernel between the neighbours and the test point, which
+                # comes last in each stack.
+                Z = np.concatenate((self._X[J[b]], X[b, None]), axis=1)
+                K = self._kernel.get(Distances(Z))
+                C = K[:, :k, :k] + sn2 * np.eye(k)
+                Kxs = K[:, :k, k]
+                r = self._y[J[b]] - self._mean
+
+                CK = np.linalg.solve(C, Kxs[:, :, None])[:, :, 0]
+                mu[b] += np.einsum('ij,ij->i', CK, r)
+                s2[b] -= np.einsum('ij,ij->i', CK, Kxs)
+
+                if grad:
+                    # the kernel gradients wrt each test point, evaluated for
+                    # the whole stack of neighbours at once.
+                    a = np.linalg.solve(C, r[:, :, None])[:, :, 0]
+                    dK = self._kernel.grady(Distances(self._X[J[b]],
+                                                      X[b, None]))
+                    dK = dK[:, :, 0, :]
+                    dmu[b] += np.einsum('ij,ijk->ik', a, dK)
+                    ds2[b] -= 2 * np.einsum('ij,ijk->ik', CK, dK)
+
+        if not grad:
+            return (mu, s2)
+
+        return (mu, s2, dmu, ds2)
+
+    def _loglikelihood(self, grad=False):
+        sn2 = self._likelihood.s2
+        n = self.ndata
+        m = self._m
+
+        lZ = 0.0
+        dlZ = np.zeros(self.nhyper)
+
+        for i in xrange(0, n, self._blocksize):
+            b = slice(i, i + self._blocksize)
+
+            # stack each point's neighbours followed by the point itself.
+            idx = np.c_[self._nbrs[b], self._perm[b]]
+            pad = (idx < 0)
+            real = ~pad
+
+            # the joint covariance of each stack, where the missing
+            # neighbours are replaced by independent standard normals with
+            # zero residual. these cancel in the conditionals below.
+            dist = Distances(self._X[idx])
+            C = self._kernel.get(dist)
+            C[pad[:, :, None] | pad[:, None, :]] = 0
+            C += np.where(real, sn2, 1.0)[:, :, None] * np.eye(m+1)
+            r = np.where(real, self._y[idx] - self._mean, 0.0)
+
+            # each conditional is the joint density of the stack divided by
+            # that of the neighbours alone.
+            Ci = np.linalg.inv(C)
+            Cn = np.linalg.inv(C[:, :m, :m])
+            a = np.einsum('bij,bj->bi', Ci, r)
+            an = np.einsum('bij,bj->bi', Cn, r[:, :m])
+
+            lZ -= 0.5 * (np.sum(a * r) - np.sum(an * r[:, :m]))
+            lZ -= 0.5 * (np.sum(np.linalg.slogdet(C)[1]) -
+                         np.sum(np.linalg.slogdet(C[:, :m, :m])[1]))
+            lZ -= 0.5 * np.log(2 * np.pi) * len(idx)
+
+            if not grad:
+                continue
+
+            # the derivative of each log-conditional wrt C is given by W.
+            # this is zero for any missing neighbours.
+            W = 0.5 * (a[:, :, None] * a[:, None, :] - Ci)
+            W[:, :m, :m] -= 0.5 * (an[:, :, None] * an[:, None, :] - Cn)
+
+            dlZ += np.r_[
+                # derivative wrt the likelihood's noise term.
+                2 * sn2 * np.sum(np.diagonal(W, 0, 1, 2)[real]),
+
+                # derivative wrt each kernel hyperparameter.
+                self._kernel.grad_contract(W, dist),
+
+                # derivative wrt the mean.
+                np.sum(a) - np.sum(an)]
+
+        if not grad:
+            return lZ
+
+        return lZ, dlZ
@@ -8,6 +8,7 @@ from __future__ import absolute_import
 from __future__ import print_function
 
 # global imports
+import numpy as np
 from abc import abstractmethod
 
 # local imports
@@ -53,6 +54,27 @@ class Kernel(Parameterized):
         """
         raise NotImplementedError
 
+    def get_with_grad(self, X1, X2=None):
+        """
+        Evaluate the kernel and its gradient together. Returns the kernel
+        matrix `K` and an array of shape `(nhyper,) + K.shape` whose ith slice
+        is the gradient wrt the ith hyperparameter. Kernels can implement this
+        directly to share computations between the two.
+        """
+        K = self.get(X1, X2)
+        dK = np.empty((self.nhyper,) + K.shape, K.dtype)
+        for i, dKi in enumerate(self.grad(X1, X2)):
+            dK[i] = dKi
+        return K, dK
+
+    def grad_contract(self, Q, X1, X2=None):
+        """
+        Return the contraction of `Q` with each gradient of the kernel, i.e.
+        the derivative of `sum(Q * K)` wrt each hyperparameter, as a vector.
+        Kernels can implement this directly to avoid forming the gradients.
+        """
+        return np.array([np.sum(Q * dK) for dK in self.grad(X1, X2)])
+
     @abstractmethod
     def dgrad(self, X):
         """Evaluate the gradients of the self covariances."""
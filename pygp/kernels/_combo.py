@@ -15,6 +15,7 @@ import operator as op
 
 # local imports
 from ._base import Kernel
+from ._distances import Distances
 
 # exported symbols
 __all__ = ['ComboKernel', 'SumKernel', 'ProductKernel', 'combine']
@@ -90,6 +91,17 @@ class ComboKernel(Kernel):
     def get_hyper(self):
         return np.hstack(p.get_hyper() for p in self._parts)
 
+    def _distances(self, X1, X2=None):
+        """
+        Return a cached `Distances` object for the given inputs which is
+        passed to every part, so that quantities such as the unscaled
+        distances are computed only once per call rather than once per part.
+        Nested combinations receive and share the same object.
+        """
+        if isinstance(X1, Distances):
+            return X1
+        return Distances(X1, X2)
+
     def set_hyper(self, hyper):
         a = 0
         for p in self._parts:
@@ -104,7 +116,8 @@ class SumKernel(ComboKernel):
     """Kernel representing a sum of other kernels."""
 
     def get(self, X1, X2=None):
-        fiterable = (p.get(X1, X2) for p in self._parts)
+        dist = self._distances(X1, X2)
+        fiterable = (p.get(dist) for p in self._parts)
         return sum(fiterable)
 
     def dget(self, X):
@@ -112,9 +125,20 @@ class SumKernel(ComboKernel):
         return sum(fiterable)
 
     def grad(self, X1, X2=None):
-        giterable = (p.grad(X1, X2) for p in self._parts)
+        dist = self._distances(X1, X2)
+        giterable = (p.grad(dist) for p in self._parts)
         return it.chain.from_iterable(giterable)
 
+    def get_with_grad(self, X1, X2=None):
+        dist = self._distances(X1, X2)
+        K, dK = zip(*[p.get_with_grad(dist) for p in self._parts])
+        return sum(K), np.concatenate(dK)
+
+    def grad_contract(self, Q, X1, X2=None):
+        dist = self._distances(X1, X2)
+        return np.concatenate([p.grad_contract(Q, dist)
+                               for p in self._parts])
+
     def dgrad(self, X):
         giterable = (p.dgrad(X) for p in self._parts)
         return it.chain.from_iterable(giterable)
@@ -124,7 +148,8 @@ class ProductKernel(ComboKernel):
     """Kernel representing a product of other kernels."""
 
     def get(self, X1, X2=None):
-        fiterable = (p.get(X1, X2) for p in self._parts)
+        dist = self._distances(X1, X2)
+        fiterable = (p.get(dist) for p in self._parts)
         return product(fiterable)
 
     def dget(self, X):
@@ -132,12 +157,30 @@ class ProductKernel(ComboKernel):
         return product(fiterable)
 
     def grad(self, X1, X2=None):
-        fiterable = (p.get(X1, X2) for p in self._parts)
-        giterable = (p.grad(X1, X2) for p in self._parts)
+        # the parts are evaluated once up front, but their gradients are
+        # yielded one at a time so that at most one is held in memory.
+        dist = self._distances(X1, X2)
+        fiterable = (p.get(dist) for p in self._parts)
+        giterable = (p.grad(dist) for p in self._parts)
         for Mi, grads in zip(product_but(fiterable), giterable):
             for dM in grads:
                 yield Mi*dM
 
+    def get_with_grad(self, X1, X2=None):
+        dist = self._distances(X1, X2)
+        # each part is evaluated only once, and the gradients of each part
+        # are scaled by the product of every other part.
+        K, dK = zip(*[p.get_with_grad(dist) for p in self._parts])
+        return product(K), np.concatenate([Mi*dKi for Mi, dKi in
+                                           zip(product_but(K), dK)])
+
+    def grad_contract(self, Q, X1, X2=None):
+        dist = self._distances(X1, X2)
+        fiterable = (p.get(dist) for p in self._parts)
+        return np.concatenate([p.grad_contract(Q*Mi, dist)
+                               for Mi, p in zip(product_but(fiterable),
+                                                self._parts)])
+
     def dgrad(self, X):
         fiterable = (p.dget(X) for p in self._parts)
         giterable = (p.dgrad(X) for p in self._parts)
@@ -8,16 +8,21 @@ from __future__ import absolute_import
 from __future__ import print_function
 
 # global imports
+import numpy as np
+import scipy.linalg as sla
 import scipy.spatial.distance as ssd
 
 # exported symbols
-__all__ = ['rescale', 'sqdist', 'sqdist_foreach']
+__all__ = ['rescale', 'sqdist', 'sqdist_blas', 'sqdist_foreach',
+           'sqdist_contract', 'Distances', 'distances']
 
 
 def rescale(ell, X1, X2):
     """
-    Rescale the two sets of vectors by `ell`.
+    Rescale the two sets of vectors by `ell`. This is done in the precision of
+    `X1` so that the lengthscales don't promote single precision inputs.
     """
+    ell = np.asarray(ell, X1.dtype)
     X1 = X1 / ell
     X2 = X2 / ell if (X2 is not None) else None
     return X1, X2
@@ -27,18 +32,82 @@ def diff(X1, X2=None):
     """
     Return the differences between vectors in `X1` and `X2`. If `X2` is not
     given this will return the pairwise differences in `X1`.
+
+    Here and below `X1` and `X2` can also be stacks of sets of vectors, i.e.
+    (...,n,d)-arrays, in which case the distances are computed for each set.
     """
     X2 = X1 if (X2 is None) else X2
-    return X1[:, None, :] - X2[None, :, :]
+    return X1[..., :, None, :] - X2[..., None, :, :]
+
+
+# inputs with at least this many dimensions have their squared distances
+# computed by BLAS rather than by cdist or by forming their differences.
+BLAS_MINDIM = 16
 
 
 def sqdist(X1, X2=None):
     """
     Return the squared-distance between two sets of vector. If `X2` is not
     given this will return the pairwise squared-distances in `X1`.
+
+    For high-dimensional inputs the squares are expanded as |x|^2 + |y|^2 -
+    2 x^T y so that the cross terms are given by a matrix product; see
+    `sqdist_blas`.
     """
+    if X1.shape[-1] >= BLAS_MINDIM:
+        return sqdist_blas(X1, X2)
     X2 = X1 if (X2 is None) else X2
-    return ssd.cdist(X1, X2, 'sqeuclidean')
+    if X1.ndim > 2:
+        return np.sum(diff(X1, X2)**2, axis=-1)
+    return ssd.cdist(X1, X2, 'sqeuclidean').astype(X1.dtype, copy=False)
+
+
+def sqdist_blas(X1, X2=None):
+    """
+    Return the squared-distances between `X1` and `X2` by expanding the
+    squares so that the cross terms are given by a single matrix product. If
+    `X2` is not given only the lower triangle of this product is computed and
+    then mirrored, and the diagonal is exactly zero; this is also the case
+    if `X2` is the same array as `X1`. Any negative distances due to
+    round-off are clamped to zero.
+    """
+    X2 = None if (X2 is X1) else X2
+
+    # the inputs are centered to reduce the cancellation in the expansion.
+    # the mean is taken over each set of vectors so that stacks of nearby
+    # points are centered individually.
+    mu = np.mean(X1, axis=-2, keepdims=True)
+    X1 = X1 - mu
+    X2 = None if (X2 is None) else X2 - mu
+    sq1 = np.sum(X1**2, axis=-1)
+
+    if X2 is None and X1.ndim == 2:
+        # syrk fills the upper triangle of the fortran-ordered matrix, i.e.
+        # the lower triangle of its transpose. this is mirrored one block of
+        # rows at a time to avoid forming any large temporaries.
+        n = X1.shape[0]
+        syrk, = sla.get_blas_funcs(('syrk',), (X1,))
+        D = syrk(-2., X1.T, trans=1).T
+        D += sq1[:, None]
+        D += sq1
+        for i in xrange(0, n, 256):
+            j = min(n, i + 256)
+            B = D[i:j, i:j]
+            B[:] = np.tril(B) + np.tril(B, -1).T
+            D[i:j, j:] = D[j:, i:j].T
+        D.flat[::n+1] = 0
+
+    else:
+        sq2 = sq1 if (X2 is None) else np.sum(X2**2, axis=-1)
+        D = np.matmul(X1, np.swapaxes(X1 if (X2 is None) else X2, -1, -2))
+        D *= -2
+        D += sq1[..., :, None]
+        D += sq2[..., None, :]
+        if X2 is None:
+            i = np.arange(D.shape[-1])
+            D[..., i, i] = 0
+
+    return np.maximum(D, 0, out=D)
 
 
 def sqdist_foreach(X1, X2=None):
@@ -48,5 +117,99 @@ def sqdist_foreach(X1, X2=None):
     pairwise squared-distances in `X1` in each dimension.
     """
     X2 = X1 if (X2 is None) else X2
-    for i in xrange(X1.shape[1]):
-        yield ssd.cdist(X1[:, i, None], X2[:, i, None], 'sqeuclidean')
+    for i in xrange(X1.shape[-1]):
+        yield sqdist(X1[..., i, None], X2[..., i, None])
+
+
+def sqdist_contract(P, X1, X2=None):
+    """
+    Return the contraction of `P` with the squared-distances between `X1` and
+    `X2` in each dimension, i.e. `sum(P * D)` for each `D` returned by
+    `sqdist_foreach`, without forming any of these matrices.
+    """
+    X2 = X1 if (X2 is None) else X2
+
+    # expanding the squares gives the sum of P's rows and columns weighted by
+    # the squared inputs, minus the cross terms given by a single product.
+    # the inputs are centered first to avoid any cancellation.
+    mu = np.mean(X1.reshape(-1, X1.shape[-1]), axis=0)
+    X1 = X1 - mu
+    X2 = X2 - mu
+    A = X1**2 * np.sum(P, axis=-1)[..., None] - 2 * X1 * np.matmul(P, X2)
+    B = X2**2 * np.sum(P, axis=-2)[..., None]
+    return (np.sum(A.reshape(-1, A.shape[-1]), axis=0) +
+            np.sum(B.reshape(-1, B.shape[-1]), axis=0))
+
+
+class Distances(object):
+    """
+    Distances between two fixed sets of vectors `X1` and `X2` (or the pairwise
+    distances in `X1` if `X2` is not given). If `cache` is true the squared
+    distances are computed once and only rescaled on subsequent calls with a
+    scalar lengthscale. Anything per-dimension, i.e. for ARD lengthscales or
+    the raw differences, would take d times as much memory and is instead
+    computed on demand from the rescaled inputs. Stationary kernels accept an
+    instance of this class in place of their first argument, both when
+    evaluating the kernel and its gradients, which lets combinations of
+    kernels share one instance.
+    """
+    def __init__(self, X1, X2=None, cache=True):
+        self.X1 = X1
+        self.X2 = X2
+        self._cache = cache
+        self._S = None
+
+    def block(self, i, j):
+        """
+        Return a `Distances` object for the vectors `X1[i]` and `X2[j]` whose
+        cached distances are a view of those cached by this object, e.g. to
+        evaluate a kernel one tile at a time. `i` and `j` should be slices so
+        that nothing is copied.
+        """
+        X2 = self.X1 if (self.X2 is None) else self.X2
+        dist = Distances(self.X1[..., i, :], X2[..., j, :], self._cache)
+        if self._S is not None:
+            dist._S = self._S[..., i, j]
+        return dist
+
+    def diff(self, ell=1.):
+        """
+        Return the differences between vectors rescaled by `ell`; see `diff`.
+        """
+        return diff(*rescale(ell, self.X1, self.X2))
+
+    def sqdist(self, ell=1.):
+        """
+        Return the squared-distances between vectors rescaled by `ell`; see
+        `sqdist`.
+        """
+        if not self._cache or np.size(ell) > 1:
+            return sqdist(*rescale(ell, self.X1, self.X2))
+        if self._S is None:
+            self._S = sqdist(self.X1, self.X2)
+        return self._S / np.asarray(ell, self._S.dtype)**2
+
+    def sqdist_foreach(self, ell=1.):
+        """
+        Return an iterator over the per-dimension squared-distances rescaled
+        by `ell`; see `sqdist_foreach`.
+        """
+        return sqdist_foreach(*rescale(ell, self.X1, self.X2))
+
+    def sqdist_contract(self, P, ell=1.):
+        """
+        Return the contraction of `P` with the per-dimension squared-distances
+        rescaled by `ell`; see `sqdist_contract`.
+        """
+        return sqdist_contract(P, *rescale(ell, self.X1, self.X2))
+
+
+def distances(X1, X2=None):
+    """
+    Return a `Distances` object for the given vectors. If `X1` is already such
+    an object it is returned directly (and `X2` is ignored); otherwise the
+    returned object computes everything on demand without caching.
+    """
+    if isinstance(X1, Distances):
+        return X1
+    return Distances(X1, X2, cache=False)
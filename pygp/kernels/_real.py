@@ -36,7 +36,11 @@ class RealKernel(Kernel):
         return ProductKernel(*combine(ProductKernel, self, other))
 
     def transform(self, X):
-        return np.array(X, ndmin=2, dtype=float, copy=False)
+        # single precision inputs are kept as is so that the kernel is
+        # evaluated in single precision; anything else becomes a double.
+        X = np.array(X, ndmin=2, copy=False)
+        dtype = np.float32 if (X.dtype == np.float32) else float
+        return np.array(X, dtype=dtype, copy=False)
 
     @abstractmethod
     def gradx(self, X1, X2=None):
@@ -72,6 +76,15 @@ class RealKernel(Kernel):
         """
         raise NotImplementedError
 
+    def grad_spectrum(self, W):
+        """
+        Given weights W sampled by `sample_spectrum` return the derivatives of
+        these weights with respect to each hyperparameter, holding the
+        underlying random draws fixed, as an (nhyper,n,d)-array. Also return
+        the derivatives of the normalizing constant as an nhyper-vector.
+        """
+        raise NotImplementedError
+
 
 def _can_combine(*parts):
     """
@@ -94,13 +107,16 @@ class SumKernel(RealKernel, SumKernel_):
         self.ndim = self._parts[0].ndim
 
     def gradx(self, X1, X2=None):
-        return sum(p.gradx(X1, X2) for p in self._parts)
+        dist = self._distances(X1, X2)
+        return sum(p.gradx(dist) for p in self._parts)
 
     def grady(self, X1, X2=None):
-        return sum(p.grady(X1, X2) for p in self._parts)
+        dist = self._distances(X1, X2)
+        return sum(p.grady(dist) for p in self._parts)
 
     def gradxy(self, X1, X2=None):
-        return sum(p.gradxy(X1, X2) for p in self._parts)
+        dist = self._distances(X1, X2)
+        return sum(p.gradxy(dist) for p in self._parts)
 
     def sample_spectrum(self, N, rng=None):
         raise NotImplementedError
@@ -117,24 +133,27 @@ class ProductKernel(RealKernel, ProductKernel_):
         self.ndim = self._parts[0].ndim
 
     def gradx(self, X1, X2=None):
-        fiterable = (p.get(X1, X2)[:, :, None] for p in self._parts)
-        giterable = (p.gradx(X1, X2) for p in self._parts)
+        dist = self._distances(X1, X2)
+        fiterable = (p.get(dist)[..., None] for p in self._parts)
+        giterable = (p.gradx(dist) for p in self._parts)
         return sum(f*g for f, g in zip(product_but(fiterable), giterable))
 
     def grady(self, X1, X2=None):
-        fiterable = (p.get(X1, X2)[:, :, None] for p in self._parts)
-        giterable = (p.grady(X1, X2) for p in self._parts)
+        dist = self._distances(X1, X2)
+        fiterable = (p.get(dist)[..., None] for p in self._parts)
+        giterable = (p.grady(dist) for p in self._parts)
         return sum(f*g for f, g in zip(product_but(fiterable), giterable))
 
     def gradxy(self, X1, X2=None):
-        # the kernel evaluations.
-        K = [p.get(X1, X2) for p in self._parts]
+        # the kernel evaluations, which share the distances between inputs.
+        dist = self._distances(X1, X2)
+        K = [p.get(dist) for p in self._parts]
         Kn = product_but(K)
 
         # the gradients we need.
-        Gx = [p.gradx(X1, X2) for p in self._parts]
-        Gy = [p.grady(X1, X2) for p in self._parts]
-        Gxy = [p.gradxy(X1, X2) for p in self._parts]
+        Gx = [p.gradx(dist) for p in self._parts]
+        Gy = [p.grady(dist) for p in self._parts]
+        Gxy = [p.gradxy(dist) for p in self._parts]
 
         # the part of the gradient corresponding to the two partial derivatives
         # with respect to xy.
@@ -13,7 +13,7 @@ from mwhutils.random import rstate
 
 # local imports
 from ._real import RealKernel
-from ._distances import rescale, diff, sqdist, sqdist_foreach
+from ._distances import distances
 from ..utils.models import printable
 
 # exported symbols
@@ -67,15 +67,16 @@ class Matern(RealKernel):
         self._logell = hyper[1] if self._iso else hyper[1:]
 
     def get(self, X1, X2=None):
-        X1, X2 = rescale(np.exp(self._logell)/np.sqrt(self._d), X1, X2)
-        D = np.sqrt(sqdist(X1, X2))
+        ell = np.exp(self._logell) / np.sqrt(self._d)
+        D = np.sqrt(distances(X1, X2).sqdist(ell))
         S = np.exp(self._logsf*2 - D)
         K = S * self._f(D)
         return K
 
     def grad(self, X1, X2=None):
-        X1, X2 = rescale(np.exp(self._logell)/np.sqrt(self._d), X1, X2)
-        D = np.sqrt(sqdist(X1, X2))
+        ell = np.exp(self._logell) / np.sqrt(self._d)
+        dist = distances(X1, X2)
+        D = np.sqrt(dist.sqdist(ell))
         S = np.exp(self._logsf*2 - D)
         K = S * self._f(D)
         M = S * self._df(D)
@@ -84,11 +85,44 @@ class Matern(RealKernel):
         if self._iso:
             yield M*D       # derivative wrt logell (iso)
         else:
-            for D_ in sqdist_foreach(X1, X2):
+            for D_ in dist.sqdist_foreach(ell):
                             # derivative(s) wrt logell (ard)
                 with np.errstate(invalid='ignore'):
                     yield np.where(D < 1e-12, 0, M*D_/D)
 
+    def get_with_grad(self, X1, X2=None):
+        ell = np.exp(self._logell) / np.sqrt(self._d)
+        dist = distances(X1, X2)
+        D = np.sqrt(dist.sqdist(ell))
+        S = np.exp(self._logsf*2 - D)
+        K = S * self._f(D)
+        M = S * self._df(D)
+
+        dK = np.empty((self.nhyper,) + K.shape, K.dtype)
+        dK[0] = 2*K
+        if self._iso:
+            dK[1] = M*D
+        else:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                M = np.where(D < 1e-12, 0, M/D)
+            for i, D_ in enumerate(dist.sqdist_foreach(ell)):
+                dK[1+i] = M*D_
+        return K, dK
+
+    def grad_contract(self, Q, X1, X2=None):
+        ell = np.exp(self._logell) / np.sqrt(self._d)
+        dist = distances(X1, X2)
+        D = np.sqrt(dist.sqdist(ell))
+        S = Q * np.exp(self._logsf*2 - D)
+        P = S * self._f(D)
+        M = S * self._df(D)
+
+        if self._iso:
+            return np.r_[2*np.sum(P), np.sum(M*D)]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            M = np.where(D < 1e-12, 0, M/D)
+        return np.r_[2*np.sum(P), dist.sqdist_contract(M, ell)]
+
     def dget(self, X1):
         return np.exp(self._logsf*2) * np.ones(len(X1))
 
@@ -99,14 +133,16 @@ class Matern(RealKernel):
 
     def gradx(self, X1, X2=None):
         ell = np.exp(self._logell) / np.sqrt(self._d)
-        X1, X2 = rescale(ell, X1, X2)
-        D1 = diff(X1, X2)
+        dist = distances(X1, X2)
 
-        D = np.sqrt(np.sum(D1**2, axis=-1))
+        D = np.sqrt(dist.sqdist(ell))
         S = np.exp(self._logsf*2 - D)
-        with np.errstate(invalid='ignore'):
+        with np.errstate(divide='ignore', invalid='ignore'):
             M = np.where(D < 1e-12, 0, S * self._df(D) / D)
-        G = -M[:, :, None] * D1 / ell
+
+        G = dist.diff(ell)
+        G *= M[..., None]
+        G /= -ell
 
         return G
 
@@ -124,3 +160,14 @@ class Matern(RealKernel):
         g = np.tile(rng.gamma(a, 1/a, N), (self.ndim, 1)).T
         W = (rng.randn(N, self.ndim) / ell) / np.sqrt(g)
         return W, sf2
+
+    def grad_spectrum(self, W):
+        # the weights are proportional to 1/ell given the random draws.
+        dW = np.zeros((self.nhyper,) + W.shape)
+        if self._iso:
+            dW[1] = -W
+        else:
+            for i in xrange(self.ndim):
+                dW[1+i, :, i] = -W[:, i]
+        dsf2 = np.r_[2 * np.exp(self._logsf*2), np.zeros(self.nhyper-1)]
+        return dW, dsf2
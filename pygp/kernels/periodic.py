@@ -12,7 +12,7 @@ import numpy as np
 
 # local imports
 from ._real import RealKernel
-from ._distances import diff, sqdist
+from ._distances import distances
 from ..utils.models import printable
 
 # exported symbols
@@ -54,7 +54,7 @@ class Periodic(RealKernel):
         sf2 = np.exp(self._logsf*2)
         ell = np.exp(self._logell)
         p = np.exp(self._logp)
-        D = np.sqrt(sqdist(X1, X2)) * np.pi / p
+        D = np.sqrt(distances(X1, X2).sqdist()) * np.pi / p
         K = sf2 * np.exp(-2*(np.sin(D) / ell)**2)
         return K
 
@@ -64,7 +64,7 @@ class Periodic(RealKernel):
         p = np.exp(self._logp)
 
         # get the distance and a few transformations
-        D = np.sqrt(sqdist(X1, X2)) * np.pi / p
+        D = np.sqrt(distances(X1, X2).sqdist()) * np.pi / p
         R = np.sin(D) / ell
         S = R**2
         E = 2 * sf2 * np.exp(-2*S)
@@ -73,6 +73,22 @@ class Periodic(RealKernel):
         yield 2*E*S
         yield 2*E*R*D * np.cos(D) / ell
 
+    def get_with_grad(self, X1, X2=None):
+        sf2 = np.exp(self._logsf*2)
+        ell = np.exp(self._logell)
+        p = np.exp(self._logp)
+
+        D = np.sqrt(distances(X1, X2).sqdist()) * np.pi / p
+        R = np.sin(D) / ell
+        S = R**2
+        K = sf2 * np.exp(-2*S)
+
+        dK = np.empty((3,) + K.shape, K.dtype)
+        dK[0] = 2*K
+        dK[1] = 4*K*S
+        dK[2] = 4*K*R*D * np.cos(D) / ell
+        return K, dK
+
     def dget(self, X1):
         return np.exp(self._logsf*2) * np.ones(len(X1))
 
@@ -87,7 +103,7 @@ class Periodic(RealKernel):
         p = np.exp(self._logp)
 
         # get the distance and a few transformations
-        D = diff(X1, X2) * np.pi / p
+        D = distances(X1, X2).diff() * np.pi / p
         K = sf2 * np.exp(-2*(np.sin(D) / ell)**2)
         G = -2 * np.pi / ell**2 / p * K * np.sin(2*D)
 
@@ -13,7 +13,7 @@ import numpy as np
 # local imports
 from ._real import RealKernel
 from ..utils.models import printable
-from ._distances import rescale, diff, sqdist, sqdist_foreach
+from ._distances import distances
 
 # exported symbols
 __all__ = ['RQ']
@@ -58,8 +58,8 @@ class RQ(RealKernel):
         ell = np.exp(self._logell)
         alpha = np.exp(self._logalpha)
 
-        X1, X2 = rescale(ell, X1, X2)
-        K = sf2 * (1 + 0.5*sqdist(X1, X2)/alpha) ** (-alpha)
+        D = distances(X1, X2).sqdist(ell)
+        K = sf2 * (1 + 0.5*D/alpha) ** (-alpha)
         return K
 
     def grad(self, X1, X2=None):
@@ -69,8 +69,8 @@ class RQ(RealKernel):
         alpha = np.exp(self._logalpha)
 
         # precomputations
-        X1, X2 = rescale(ell, X1, X2)
-        D = sqdist(X1, X2)
+        dist = distances(X1, X2)
+        D = dist.sqdist(ell)
         E = 1 + 0.5*D/alpha
         K = sf2 * E**(-alpha)
         M = K*D/E
@@ -79,10 +79,47 @@ class RQ(RealKernel):
         if self._iso:
             yield M                             # derivative wrt logell (iso)
         else:
-            for D in sqdist_foreach(X1, X2):
+            for D in dist.sqdist_foreach(ell):
                 yield K*D/E                     # derivative wrt logell (ard)
         yield 0.5*M - alpha*K*np.log(E)         # derivative wrt alpha
 
+    def get_with_grad(self, X1, X2=None):
+        sf2 = np.exp(self._logsf*2)
+        ell = np.exp(self._logell)
+        alpha = np.exp(self._logalpha)
+
+        dist = distances(X1, X2)
+        D = dist.sqdist(ell)
+        E = 1 + 0.5*D/alpha
+        K = sf2 * E**(-alpha)
+        M = K*D/E
+
+        dK = np.empty((self.nhyper,) + K.shape, K.dtype)
+        dK[0] = 2*K
+        if self._iso:
+            dK[1] = M
+        else:
+            for i, D in enumerate(dist.sqdist_foreach(ell)):
+                dK[1+i] = K*D/E
+        dK[-1] = 0.5*M - alpha*K*np.log(E)
+        return K, dK
+
+    def grad_contract(self, Q, X1, X2=None):
+        sf2 = np.exp(self._logsf*2)
+        ell = np.exp(self._logell)
+        alpha = np.exp(self._logalpha)
+
+        dist = distances(X1, X2)
+        D = dist.sqdist(ell)
+        E = 1 + 0.5*D/alpha
+        P = Q * sf2 * E**(-alpha)
+        M = P*D/E
+
+        return np.r_[
+            2*np.sum(P),
+            np.sum(M) if self._iso else dist.sqdist_contract(P/E, ell),
+            np.sum(0.5*M - alpha*P*np.log(E))]
+
     def dget(self, X1):
         return np.exp(self._logsf*2) * np.ones(len(X1))
 
@@ -95,15 +132,17 @@ class RQ(RealKernel):
     def gradx(self, X1, X2=None):
         # hypers
         sf2 = np.exp(self._logsf*2)
-        ell = np.exp(self._logell)
         alpha = np.exp(self._logalpha)
 
         # precomputations
-        X1, X2 = rescale(ell, X1, X2)
-        D = diff(X1, X2)
-        E = 1 + np.sum(D**2, axis=-1) / 2 / alpha
+        ell = np.exp(self._logell)
+        dist = distances(X1, X2)
+        E = 1 + dist.sqdist(ell) / 2 / alpha
         K = sf2 * E**(-alpha)
-        G = -(K/E)[:, :, None] * D / ell
+
+        G = dist.diff(ell)
+        G *= (K/E)[..., None]
+        G /= -ell
 
         return G
 
@@ -13,7 +13,7 @@ from mwhutils.random import rstate
 
 # local imports
 from ._real import RealKernel
-from ._distances import rescale, diff, sqdist, sqdist_foreach
+from ._distances import distances
 from ..utils.models import printable
 
 # exported symbols
@@ -51,20 +51,44 @@ class SE(RealKernel):
         self._logell = hyper[1] if self._iso else hyper[1:]
 
     def get(self, X1, X2=None):
-        X1, X2 = rescale(np.exp(self._logell), X1, X2)
-        return np.exp(self._logsf*2 - sqdist(X1, X2)/2)
+        D = distances(X1, X2).sqdist(np.exp(self._logell))
+        return np.exp(self._logsf*2 - D/2)
 
     def grad(self, X1, X2=None):
-        X1, X2 = rescale(np.exp(self._logell), X1, X2)
-        D = sqdist(X1, X2)
+        ell = np.exp(self._logell)
+        dist = distances(X1, X2)
+        D = dist.sqdist(ell)
         K = np.exp(self._logsf*2 - D/2)
         yield 2*K                               # derivative wrt logsf
         if self._iso:
             yield K*D                           # derivative wrt logell (iso)
         else:
-            for D in sqdist_foreach(X1, X2):
+            for D in dist.sqdist_foreach(ell):
                 yield K*D                       # derivatives wrt logell (ard)
 
+    def get_with_grad(self, X1, X2=None):
+        ell = np.exp(self._logell)
+        dist = distances(X1, X2)
+        D = dist.sqdist(ell)
+        K = np.exp(self._logsf*2 - D/2)
+        dK = np.empty((self.nhyper,) + K.shape, K.dtype)
+        dK[0] = 2*K
+        if self._iso:
+            dK[1] = K*D
+        else:
+            for i, D in enumerate(dist.sqdist_foreach(ell)):
+                dK[1+i] = K*D
+        return K, dK
+
+    def grad_contract(self, Q, X1, X2=None):
+        ell = np.exp(self._logell)
+        dist = distances(X1, X2)
+        D = dist.sqdist(ell)
+        P = Q * np.exp(self._logsf*2 - D/2)
+        if self._iso:
+            return np.r_[2*np.sum(P), np.sum(P*D)]
+        return np.r_[2*np.sum(P), dist.sqdist_contract(P, ell)]
+
     def dget(self, X1):
         return np.exp(self._logsf*2) * np.ones(len(X1))
 
@@ -75,25 +99,28 @@ class SE(RealKernel):
 
     def gradx(self, X1, X2=None):
         ell = np.exp(self._logell)
-        X1, X2 = rescale(ell, X1, X2)
-
-        D = diff(X1, X2)
-        K = np.exp(self._logsf*2 - np.sum(D**2, axis=-1)/2)
-        G = -K[:, :, None] * D / ell
+        dist = distances(X1, X2)
+        K = np.exp(self._logsf*2 - dist.sqdist(ell)/2)
+
+        # the differences are formed directly in the output and scaled in
+        # place, so no other (m,n,d)-arrays are needed.
+        G = dist.diff(ell)
+        G *= K[..., None]
+        G /= -ell
         return G
 
     def grady(self, X1, X2=None):
         return -self.gradx(X1, X2)
 
     def gradxy(self, X1, X2=None):
-        ell = np.exp(self._logell)
-        X1, X2 = rescale(ell, X1, X2)
-        D = diff(X1, X2)
+        D = distances(X1, X2).diff(np.exp(self._logell))
+        ell = np.exp(self._logell).astype(D.dtype)
         _, _, d = D.shape
 
         K = np.exp(self._logsf*2 - np.sum(D**2, axis=-1)/2)
         D /= ell
-        M = np.eye(d)/ell**2 - D[:, :, None] * D[:, :, :, None]
+        I = np.eye(d, dtype=D.dtype)
+        M = I/ell**2 - D[:, :, None] * D[:, :, :, None]
         G = M * K[:, :, None, None]
 
         return G
@@ -104,3 +131,14 @@ class SE(RealKernel):
         ell = np.exp(self._logell)
         W = rng.randn(N, self.ndim) / ell
         return W, sf2
+
+    def grad_spectrum(self, W):
+        # the weights are proportional to 1/ell given the random draws.
+        dW = np.zeros((self.nhyper,) + W.shape)
+        if self._iso:
+            dW[1] = -W
+        else:
+            for i in xrange(self.ndim):
+                dW[1+i, :, i] = -W[:, i]
+        dsf2 = np.r_[2 * np.exp(self._logsf*2), np.zeros(self.nhyper-1)]
+        return dW, dsf2
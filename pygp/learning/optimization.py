@@ -58,10 +58,21 @@ def optimize(gp, priors=None):
         lZ, dlZ = gp.loglikelihood(True)
         return -lZ, -dlZ[active]
 
-    # optimize the model
-    x, _, info = so.fmin_l_bfgs_b(objective, hyper0[active])
+    # optimize the model. if possible the model is made lazy so that setting
+    # the hyperparameters defers the update until the loglikelihood is
+    # computed, which lets models evaluate the kernel and its gradient
+    # together.
+    lazy = getattr(gp, 'lazy', None)
+    if lazy is not None:
+        gp.lazy = True
+    try:
+        x, _, info = so.fmin_l_bfgs_b(objective, hyper0[active])
 
-    # make sure that the gp is using the correct hypers
-    hyper = hyper0.copy()
-    hyper[active] = x
-    gp.set_hyper(hyper)
+        # make sure that the gp is using the correct hypers. this is done
+        # before restoring lazy so that the model is only updated once.
+        hyper = hyper0.copy()
+        hyper[active] = x
+        gp.set_hyper(hyper)
+    finally:
+        if lazy is not None:
+            gp.lazy = lazy
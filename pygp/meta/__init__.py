@@ -6,10 +6,13 @@ hyperparameters.
 # pylint: disable=wildcard-import
 from .mcmc import *
 from .smc import *
+from .experts import *
 
 from . import mcmc
 from . import smc
+from . import experts
 
 __all__ = []
 __all__ += mcmc.__all__
 __all__ += smc.__all__
+__all__ += experts.__all__
@@ -0,0 +1,298 @@
+"""
+Meta models which split the data between a number of independent GP experts
+and combine their predictions.
+"""
+
+# future imports
+from __future__ import division
+from __future__ import absolute_import
+from __future__ import print_function
+
+# global imports
+import numpy as np
+from multiprocessing import cpu_count
+from scipy.spatial.distance import cdist
+from mwhutils.random import rstate
+
+# local imports
+from ..utils.models import Parameterized
+
+# exported symbols
+__all__ = ['Experts']
+
+
+def _kmeans(X, k, rng, niter=20):
+    """Return the centers of `k` clusters of `X` found using k-means."""
+    C = X[rng.choice(len(X), k, replace=False)]
+    for _ in xrange(niter):
+        labels = np.argmin(cdist(X, C, 'sqeuclidean'), axis=1)
+        for i in xrange(k):
+            if np.any(labels == i):
+                C[i] = np.mean(X[labels == i], axis=0)
+    return C
+
+
+def _kdtree(X, k):
+    """
+    Return the centers of `k` cells of `X` found by repeatedly splitting the
+    largest cell at the median of its widest dimension.
+    """
+    cells = [np.arange(len(X))]
+    while len(cells) < k:
+        idx = cells.pop(np.argmax([len(_) for _ in cells]))
+        Z = X[idx]
+        j = np.argmax(np.ptp(Z, axis=0))
+        order = np.argsort(Z[:, j])
+        cells += [idx[order[:len(idx)//2]], idx[order[len(idx)//2:]]]
+    return np.array([np.mean(X[idx], axis=0) for idx in cells])
+
+
+# the experts held by a worker process, indexed by their position in the
+# model. each worker process belongs to a single model.
+_registry = {}
+
+
+def _load(i, expert):
+    """Store the ith expert in the registry of the worker."""
+    _registry[i] = expert
+
+
+def _call(i, hyper, name, args):
+    """
+    Call the named method of the ith expert held by the worker with the given
+    arguments, after setting its hyperparameters, and return the result. This
+    is what each worker runs.
+    """
+    expert = _registry[i]
+    if np.any(expert.get_hyper() != hyper):
+        expert.set_hyper(hyper)
+    return getattr(expert, name)(*args)
+
+
+class Experts(Parameterized):
+    """
+    Meta model which partitions the data between `n` experts, each of which
+    is a copy of `model` fit to its own part of the data.
+
+    The data is partitioned randomly or, if `partition` is 'kmeans' or
+    'kdtree', between the cells found by k-means or by median splits of the
+    inputs; new data is then given to the expert with the nearest center.
+    The experts' predictions are combined using a product of experts (PoE),
+    the generalized PoE of (Cao and Fleet, 2014) with uniform weights, the
+    Bayesian committee machine (BCM), or the robust BCM of (Deisenroth and
+    Ng, 2015), by setting `method` to 'poe', 'gpoe', 'bcm', or 'rbcm'.
+
+    The experts share the hyperparameters of the model, and the
+    loglikelihood is the sum of the experts' loglikelihoods. By default the
+    experts are fit and evaluated serially. If `nworkers` is greater than 1
+    (or None, for one per CPU) this is instead done in parallel by as many
+    worker processes, which are started when first needed and kept for the
+    lifetime of the model. Each expert is sent to a single worker once and
+    stays there, along with its statistics, so afterwards only new data,
+    hyperparameters, test points, and results are passed between processes.
+    """
+    def __init__(self, model, n=4, partition='kmeans', method='rbcm',
+                 nworkers=1, rng=None):
+        if partition not in ('random', 'kmeans', 'kdtree'):
+            raise ValueError('unknown partition type')
+        if method not in ('poe', 'gpoe', 'bcm', 'rbcm'):
+            raise ValueError('unknown method for combining the experts')
+
+        self._model = model.copy()
+        self._model.reset()
+        self._n = n
+        self._partition = partition
+        self._method = method
+        self._nworkers = cpu_count() if (nworkers is None) else nworkers
+        self._rng = rstate(rng)
+
+        # the experts and the centers of their part of the input space.
+        self._experts = []
+        self._centers = None
+
+        # a single-process pool for each worker, which are only started once
+        # needed, and the number of experts which have been sent to them.
+        self._pools = None
+        self._nsent = 0
+
+        self.nhyper = self._model.nhyper
+
+        if model.ndata > 0:
+            self.add_data(*model.data)
+
+    def __iter__(self):
+        return self._experts.__iter__()
+
+    def __getstate__(self):
+        # the pools can't be copied or pickled, so copies start their own and
+        # send them the experts.
+        state = self.__dict__.copy()
+        state['_pools'] = None
+        state['_nsent'] = 0
+        return state
+
+    def __del__(self):
+        for pool in getattr(self, '_pools', None) or []:
+            pool.shutdown(wait=False)
+
+    def _params(self):
+        return self._model._params()
+
+    def get_hyper(self):
+        return self._model.get_hyper()
+
+    def set_hyper(self, hyper):
+        # the experts are lazy, so their statistics are only updated the next
+        # time they are used. any held by workers are sent the new
+        # hyperparameters along with their next call.
+        self._model.set_hyper(hyper)
+        for expert in self._experts:
+            expert.set_hyper(hyper)
+
+    @property
+    def ndata(self):
+        return sum(expert.ndata for expert in self._experts)
+
+    @property
+    def data(self):
+        if len(self._experts) == 0:
+            return (None, None)
+        X, y = zip(*[expert.data for expert in self._experts])
+        return (np.concatenate(X), np.concatenate(y))
+
+    def _submit(self, i, fn, *args):
+        """Run `fn(i, *args)` on the worker holding the ith expert."""
+        return self._pools[i % len(self._pools)].submit(fn, i, *args)
+
+    def _map(self, name, *args):
+        """
+        Call the named method of each expert with the given arguments, either
+        serially or by the workers holding them, and return the results.
+        """
+        if self._nworkers == 1:
+            return [getattr(expert, name)(*args) for expert in self._experts]
+
+        if self._pools is None:
+            # NOTE: this is only imported here as on python 2 it requires the
+            # futures backport.
+            from concurrent.futures import ProcessPoolExecutor
+            self._pools = [ProcessPoolExecutor(1)
+                           for _ in xrange(self._nworkers)]
+
+        # send any new experts. each pool runs its jobs in order, so these
+        # are loaded before they are called.
+        for i in xrange(self._nsent, len(self._experts)):
+            self._submit(i, _load, self._experts[i])
+        self._nsent = len(self._experts)
+
+        hyper = self._model.get_hyper()
+        futures = [self._submit(i, _call, hyper, name, args)
+                   for i in xrange(len(self._experts))]
+        return [future.result() for future in futures]
+
+    def add_data(self, X, y):
+        X = self._model._kernel.transform(X)
+        y = self._model._likelihood.transform(y)
+
+        # partition the first batch of data. afterwards new points are given
+        # to the expert with the nearest center, or a random expert.
+        if len(self._experts) == 0:
+            n = min(self._n, len(X))
+            if self._partition == 'random':
+                labels = self._rng.permutation(len(X)) % n
+            else:
+                self._centers = (_kmeans(X, n, self._rng)
+                                 if (self._partition == 'kmeans') else
+                                 _kdtree(X, n))
+                labels = np.argmin(cdist(X, self._centers, 'sqeuclidean'),
+                                   axis=1)
+
+            # drop any empty cells.
+            keep = np.unique(labels)
+            if self._centers is not None:
+                self._centers = self._centers[keep]
+            labels = np.searchsorted(keep, labels)
+
+            for _ in keep:
+                expert = self._model.copy()
+                expert.lazy = True
+                self._experts.append(expert)
+
+        elif self._centers is None:
+            labels = self._rng.randint(len(self._experts), size=len(X))
+
+        else:
+            labels = np.argmin(cdist(X, self._centers, 'sqeuclidean'), axis=1)
+
+        # the experts are lazy so this only appends the data, and fitting
+        # them is left to the workers. any experts already held by a worker
+        # are also sent their new data.
+        hyper = self._model.get_hyper()
+        for i, expert in enumerate(self._experts):
+            if np.any(labels == i):
+                Xi, yi = X[labels == i], y[labels == i]
+                expert.add_data(Xi, yi)
+                if i < self._nsent:
+                    self._submit(i, _call, hyper, 'add_data', (Xi, yi))
+
+        self._map('_refresh')
+
+    def loglikelihood(self, grad=False):
+        """
+        Return the sum of the experts' loglikelihoods, and if `grad` is True
+        the sum of their gradients.
+        """
+        # the experts are lazy, so this also updates any stale statistics.
+        parts = self._map('loglikelihood', grad)
+        if not grad:
+            return sum(parts)
+        lZ, dlZ = zip(*parts)
+        return sum(lZ), np.sum(dlZ, axis=0)
+
+    def posterior(self, X, grad=False):
+        X = self._model._kernel.transform(X)
+        parts = [np.array(_) for _ in zip(*self._map('posterior', X, grad))]
+
+        # the prior, which is used to correct the BCM variants.
+        m0 = self._model._mean
+        s0 = self._model._kernel.dget(X)
+        c = 1 if self._method in ('bcm', 'rbcm') else 0
+
+        # the weight of each expert. for the robust BCM this is the difference
+        # in entropy between the prior and the expert's posterior.
+        mu_, s2_ = parts[:2]
+        beta = (np.ones_like(s2_) if (self._method in ('poe', 'bcm')) else
+                np.ones_like(s2_) / len(s2_) if (self._method == 'gpoe') else
+                0.5 * (np.log(s0) - np.log(s2_)))
+
+        # the combined precision and precision-weighted mean.
+        P = np.sum(beta / s2_, axis=0) + c * (1 - np.sum(beta, axis=0)) / s0
+        N = np.sum(beta * mu_ / s2_, axis=0)
+        N += c * (1 - np.sum(beta, axis=0)) * m0 / s0
+
+        mu = N / P
+        s2 = 1 / P
+
+        if not grad:
+            return mu, s2
+
+        # NOTE: this assumes a stationary kernel so that the prior variance
+        # doesn't depend on the inputs.
+        dmu_, ds2_ = parts[2:]
+        dbeta = (-0.5 * ds2_ / s2_[:, :, None] if (self._method == 'rbcm')
+                 else np.zeros_like(ds2_))
+
+        beta = beta[:, :, None]
+        mu_ = mu_[:, :, None]
+        s2_ = s2_[:, :, None]
+
+        dP = np.sum(dbeta / s2_ - beta * ds2_ / s2_**2, axis=0)
+        dP -= c * np.sum(dbeta, axis=0) / s0[:, None]
+        dN = np.sum(dbeta * mu_ / s2_ + beta * dmu_ / s2_ -
+                    beta * mu_ * ds2_ / s2_**2, axis=0)
+        dN -= c * np.sum(dbeta, axis=0) * m0 / s0[:, None]
+
+        dmu = (dN - mu[:, None] * dP) / P[:, None]
+        ds2 = -dP / P[:, None]**2
+
+        return mu, s2, dmu, ds2
@@ -0,0 +1,257 @@
+"""
+Linear algebra helpers.
+"""
+
+# future imports
+from __future__ import division
+from __future__ import absolute_import
+from __future__ import print_function
+
+# global imports
+import numpy as np
+import scipy.linalg as sla
+
+# exported symbols
+__all__ = ['cholupdate', 'pivoted_cholesky', 'pcg', 'lanczos',
+           'lanczos_quadrature', 'toeplitz_mvm', 'durbin', 'kron_mvm']
+
+
+def cholupdate(R, X):
+    """
+    Given an upper-triangular Cholesky factor `R` of some matrix `A` return
+    the factor of `A + X^T X` where `X` is a (k,n)-array. This is a rank-k
+    update which requires O(k n^2) operations rather than the O(n^3) needed
+    to refactorize `A`.
+    """
+    R = np.array(R, dtype=float, copy=True)
+    X = np.array(X, ndmin=2, dtype=float, copy=True)
+
+    # for each column zero out X[:, j] using a Householder reflection of the
+    # vector [R[j,j], X[:, j]] and apply the same reflection to the remaining
+    # columns of R[j] and X.
+    for j in xrange(R.shape[0]):
+        x = X[:, j].copy()
+        if not np.any(x):
+            continue
+
+        r = R[j, j]
+        s = 1 if (r >= 0) else -1
+        u = r + s * np.sqrt(r**2 + np.dot(x, x))
+        beta = 2 / (u**2 + np.dot(x, x))
+
+        w = beta * (u * R[j, j:] + np.dot(x, X[:, j:]))
+        R[j, j:] -= u * w
+        X[:, j:] -= np.outer(x, w)
+
+        # the reflection leaves R[j,j] with the opposite sign of r, so flip
+        # the row if necessary to keep the diagonal positive.
+        if R[j, j] < 0:
+            R[j, j:] *= -1
+
+    return R
+
+
+def pivoted_cholesky(diag, column, rank, tol=1e-10):
+    """
+    Compute a rank-`rank` pivoted (partial) Cholesky factor `L` such that
+    `L L^T` approximates some psd matrix `A`. The matrix is only accessed
+    through its diagonal `diag` and the function `column(i)`, which should
+    return the i-th column of `A`. The factorization stops early if the
+    largest remaining diagonal element falls below `tol` times the largest
+    element of `diag`.
+    """
+    d = np.array(diag, dtype=float, copy=True)
+    n = d.shape[0]
+    k = min(rank, n)
+    L = np.zeros((n, k))
+    tol = tol * np.max(d) if (n > 0) else 0
+
+    for j in xrange(k):
+        i = np.argmax(d)
+        if d[i] <= tol:
+            return L[:, :j]
+
+        # the i-th column of the residual A - L L^T.
+        c = column(i) - np.dot(L[:, :j], L[i, :j])
+        L[:, j] = c / np.sqrt(d[i])
+        d -= L[:, j]**2
+        d[i] = 0
+
+    return L
+
+
+def pcg(A, B, M=None, tol=1e-8, maxiter=None, lanczos=False):
+    """
+    Solve the linear system `A X = B` using the preconditioned conjugate
+    gradient method, where `A` is a function computing matrix products with a
+    psd matrix and `B` is an (n,t)-array of right-hand sides which are solved
+    for simultaneously. `M` is an optional function which applies the inverse
+    of the preconditioner. Each column is iterated until its residual norm
+    falls below `tol` times the norm of the corresponding column of `B`.
+
+    If `lanczos` is True also return a list of the Lanczos tridiagonal
+    matrices for each column, which correspond to running the Lanczos process
+    on the preconditioned system starting from that column of `B`.
+    """
+    B = np.array(B, dtype=float, ndmin=2)
+    M = (lambda R: R) if (M is None) else M
+    n, t = B.shape
+    maxiter = n if (maxiter is None) else maxiter
+
+    X = np.zeros_like(B)
+    R = B.copy()
+    Z = M(R)
+    P = Z.copy()
+    rz = np.sum(R*Z, axis=0)
+
+    bnorm = np.sqrt(np.sum(B**2, axis=0))
+    bnorm[bnorm == 0] = 1
+    active = np.sqrt(np.sum(R**2, axis=0)) > tol * bnorm
+
+    # the CG coefficients for each column, used to form the Lanczos matrices.
+    coefs = [[] for _ in xrange(t)]
+
+    for _ in xrange(maxiter):
+        if not np.any(active):
+            break
+
+        idx = np.flatnonzero(active)
+        AP = A(P[:, idx])
+        alpha = rz[idx] / np.sum(P[:, idx]*AP, axis=0)
+
+        X[:, idx] += alpha * P[:, idx]
+        R[:, idx] -= alpha * AP
+
+        Z = M(R[:, idx])
+        rz_ = np.sum(R[:, idx]*Z, axis=0)
+        beta = rz_ / rz[idx]
+        P[:, idx] = Z + beta * P[:, idx]
+        rz[idx] = rz_
+
+        for i, a, b in zip(idx, alpha, beta):
+            coefs[i].append((a, b))
+
+        rnorm = np.sqrt(np.sum(R[:, idx]**2, axis=0))
+        active[idx] = rnorm > tol * bnorm[idx]
+
+    if not lanczos:
+        return X
+
+    # the Lanczos matrix has diagonal 1/a_j + b_{j-1}/a_{j-1} and
+    # off-diagonal sqrt(b_j)/a_j; see eg Saad, 2003.
+    T = []
+    for coef in coefs:
+        a, b = np.array(coef, ndmin=2).reshape(-1, 2).T
+        Tj = np.diag(1/a)
+        Tj[1:, 1:] += np.diag(b[:-1] / a[:-1])
+        Tj[range(1, len(a)), range(len(a)-1)] = np.sqrt(b[:-1]) / a[:-1]
+        Tj[range(len(a)-1), range(1, len(a))] = np.sqrt(b[:-1]) / a[:-1]
+        T.append(Tj)
+
+    return X, T
+
+
+def lanczos(A, b, k):
+    """
+    Run `k` iterations of the Lanczos process on a psd matrix starting from
+    the vector `b`, where `A` is a function computing products with the
+    matrix. Return an (n,j)-array `Q` with orthonormal columns and the (j,j)
+    tridiagonal matrix `T = Q^T A Q`, where `j` is less than `k` if the
+    Krylov subspace is exhausted early. Each new vector is reorthogonalized
+    against all of the previous ones, which takes O(n k^2) operations.
+    """
+    b = np.asarray(b, dtype=float)
+    k = min(k, len(b))
+    Q = np.zeros((len(b), k))
+    a = np.zeros(k)
+    c = np.zeros(k)
+    q = b / np.sqrt(np.dot(b, b))
+
+    for j in xrange(k):
+        Q[:, j] = q
+        v = A(q)
+        a[j] = np.dot(q, v)
+
+        # orthogonalizing twice is enough to keep Q orthonormal to working
+        # precision.
+        for _ in xrange(2):
+            v -= np.dot(Q[:, :j+1], np.dot(Q[:, :j+1].T, v))
+
+        c[j] = np.sqrt(np.dot(v, v))
+        if c[j] <= 1e-12 * np.max(np.abs(a[:j+1])):
+            break
+        q = v / c[j]
+
+    j = min(j+1, k)
+    T = np.diag(a[:j]) + np.diag(c[:j-1], 1) + np.diag(c[:j-1], -1)
+    return Q[:, :j], T
+
+
+def lanczos_quadrature(T, f=np.log):
+    """
+    Given a Lanczos tridiagonal matrix `T` return the Gauss quadrature
+    estimate `e_1^T f(T) e_1`. When `T` is obtained by running Lanczos on `A`
+    from a unit vector `z` this approximates `z^T f(A) z`.
+    """
+    if len(T) == 0:
+        return 0.0
+    w, V = np.linalg.eigh(T)
+    return np.dot(V[0]**2, f(w))
+
+
+def toeplitz_mvm(c, V):
+    """
+    Multiply the symmetric Toeplitz matrix with first column `c` by the
+    (n,)- or (n,t)-array `V`. This embeds the matrix in a circulant matrix of
+    twice the size, and hence requires O(n log n) operations per column.
+    """
+    n = c.shape[0]
+    V = np.asarray(V)
+    circ = np.r_[c, 0, c[:0:-1]]
+    F = np.fft.rfft(circ)
+    W = np.fft.irfft(np.fft.rfft(V, 2*n, axis=0) *
+                     F.reshape((-1,) + (1,) * (V.ndim-1)), 2*n, axis=0)
+    return W[:n]
+
+
+def durbin(c):
+    """
+    Given the first column `c` of a symmetric positive-definite Toeplitz
+    matrix `T` use the Durbin (Levinson) recursion to compute the first column
+    of `T^{-1}` and the log-determinant of `T`. This requires O(n^2)
+    operations and O(n) memory; see Golub and Van Loan, Alg. 4.7.1.
+    """
+    n = c.shape[0]
+    r = c[1:] / c[0]
+    y = np.zeros(n-1)
+
+    # e is the prediction error of the leading k-by-k block, normalized by
+    # c[0]; the product of these gives the determinant.
+    e = 1.0
+    logdet = n * np.log(c[0])
+
+    for k in xrange(n-1):
+        alpha = -(r[k] + np.dot(r[:k][::-1], y[:k])) / e
+        y[:k] = y[:k] + alpha * y[:k][::-1]
+        y[k] = alpha
+        logdet += np.log(e)
+        e *= (1 - alpha**2)
+
+    logdet += np.log(e)
+    x = np.r_[1, y] / (c[0] * e)
+
+    return x, logdet
+
+
+def kron_mvm(Ks, V):
+    """
+    Multiply the Kronecker product of the matrices `Ks` by the (N,)- or
+    (N,t)-array `V`, where N is the product of their numbers of columns. Each
+    factor is applied along its own axis of `V` reshaped into a grid, so this
+    requires O(N sum_i n_i) operations per column rather than O(N^2).
+    """
+    V = np.asarray(V)
+    W = V.reshape([K.shape[1] for K in Ks] + [-1])
+    for i, K in enumerate(Ks):
+        W = np.rollaxis(np.tensordot(K, W, (1, i)), 0, i+1)
+    return W.reshape((-1,) + V.shape[1:])
@@ -13,4 +13,5 @@ setup(name='pygp',
       license='Simplified BSD',
       packages=find_packages(),
       package_data={'': ['*.txt', '*.npz']},
-      install_requires=['numpy', 'scipy', 'matplotlib', 'mwhutils'])
+      install_requires=['numpy', 'scipy', 'matplotlib', 'mwhutils',
+                        'futures; python_version < "3"'])
@@ -11,9 +11,13 @@ from __future__ import absolute_import
 from __future__ import print_function
 
 # global imports
+import os
+import shutil
+import tempfile
 import numpy as np
 import numpy.testing as nt
 import scipy.optimize as spop
+import nose
 
 # local imports
 import pygp
@@ -62,6 +66,27 @@ class InferenceTest(object):
         hyper2 = self.gp.get_hyper()
         nt.assert_allclose(hyper1, hyper2)
 
+    def test_set_hyper(self):
+        # make sure that partially updating the statistics when only the mean
+        # and/or the scale changes gives the same result as a full update.
+        # note that this assumes the first kernel parameter is sf.
+        a = self.gp._likelihood.nhyper
+        for delta in [(0, 0, .1), (.1, .1, 0), (.2, .2, -.1), (.1, 0, 0)]:
+            hyper = self.gp.get_hyper()
+            hyper[0] += delta[0]
+            hyper[a] += delta[1]
+            hyper[-1] += delta[2]
+
+            gp1 = self.gp.copy()
+            gp1.set_hyper(hyper)
+
+            gp2 = self.gp.copy()
+            gp2._updatehyper = lambda hyper0: gp2._update()
+            gp2.set_hyper(hyper)
+
+            nt.assert_allclose(gp1.posterior(self.X), gp2.posterior(self.X))
+            nt.assert_allclose(gp1.loglikelihood(), gp2.loglikelihood())
+
     def test_add_data(self):
         # add additional data.
         gp1 = self.gp.copy()
@@ -78,6 +103,78 @@ class InferenceTest(object):
         p2 = gp2.posterior(self.X)
         nt.assert_allclose(p1, p2)
 
+    def test_add_data_single(self):
+        # add the data one point at a time, which should repeatedly grow the
+        # data (and possibly statistics) buffers.
+        X, y = self.gp.data
+        gp = self.gp.copy()
+        gp.reset()
+        for i in xrange(len(X)):
+            gp.add_data(X[i:i+1], y[i:i+1])
+
+        nt.assert_allclose(gp.data[0], X)
+        nt.assert_allclose(gp.posterior(self.X), self.gp.posterior(self.X))
+
+    def test_lazy(self):
+        hyper = self.gp.get_hyper() + 0.1
+        X, y = self.gp.data
+
+        # eagerly add the data in two batches and change the hypers.
+        gp1 = self.gp.copy()
+        gp1.reset()
+        gp1.add_data(X[:5], y[:5])
+        gp1.add_data(X[5:], y[5:])
+        gp1.set_hyper(hyper)
+
+        # do the same thing lazily, and make sure we don't update anything
+        # until the posterior is asked for.
+        gp2 = self.gp.copy()
+        gp2.reset()
+        gp2.lazy = True
+        gp2._update = None
+        gp2.add_data(X[:5], y[:5])
+        gp2.add_data(X[5:], y[5:])
+        gp2.set_hyper(hyper)
+        del gp2._update
+
+        nt.assert_allclose(gp1.posterior(self.X), gp2.posterior(self.X))
+        nt.assert_allclose(gp1.loglikelihood(), gp2.loglikelihood())
+
+        # changing only the mean lazily should also match.
+        hyper[-1] += 0.1
+        gp1.set_hyper(hyper)
+        gp2.set_hyper(hyper)
+        nt.assert_allclose(gp1.loglikelihood(), gp2.loglikelihood())
+
+    def test_remove_data(self):
+        X, y = self.gp.data
+        keep = np.ones(len(X), dtype=bool)
+        keep[[0, 3, 7]] = False
+
+        gp1 = self.gp.copy()
+        gp1.remove_data([7, 0, 3])
+
+        gp2 = self.gp.copy()
+        gp2.reset()
+        gp2.add_data(X[keep], y[keep])
+
+        nt.assert_allclose(gp1.data[0], gp2.data[0])
+        nt.assert_allclose(gp1.posterior(self.X), gp2.posterior(self.X))
+        nt.assert_allclose(gp1.loglikelihood(), gp2.loglikelihood())
+
+    def test_window(self):
+        X, y = self.gp.data
+        gp1 = self.gp.copy()
+        gp1.window = 12
+        gp1.add_data(self.X, self.y)
+
+        gp2 = self.gp.copy()
+        gp2.reset()
+        gp2.add_data(np.r_[X, self.X][-12:], np.r_[y, self.y][-12:])
+
+        assert gp1.ndata == 12
+        nt.assert_allclose(gp1.posterior(self.X), gp2.posterior(self.X))
+
     def test_sample(self):
         _ = self.gp.sample(self.X, m=2, latent=False)
         _ = self.gp.sample(self.X, m=2, latent=True)
@@ -102,6 +199,26 @@ class InferenceTest(object):
         g2 = spop.approx_fprime(x, f, 1e-8)
         nt.assert_allclose(g1, g2, rtol=1e-5, atol=1e-5)
 
+    def test_sample_pathwise(self):
+        try:
+            f = self.gp.sample_pathwise(10)
+        except NotImplementedError:
+            raise nose.SkipTest()
+
+        # get the gradient and test it
+        x = self.X[0]
+        _, g1 = f(x, True)
+        g2 = spop.approx_fprime(x, f, 1e-8)
+        nt.assert_allclose(g1, g2, rtol=1e-5, atol=1e-5)
+
+        # reset the gp and sample from the prior.
+        gp = self.gp.copy()
+        gp.reset()
+        f = gp.sample_pathwise(10)
+        _, g1 = f(x, True)
+        g2 = spop.approx_fprime(x, f, 1e-8)
+        nt.assert_allclose(g1, g2, rtol=1e-5, atol=1e-5)
+
     def test_loglikelihood(self):
         x = self.gp.get_hyper()
         f = lambda x: self.gp.copy(x).loglikelihood()
@@ -111,6 +228,16 @@ class InferenceTest(object):
         # slightly lesser gradient tolerance. mostly due to FITC.
         nt.assert_allclose(g1, g2, rtol=1e-5, atol=1e-5)
 
+    def test_loglikelihood_blocks(self):
+        # accumulating the gradient in blocks shouldn't change it.
+        gp = self.gp.copy()
+        gp.blocksize = 3
+        lZ1, g1 = self.gp.loglikelihood(grad=True)
+        lZ2, g2 = gp.loglikelihood(grad=True)
+        nt.assert_allclose(lZ1, lZ2)
+        nt.assert_allclose(g1, g2)
+        nt.assert_raises(ValueError, setattr, gp, 'blocksize', 0)
+
 
 ### TEST CLASS FOR REAL-VALUED INPUTS #########################################
 
@@ -156,6 +283,41 @@ class RealTest(InferenceTest):
         gp.set_hyper(gp.get_hyper() + 1)
         gp.posterior(self.X)
 
+    def test_posterior_blocks(self):
+        # evaluating the posterior in blocks, serially or in parallel, should
+        # give the same result.
+        p1 = self.gp.posterior(self.X, grad=True)
+        for nworkers in [1, 2]:
+            p2 = self.gp.posterior(self.X, grad=True, blocksize=3,
+                                   nworkers=nworkers)
+            for a, b in zip(p1, p2):
+                nt.assert_allclose(a, b)
+
+    def test_predict(self):
+        # the cached predictions should match the posterior, including after
+        # the data and hyperparameters change.
+        gp = self.gp.copy()
+        for _ in xrange(2):
+            mu, s2 = gp.posterior(self.X)
+            nt.assert_allclose(gp.predict_mean(self.X), mu)
+            nt.assert_allclose(gp.predict_var(self.X), s2, atol=1e-10)
+            gp.add_data(self.X, self.y)
+            gp.set_hyper(gp.get_hyper() + 0.1)
+
+    def test_float32(self):
+        # evaluating the kernel in single precision should only perturb the
+        # predictions and the loglikelihood slightly.
+        gp = self.gp.copy()
+        gp.dtype = np.float32
+        assert gp.data[0].dtype == np.float32
+
+        mu1, s21 = gp.posterior(self.X)
+        mu2, s22 = self.gp.posterior(self.X)
+        nt.assert_allclose(mu1, mu2, rtol=1e-3, atol=1e-4)
+        nt.assert_allclose(s21, s22, rtol=1e-3, atol=1e-4)
+        nt.assert_allclose(gp.loglikelihood(), self.gp.loglikelihood(),
+                           rtol=1e-4)
+
     def test_posterior_mu(self):
         f = lambda x: self.gp.posterior(x[None])[0]
         G1 = self.gp.posterior(self.X, grad=True)[2]
@@ -178,6 +340,89 @@ class TestExact(RealTest):
         gp = pygp.inference.ExactGP(likelihood, kernel, 0.0)
         RealTest.__init__(self, gp)
 
+    def test_from_options(self):
+        gp1 = pygp.inference.ExactGP(self.gp._likelihood, self.gp._kernel,
+                                     0.0, keepgrad=True)
+        gp1.blocksize = 7
+        gp2 = pygp.inference.ExactGP.from_gp(gp1)
+        nt.assert_equal(gp2._keepgrad, True)
+        nt.assert_equal(gp2.blocksize, 7)
+
+    def test_sample_pathwise_moments(self):
+        # the samples should have the moments of the posterior, up to the
+        # Monte Carlo error and the error in the prior features.
+        rng = np.random.RandomState(0)
+        F = np.array([self.gp.sample_pathwise(1000, rng).get(self.X)
+                      for _ in xrange(500)])
+        mu, s2 = self.gp.posterior(self.X)
+        nt.assert_allclose(np.mean(F, axis=0), mu, atol=0.1)
+        nt.assert_allclose(np.var(F, axis=0), s2, atol=0.1)
+
+    def test_buffers(self):
+        # the cholesky should be a contiguous view of its buffer after adding
+        # or removing points, so that it can be given to LAPACK without a
+        # copy, and should agree with a fresh model.
+        gp = self.gp.copy()
+        for update in [lambda: gp.add_data(self.X[:1], self.y[:1]),
+                       lambda: gp.add_data(self.X, self.y),
+                       lambda: gp.remove_data([1, 3, 4])]:
+            update()
+            assert gp._R.flags.f_contiguous
+            assert np.may_share_memory(gp._R, gp._Rbuf)
+            gp2 = pygp.inference.ExactGP.from_gp(gp)
+            nt.assert_allclose(gp._R, gp2._R, atol=1e-10)
+            nt.assert_allclose(gp._a, gp2._a, atol=1e-10)
+
+    def test_updategrad(self):
+        # updating a lazy model along with the gradient should agree with a
+        # separate update and gradient computation.
+        hyper = self.gp.get_hyper() + 0.1
+        gp1 = self.gp.copy()
+        gp1.lazy = True
+        gp1.set_hyper(hyper)
+        lZ1, g1 = gp1.loglikelihood(grad=True)
+        lZ2, g2 = self.gp.copy(hyper).loglikelihood(grad=True)
+        nt.assert_allclose(lZ1, lZ2)
+        nt.assert_allclose(g1, g2)
+        nt.assert_allclose(gp1.posterior(self.X), self.gp.copy(hyper)
+                                                         .posterior(self.X))
+
+        # the same should hold when the kernel is evaluated over several
+        # tiles, and when the gradients are kept for only some of them.
+        for keepgrad in [False, True]:
+            gp1 = self.gp.copy()
+            gp1.blocksize = 3
+            gp1._keepgrad = keepgrad
+            gp1.lazy = True
+            gp1.set_hyper(hyper)
+            lZ1, g1 = gp1.loglikelihood(grad=True)
+            nt.assert_allclose(lZ1, lZ2)
+            nt.assert_allclose(g1, g2)
+
+    def test_predict_rank(self):
+        # a full rank approximation is exact, otherwise the variance can only
+        # be overestimated.
+        _, s2 = self.gp.posterior(self.X)
+        s2_ = self.gp.predict_var(self.X, rank=self.gp.ndata)
+        nt.assert_allclose(s2_, s2, atol=1e-10)
+        s2_ = self.gp.predict_var(self.X, rank=3)
+        assert np.all(s2_ >= s2 - 1e-10)
+
+        # the error of the Lanczos approximation should fall quickly with its
+        # rank for a smooth kernel.
+        rng = np.random.RandomState(0)
+        X = rng.rand(200, 2)
+        y = np.sin(4 * np.sum(X, axis=1)) + 0.1 * rng.randn(200)
+        gp = pygp.inference.ExactGP(pygp.likelihoods.Gaussian(.01),
+                                    pygp.kernels.SE(1, .3, ndim=2), 0.0)
+        gp.add_data(X, y)
+        _, s2 = gp.posterior(self.X)
+        e = [gp.predict_var(self.X, rank=r) - s2 for r in [10, 40, 80]]
+        assert np.all(np.array(e) >= -1e-10)
+        assert np.max(e[0]) < 0.5
+        assert np.max(e[1]) < 1e-2
+        assert np.max(e[2]) < 1e-7
+
 
 class TestBasic(RealTest):
     def __init__(self):
@@ -195,6 +440,18 @@ class TestFITC(RealTest):
         gp = pygp.inference.FITC(likelihood, kernel, mean, U)
         RealTest.__init__(self, gp)
 
+    def test_updateinc(self):
+        # adding data incrementally is the same as a full update on all of the
+        # data.
+        gp1 = self.gp.copy()
+        gp1.add_data(self.X, self.y)
+        gp2 = pygp.inference.FITC.from_gp(gp1)
+        for a, b in zip(gp1.posterior(self.X, grad=True) +
+                        gp1.loglikelihood(True),
+                        gp2.posterior(self.X, grad=True) +
+                        gp2.loglikelihood(True)):
+            nt.assert_allclose(a, b)
+
 
 class TestDTC(RealTest):
     def __init__(self):
@@ -207,6 +464,430 @@ class TestDTC(RealTest):
         RealTest.__init__(self, gp)
 
 
+class TestCG(RealTest):
+    def __init__(self):
+        likelihood = pygp.likelihoods.Gaussian(1)
+        kernel = pygp.kernels.SE(1, 1, ndim=2)
+        gp = pygp.inference.CGGP(likelihood, kernel, 0.0)
+        gp.blocksize = 4
+        RealTest.__init__(self, gp)
+
+    def test_exact(self):
+        # the preconditioner is exact if its rank is at least the number of
+        # data points, in which case the stochastic estimates are as well.
+        gp1 = pygp.inference.CGGP.from_gp(self.gp)
+        gp1.add_data(self.X, self.y)
+        gp2 = pygp.inference.ExactGP.from_gp(gp1)
+
+        nt.assert_allclose(gp1.posterior(self.X), gp2.posterior(self.X))
+        nt.assert_allclose(gp1.loglikelihood(True)[1],
+                           gp2.loglikelihood(True)[1], rtol=1e-6)
+
+        # otherwise the CG solutions should still be exact and the stochastic
+        # estimates approximately so.
+        gp1._rank = 3
+        gp1._nprobe = 1000
+        gp1._update()
+
+        nt.assert_allclose(gp1.posterior(self.X), gp2.posterior(self.X))
+        nt.assert_allclose(gp1.loglikelihood(), gp2.loglikelihood(),
+                           rtol=1e-2)
+
+    def test_from_options(self):
+        # the settings of the iterative methods should be kept.
+        gp1 = pygp.inference.CGGP(self.gp._likelihood, self.gp._kernel, 0.0,
+                                  rank=5, nprobe=3, tol=1e-6, maxiter=50,
+                                  seed=1)
+        gp1.blocksize = 7
+        gp2 = pygp.inference.CGGP.from_gp(gp1)
+        nt.assert_equal(gp2._options(gp2), gp1._options(gp1))
+        nt.assert_equal(gp2.blocksize, 7)
+
+
+class TestToeplitz(RealTest):
+    def __init__(self):
+        # the data and test points lie on a regular grid, with the data in
+        # some random order.
+        rng = np.random.RandomState(1)
+        likelihood = pygp.likelihoods.Gaussian(1)
+        kernel = pygp.kernels.SE(1, 1, ndim=1)
+        self.gp = pygp.inference.ToeplitzGP(likelihood, kernel, 0.0,
+                                            grid=(0, 0.1))
+        self.gp.add_data(0.1 * rng.permutation(10)[:, None], rng.rand(10))
+        self.X = 0.1 * np.arange(10, 20)[:, None]
+        self.y = rng.rand(10)
+
+    def test_exact(self):
+        # compare the complete grid and a grid with missing points against
+        # exact inference.
+        gp1 = self.gp.copy()
+        gp1.add_data(self.X, self.y)
+        gp2 = pygp.inference.ExactGP.from_gp(gp1)
+
+        for _ in xrange(2):
+            nt.assert_allclose(gp1.posterior(self.X), gp2.posterior(self.X))
+            nt.assert_allclose(gp1.loglikelihood(True)[1],
+                               gp2.loglikelihood(True)[1], rtol=1e-6)
+            gp1.remove_data([2, 12])
+            gp2.remove_data([2, 12])
+
+    def test_from_options(self):
+        # the grid should only be kept when copying from the same class, and
+        # the settings of the iterative methods from any iterative model.
+        gp1 = pygp.inference.CGGP(self.gp._likelihood, self.gp._kernel, 0.0,
+                                  rank=5, seed=1)
+        gp2 = pygp.inference.ToeplitzGP.from_gp(gp1)
+        gp3 = pygp.inference.ToeplitzGP.from_gp(self.gp)
+        nt.assert_equal(gp2._options(gp2), gp1._options(gp1))
+        nt.assert_equal(gp2._grid, None)
+        nt.assert_equal(gp3._grid, self.gp._grid)
+
+    def test_grid(self):
+        gp = self.gp.copy()
+        gp.reset()
+        gp.add_data([[0.2]], [0])
+        nt.assert_raises(ValueError, gp.add_data, [[0.12]], [0])
+
+        # a grid which starts below the data should still be complete.
+        gp = self.gp.copy()
+        gp.reset()
+        gp.add_data([[0.2], [0.3], [0.4]], [0, 0, 0])
+        assert gp._complete
+
+
+class TestKalman(RealTest):
+    def __init__(self):
+        likelihood = pygp.likelihoods.Gaussian(1)
+        kernel = pygp.kernels.Matern(1, 1, d=3)
+        gp = pygp.inference.KalmanGP(likelihood, kernel, 0.0)
+        RealTest.__init__(self, gp)
+
+    def test_exact(self):
+        # compare against exact inference for each state-space kernel,
+        # including adding data which follows the current inputs.
+        X, y = self.gp.data
+        likelihood = pygp.likelihoods.Gaussian(.5)
+        for kernel in [pygp.kernels.Matern(1, .5, d=1),
+                       pygp.kernels.Matern(1, .5, d=3),
+                       pygp.kernels.Matern(1, .5, d=5),
+                       pygp.kernels.Matern(1, .5, d=5) +
+                       pygp.kernels.Matern(.5, 2, d=1)]:
+            gp1 = pygp.inference.KalmanGP(likelihood, kernel, 0.5)
+            gp1.add_data(X, y)
+            gp2 = pygp.inference.ExactGP.from_gp(gp1)
+
+            for _ in xrange(2):
+                for a, b in zip(gp1.posterior(self.X, grad=True) +
+                                gp1._full_posterior(self.X) +
+                                gp1.loglikelihood(True),
+                                gp2.posterior(self.X, grad=True) +
+                                gp2._full_posterior(self.X) +
+                                gp2.loglikelihood(True)):
+                    nt.assert_allclose(a, b, rtol=1e-6, atol=1e-10)
+                gp1.add_data(self.X + 1, self.y)
+                gp2.add_data(self.X + 1, self.y)
+
+    def test_kernel(self):
+        likelihood = pygp.likelihoods.Gaussian(1)
+        kernel = pygp.kernels.SE(1, 1, ndim=1)
+        nt.assert_raises(ValueError, pygp.inference.KalmanGP,
+                         likelihood, kernel, 0.0)
+
+
+class TestKronecker(RealTest):
+    def __init__(self):
+        # the data covers a 4x3 grid in some random order, and the new points
+        # extend this to a 6x3 grid.
+        rng = np.random.RandomState(1)
+        likelihood = pygp.likelihoods.Gaussian(1)
+        kernel = pygp.kernels.SE(1, [1, .5])
+        G = np.array([(0.2*i, 0.3*j) for i in xrange(6) for j in xrange(3)])
+        self.gp = pygp.inference.KroneckerGP(likelihood, kernel, 0.0)
+        self.gp.add_data(G[rng.permutation(12)], rng.rand(12))
+        self.X = G[12:]
+        self.y = rng.rand(6)
+
+    def test_exact(self):
+        # compare the complete grid and a grid with missing points against
+        # exact inference.
+        gp1 = self.gp.copy()
+        gp1.add_data(self.X, self.y)
+        gp2 = pygp.inference.ExactGP.from_gp(gp1)
+
+        for _ in xrange(2):
+            for a, b in zip(gp1.posterior(self.X, grad=True) +
+                            gp1.loglikelihood(True),
+                            gp2.posterior(self.X, grad=True) +
+                            gp2.loglikelihood(True)):
+                nt.assert_allclose(a, b, rtol=1e-6, atol=1e-10)
+            gp1.remove_data([2, 12])
+            gp2.remove_data([2, 12])
+
+    def test_grid(self):
+        likelihood = pygp.likelihoods.Gaussian(1)
+        kernel = pygp.kernels.SE(1, [1, .5])
+        gp = pygp.inference.KroneckerGP(likelihood, kernel, 0.0,
+                                        grid=[[0, 1], [0, 1]])
+        gp.add_data([[0, 1]], [0])
+        nt.assert_raises(ValueError, gp.add_data, [[0.5, 1]], [0])
+
+    def test_from_options(self):
+        # the grid should only be kept when copying from the same class, and
+        # the settings of the iterative methods from any iterative model.
+        gp1 = pygp.inference.KroneckerGP(self.gp._likelihood, self.gp._kernel,
+                                         0.0, grid=[[0, 1], [0, 1]], rank=5,
+                                         seed=1)
+        gp2 = pygp.inference.KroneckerGP.from_gp(gp1)
+        gp3 = pygp.inference.KroneckerGP.from_gp(
+            pygp.inference.ExactGP.from_gp(gp1))
+        nt.assert_equal(gp2._options(gp2), gp1._options(gp1))
+        nt.assert_equal(gp2._grid, gp1._grid)
+        nt.assert_equal(gp3._grid, None)
+
+    def test_kernel(self):
+        likelihood = pygp.likelihoods.Gaussian(1)
+        kernel = pygp.kernels.Matern(1, [1, 1])
+        nt.assert_raises(ValueError, pygp.inference.KroneckerGP,
+                         likelihood, kernel, 0.0)
+
+
+class TestSKI(RealTest):
+    def __init__(self):
+        # the grid covers the data and test points with room to spare, so the
+        # interpolation stencils of each lie fully on the grid.
+        likelihood = pygp.likelihoods.Gaussian(1)
+        kernel = pygp.kernels.SE(1, 1, ndim=2)
+        grid = [np.linspace(-0.5, 1.5, 41)] * 2
+        gp = pygp.inference.SKI(likelihood, kernel, 0.0, grid=grid)
+        RealTest.__init__(self, gp)
+
+    def test_exact(self):
+        # with a fine enough grid the interpolated kernel should be close to
+        # the exact kernel.
+        gp1 = pygp.inference.SKI.from_gp(self.gp)
+        gp1.add_data(self.X, self.y)
+        gp2 = pygp.inference.ExactGP.from_gp(gp1)
+
+        for a, b in zip(gp1.posterior(self.X, grad=True) +
+                        gp1.loglikelihood(True),
+                        gp2.posterior(self.X, grad=True) +
+                        gp2.loglikelihood(True)):
+            nt.assert_allclose(a, b, rtol=1e-3, atol=1e-3)
+
+        # the same should hold for a grid placed automatically.
+        gp1 = pygp.inference.SKI(gp2._likelihood.copy(), gp2._kernel.copy(),
+                                 gp2._mean, gridsize=30)
+        gp1.add_data(*gp2.data)
+        nt.assert_allclose(gp1.posterior(self.X), gp2.posterior(self.X),
+                           rtol=1e-3, atol=1e-3)
+
+    def test_predict_rank(self):
+        # a low-rank approximation can only overestimate the variance.
+        _, s2 = self.gp.posterior(self.X)
+        s2_ = self.gp.predict_var(self.X, rank=3)
+        assert np.all(s2_ >= s2 - 1e-6)
+        s2_ = self.gp.predict_var(self.X, rank=self.gp.ndata-1)
+        nt.assert_allclose(s2_, s2, atol=1e-6)
+
+    def test_grid(self):
+        likelihood = pygp.likelihoods.Gaussian(1)
+        kernel = pygp.kernels.SE(1, 1, ndim=2)
+        nt.assert_raises(ValueError, pygp.inference.SKI,
+                         likelihood, kernel, 0.0, grid=[np.arange(5)])
+        nt.assert_raises(ValueError, pygp.inference.SKI,
+                         likelihood, kernel, 0.0, grid=[np.arange(4)] * 2)
+        nt.assert_raises(ValueError, pygp.inference.SKI,
+                         likelihood, kernel, 0.0, grid=[2**np.arange(5)] * 2)
+
+    def test_from_options(self):
+        # the grid should only be kept when copying from the same class, and
+        # the settings of the iterative methods from any iterative model.
+        gp1 = pygp.inference.SKI(self.gp._likelihood, self.gp._kernel, 0.0,
+                                 gridsize=20, rank=5, seed=1)
+        gp2 = pygp.inference.SKI.from_gp(gp1)
+        gp3 = pygp.inference.SKI.from_gp(self.gp)
+        nt.assert_equal(gp2._options(gp2), gp1._options(gp1))
+        nt.assert_equal(gp2._gridsize, 20)
+        nt.assert_equal(gp3._grid, self.gp._grid)
+
+
+class TestSSGP(RealTest):
+    def __init__(self):
+        likelihood = pygp.likelihoods.Gaussian(1)
+        kernel = pygp.kernels.SE(1, 1, ndim=2)
+        gp = pygp.inference.SSGP(likelihood, kernel, 0.0, N=50)
+        RealTest.__init__(self, gp)
+
+    def test_exact(self):
+        # the model is exact inference with the kernel given by the inner
+        # product of the features.
+        gp1 = self.gp.copy()
+        gp1.add_data(self.X, self.y)
+        X, y = gp1.data
+        Phi = gp1._features(X)
+        Phis = gp1._features(self.X)
+        sn2 = gp1._likelihood.s2
+
+        K = np.dot(Phi, Phi.T) + sn2 * np.eye(len(X))
+        Kxs = np.dot(Phi, Phis.T)
+        mu = np.dot(Kxs.T, np.linalg.solve(K, y))
+        s2 = np.sum(Phis**2, axis=1)
+        s2 -= np.sum(Kxs * np.linalg.solve(K, Kxs), axis=0)
+        lZ = -0.5 * np.dot(y, np.linalg.solve(K, y))
+        lZ -= 0.5 * np.linalg.slogdet(2 * np.pi * K)[1]
+
+        nt.assert_allclose(gp1.posterior(self.X), (mu, s2))
+        nt.assert_allclose(gp1.loglikelihood(), lZ)
+
+    def test_init(self):
+        likelihood = pygp.likelihoods.Gaussian(1)
+        kernel = pygp.kernels.RQ(1, 1, 1)
+        nt.assert_raises(ValueError, pygp.inference.SSGP,
+                         likelihood, kernel, 0.0)
+
+
+class TestSVGP(RealTest):
+    def __init__(self):
+        rng = np.random.RandomState(1)
+        likelihood = pygp.likelihoods.Gaussian(1)
+        kernel = pygp.kernels.SE(1, 1, ndim=2)
+        mean = 0.0
+        U = rng.rand(10, kernel.ndim)
+        gp = pygp.inference.SVGP(likelihood, kernel, mean, U)
+        RealTest.__init__(self, gp)
+
+    def test_exact(self):
+        # the optimal q gives the same predictions as DTC, and the bound is
+        # the DTC loglikelihood minus a trace term.
+        gp1 = self.gp
+        gp2 = pygp.inference.DTC.from_gp(gp1)
+        X, _ = gp1.data
+        U = gp1.pseudoinputs
+        kernel = gp1._kernel
+
+        Q = np.dot(kernel.get(X, U), np.linalg.solve(kernel.get(U),
+                                                     kernel.get(U, X)))
+        t = np.sum(kernel.dget(X)) - np.trace(Q)
+        lZ = gp2.loglikelihood() - 0.5 * t / gp1._likelihood.s2
+
+        nt.assert_allclose(gp1.posterior(self.X), gp2.posterior(self.X))
+        nt.assert_allclose(gp1.loglikelihood(), lZ, rtol=1e-6)
+
+    def test_sample_pathwise(self):
+        # the weights on the pseudo-inputs are large when Kuu is poorly
+        # conditioned, so forward differences are swamped by rounding errors
+        # and central differences are used instead.
+        f = self.gp.sample_pathwise(10, 0)
+        x = self.X[0]
+        _, g1 = f(x, True)
+        g2 = [(f(x + 1e-5*e) - f(x - 1e-5*e)) / 2e-5 for e in np.eye(len(x))]
+        nt.assert_allclose(g1, g2, rtol=1e-5, atol=1e-5)
+
+    def test_fit(self):
+        # a full natural gradient step on all of the data gives the optimal
+        # q, and the gradient of the expected loglikelihood is then the
+        # gradient of the collapsed bound.
+        X, y = self.gp.data
+        path = tempfile.mkdtemp()
+        np.save(os.path.join(path, 'X.npy'), X)
+        np.save(os.path.join(path, 'y.npy'), y)
+
+        # the paths are given as unicode, which must also work under py2.
+        gp = self.gp.copy()
+        gp.reset()
+        gp.fit(os.path.join(path, u'X.npy'), os.path.join(path, u'y.npy'),
+               niter=1, batchsize=len(X), rate=1, hyper=False)
+        shutil.rmtree(path)
+
+        nt.assert_allclose(gp.posterior(self.X), self.gp.posterior(self.X))
+        nt.assert_allclose(gp._batchgrad(X, y, 1),
+                           self.gp.loglikelihood(True)[1])
+
+        # the data isn't stored so the bound can't be evaluated, but samples
+        # should still come from q.
+        nt.assert_raises(ValueError, gp.loglikelihood)
+        rng = np.random.RandomState(0)
+        F = np.array([gp.sample_pathwise(1000, rng).get(self.X)
+                      for _ in xrange(500)])
+        mu, s2 = gp.posterior(self.X)
+        nt.assert_allclose(np.mean(F, axis=0), mu, atol=0.1)
+        nt.assert_allclose(np.var(F, axis=0), s2, atol=0.1)
+
+        # fitting minibatches should also change the hyperparameters, but
+        # can't be done if the model already holds data.
+        hyper = gp.get_hyper()
+        gp.fit(X, y, niter=10, batchsize=5, rng=0)
+        assert np.all(gp.get_hyper() != hyper)
+        nt.assert_raises(ValueError, self.gp.fit, X, y)
+
+
+class TestVecchia(RealTest):
+    def __init__(self):
+        likelihood = pygp.likelihoods.Gaussian(1)
+        kernel = pygp.kernels.SE(1, 1, ndim=2)
+        gp = pygp.inference.VecchiaGP(likelihood, kernel, 0.0, m=5)
+        gp.blocksize = 4
+        RealTest.__init__(self, gp)
+
+    def test_exact(self):
+        # with at least as many neighbours as data points the conditionals
+        # and predictions are exact, for any ordering.
+        for order in ['random', 'coord', 'data']:
+            gp1 = pygp.inference.VecchiaGP(self.gp._likelihood.copy(),
+                                           self.gp._kernel.copy(), 0.5,
+                                           m=10, order=order)
+            gp1.add_data(*self.gp.data)
+            gp2 = pygp.inference.ExactGP.from_gp(gp1)
+
+            for a, b in zip(gp1.posterior(self.X, grad=True),
+                            gp2.posterior(self.X, grad=True)):
+                nt.assert_allclose(a, b)
+            nt.assert_allclose(gp1.loglikelihood(True)[0],
+                               gp2.loglikelihood(True)[0])
+            nt.assert_allclose(gp1.loglikelihood(True)[1],
+                               gp2.loglikelihood(True)[1])
+
+    def test_neighbours(self):
+        # the neighbours should be the nearest preceding points.
+        rng = np.random.RandomState(0)
+        X = rng.rand(50, 2)
+        nbrs = pygp.inference.vecchia._neighbours(X, 3)
+        for i, J in enumerate(nbrs):
+            D = np.sum((X[:i] - X[i])**2, axis=1)
+            nt.assert_equal(J[J >= 0], np.argsort(D)[:3])
+
+    def test_updateinc(self):
+        # adding data incrementally in data order is the same as a full
+        # update.
+        gp1 = pygp.inference.VecchiaGP(self.gp._likelihood.copy(),
+                                       self.gp._kernel.copy(), 0.0,
+                                       m=3, order='data')
+        gp1.add_data(*self.gp.data)
+        gp2 = gp1.copy()
+        gp1.add_data(self.X, self.y)
+        gp2._updateinc = None
+        gp2.lazy = True
+        gp2.add_data(self.X, self.y)
+        del gp2._updateinc
+        nt.assert_allclose(gp1.loglikelihood(), gp2.loglikelihood())
+
+    def test_init(self):
+        likelihood = pygp.likelihoods.Gaussian(1)
+        kernel = pygp.kernels.SE(1, 1, ndim=2)
+        nt.assert_raises(ValueError, pygp.inference.VecchiaGP,
+                         likelihood, kernel, 0.0, order='foo')
+        nt.assert_raises(ValueError, pygp.inference.VecchiaGP,
+                         likelihood, kernel, 0.0, m=0)
+
+    def test_from_options(self):
+        gp1 = pygp.inference.VecchiaGP(self.gp._likelihood, self.gp._kernel,
+                                       0.0, m=3, order='coord', seed=1)
+        gp1.blocksize = 7
+        gp2 = pygp.inference.VecchiaGP.from_gp(gp1)
+        nt.assert_equal((gp2._m, gp2._order, gp2._seed), (3, 'coord', 1))
+        nt.assert_equal(gp2.blocksize, 7)
+
+
 ### INITIALIZATION TESTS ######################################################
 
 # the following tests attempt to initialize a few models with invalid
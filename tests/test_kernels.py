@@ -19,6 +19,7 @@ import operator as op
 
 # pygp imports
 import pygp.kernels as pk
+from pygp.kernels._distances import Distances, sqdist_blas
 
 
 ### BASE TEST CLASS ###########################################################
@@ -66,6 +67,76 @@ class KernelTest(object):
         nt.assert_allclose(K1, K2)
         nt.assert_allclose(G1, G2)
 
+    def test_distances(self):
+        dist = Distances(self.x1, self.x2)
+        for _ in xrange(2):
+            K1 = self.kernel.get(self.x1, self.x2)
+            K2 = self.kernel.get(dist)
+            G1 = np.array(list(self.kernel.grad(self.x1, self.x2)))
+            G2 = np.array(list(self.kernel.grad(dist)))
+            nt.assert_allclose(K1, K2)
+            nt.assert_allclose(G1, G2)
+
+    def test_distances_block(self):
+        # tiles should give the same result before and after the distances
+        # are cached by the parent.
+        dist = Distances(self.x1)
+        i, j = slice(1, 4), slice(2, None)
+        for _ in xrange(2):
+            tile = dist.block(i, j)
+            K1 = self.kernel.get(self.x1[i], self.x1[j])
+            K2 = self.kernel.get(tile)
+            G1 = np.array(list(self.kernel.grad(self.x1[i], self.x1[j])))
+            G2 = np.array(list(self.kernel.grad(tile)))
+            nt.assert_allclose(K1, K2, rtol=1e-10, atol=1e-12)
+            nt.assert_allclose(G1, G2, rtol=1e-10, atol=1e-12)
+            _ = list(self.kernel.grad(dist))
+
+        # only the squared distances are ever cached, never anything which
+        # is per-dimension.
+        assert set(vars(dist)) == set(['X1', 'X2', '_cache', '_S'])
+
+    def test_distances_stacked(self):
+        Z = np.array([self.x1, self.x1[::-1]])
+        dist = Distances(Z)
+        for _ in xrange(2):
+            K1 = np.array([self.kernel.get(z) for z in Z])
+            K2 = self.kernel.get(dist)
+            G1 = np.array([list(self.kernel.grad(z)) for z in Z])
+            G2 = np.array(list(self.kernel.grad(dist))).swapaxes(0, 1)
+            nt.assert_allclose(K1, K2)
+            nt.assert_allclose(G1, G2)
+
+    def test_grad_contract(self):
+        rng = np.random.RandomState(0)
+        Q = rng.randn(len(self.x1), len(self.x2))
+        g1 = [np.sum(Q * dK) for dK in self.kernel.grad(self.x1, self.x2)]
+
+        # contract using the raw inputs and with and without the cached
+        # distances.
+        dist = Distances(self.x1, self.x2)
+        nt.assert_allclose(self.kernel.grad_contract(Q, self.x1, self.x2), g1)
+        nt.assert_allclose(self.kernel.grad_contract(Q, dist), g1)
+        _ = dist.sqdist()
+        nt.assert_allclose(self.kernel.grad_contract(Q, dist), g1)
+
+        # contract a stack of inputs.
+        Z = np.array([self.x1, self.x1[::-1]])
+        Q = rng.randn(2, len(self.x1), len(self.x1))
+        g1 = [np.sum(Q * dK) for dK in self.kernel.grad(Distances(Z))]
+        nt.assert_allclose(self.kernel.grad_contract(Q, Distances(Z)), g1)
+
+    def test_get_with_grad(self):
+        K, dK = self.kernel.get_with_grad(self.x1, self.x2)
+        nt.assert_allclose(K, self.kernel.get(self.x1, self.x2))
+        nt.assert_allclose(dK, list(self.kernel.grad(self.x1, self.x2)))
+
+        # evaluate on a stack of inputs.
+        Z = np.array([self.x1, self.x1[::-1]])
+        K, dK = self.kernel.get_with_grad(Distances(Z))
+        nt.assert_allclose(K, self.kernel.get(Distances(Z)))
+        nt.assert_allclose(dK, list(self.kernel.grad(Distances(Z))))
+
     def test_grad(self):
         x = self.kernel.get_hyper()
         k = lambda x, x1, x2: self.kernel.copy(x)(x1, x2)
@@ -146,6 +217,44 @@ class RealKernelTest(KernelTest):
 
         nt.assert_allclose(G1, G2, rtol=1e-6, atol=1e-6)
 
+    def test_gradx_distances(self):
+        dist = Distances(self.x1, self.x2)
+        for f in ['gradx', 'grady', 'gradxy']:
+            try:
+                G1 = getattr(self.kernel, f)(self.x1, self.x2)
+            except NotImplementedError:
+                continue
+            for _ in xrange(2):
+                nt.assert_allclose(getattr(self.kernel, f)(dist), G1)
+
+    def test_gradx_stacked(self):
+        Z1 = np.array([self.x1, self.x1[::-1]])
+        Z2 = np.array([self.x2, self.x2[::-1]])
+        for f in ['gradx', 'grady']:
+            G1 = np.array([getattr(self.kernel, f)(z1, z2)
+                           for z1, z2 in zip(Z1, Z2)])
+            G2 = getattr(self.kernel, f)(Distances(Z1, Z2))
+            nt.assert_allclose(G1, G2)
+
+    def test_float32(self):
+        # the kernel should be evaluated in the precision of its inputs.
+        x1 = self.kernel.transform(self.x1.astype(np.float32))
+        x2 = self.kernel.transform(self.x2.astype(np.float32))
+        assert x1.dtype == np.float32
+        for f in ['get', 'grad', 'gradx', 'grady', 'gradxy']:
+            try:
+                G1 = np.array(list(getattr(self.kernel, f)(x1, x2)))
+                G2 = np.array(list(getattr(self.kernel, f)(self.x1, self.x2)))
+            except NotImplementedError:
+                continue
+            assert G1.dtype == np.float32
+            nt.assert_allclose(G1, G2, rtol=1e-4, atol=1e-5)
+
+        # the same should hold when rescaling cached distances.
+        dist = Distances(x1, x2)
+        for _ in xrange(2):
+            assert self.kernel.get(dist).dtype == np.float32
+
     def test_spectrum(self):
         try:
             W, alpha = self.kernel.sample_spectrum(100)
@@ -155,6 +264,24 @@ class RealKernelTest(KernelTest):
         assert np.isscalar(alpha)
         assert W.shape[0] == 100
 
+    def test_grad_spectrum(self):
+        try:
+            W, alpha = self.kernel.sample_spectrum(100, 0)
+            dW, dalpha = self.kernel.grad_spectrum(W)
+        except NotImplementedError:
+            raise nose.SkipTest()
+
+        # the draws are fixed by the seed, so W and alpha are deterministic
+        # functions of the hyperparameters.
+        def f(x):
+            W, alpha = self.kernel.copy(x).sample_spectrum(100, 0)
+            return np.r_[W.ravel(), alpha]
+
+        x = self.kernel.get_hyper()
+        G1 = np.c_[dW.reshape(len(dW), -1), dalpha]
+        G2 = np.array([(f(x + 1e-8 * e) - f(x)) / 1e-8 for e in np.eye(len(x))])
+        nt.assert_allclose(G1, G2, rtol=1e-5, atol=1e-5)
+
 
 ### PER KERNEL TESTS ##########################################################
 
@@ -238,6 +365,44 @@ class TestRealSumProduct(RealKernelTest):
                                 pk.SE(0.1, 0.2, ndim=2))
 
 
+class TestRealSumHighDim(RealKernelTest):
+    # enough dimensions that the distances are computed using BLAS.
+    def __init__(self):
+        RealKernelTest.__init__(self,
+                                pk.SE(0.8, np.linspace(2, 4, 20)) +
+                                pk.Matern(0.5, 3, d=3, ndim=20) *
+                                pk.RQ(0.7, 3, 0.5, ndim=20))
+
+
+### DISTANCE TESTS ############################################################
+
+def test_sqdist_blas():
+    rng = np.random.RandomState(0)
+    X1 = 10 + rng.rand(300, 20)
+    X2 = 10 + rng.rand(200, 20)
+
+    D = sqdist_blas(X1, X2)
+    nt.assert_allclose(D, np.sum((X1[:, None] - X2[None])**2, axis=-1),
+                       rtol=1e-10)
+
+    # the symmetric product is mirrored, so this should be exactly
+    # symmetric with a zero diagonal.
+    D = sqdist_blas(X1)
+    nt.assert_allclose(D, sqdist_blas(X1, X1), rtol=1e-10, atol=1e-12)
+    nt.assert_equal(D, D.T)
+    nt.assert_equal(np.diag(D), 0)
+
+    # stacks of inputs and single precision.
+    Z = np.array([X1[:10], X1[10:20]])
+    nt.assert_allclose(sqdist_blas(Z), [sqdist_blas(z) for z in Z],
+                       rtol=1e-10, atol=1e-12)
+    assert sqdist_blas(X1.astype(np.float32)).dtype == np.float32
+
+    # duplicate points shouldn't give negative distances.
+    X = np.tile(rng.rand(1, 20), (5, 1))
+    assert np.all(sqdist_blas(X, X) >= 0)
+
+
 ### INITIALIZATION TESTS ######################################################
 
 # the following tests attempt to initialize a few kernels with invalid
@@ -34,3 +34,18 @@ def test_optimization():
 
     # make sure our constraint is satisfied
     nt.assert_equal(gp.get_hyper()[0], np.log(0.1))
+
+
+def test_optimization_experts():
+    # models without a lazy mode, e.g. experts, can still be optimized.
+    rng = np.random.RandomState(0)
+    X = rng.rand(20, 1)
+    y = np.sin(6 * X[:, 0]) + 0.1 * rng.randn(20)
+
+    gp = pygp.BasicGP(sn=.1, sf=1, ell=.1, mu=0)
+    model = pygp.meta.Experts(gp, n=2, nworkers=1, rng=0)
+    model.add_data(X, y)
+
+    lZ0 = model.loglikelihood()
+    pygp.optimize(model)
+    assert model.loglikelihood() >= lZ0
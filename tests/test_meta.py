@@ -56,3 +56,81 @@ class BaseMetaTest(object):
 
 class TestMCMC(BaseMetaTest):
     MetaModel = meta.MCMC
+
+
+class TestExperts(object):
+    def __init__(self):
+        rng = np.random.RandomState(0)
+        X = rng.rand(40, 2)
+        y = rng.rand(40)
+
+        self.gp = pygp.BasicGP(0.5, 1, [1, 1])
+        self.gp.add_data(X, y)
+        self.model = meta.Experts(self.gp, n=4, nworkers=1, rng=0)
+        self.X = rng.rand(10, 2)
+
+    def test_init(self):
+        nt.assert_raises(ValueError, meta.Experts, self.gp, partition='foo')
+        nt.assert_raises(ValueError, meta.Experts, self.gp, method='foo')
+
+    def test_exact(self):
+        # a single expert is the exact model unless its weight depends on its
+        # posterior, as in the robust BCM.
+        for method in ['poe', 'gpoe', 'bcm']:
+            model = meta.Experts(self.gp, n=1, method=method, nworkers=1)
+            for a, b in zip(model.posterior(self.X, grad=True),
+                            self.gp.posterior(self.X, grad=True)):
+                nt.assert_allclose(a, b)
+            nt.assert_allclose(model.loglikelihood(True)[1],
+                               self.gp.loglikelihood(True)[1])
+
+    def test_partition(self):
+        for partition in ['random', 'kmeans', 'kdtree']:
+            model = meta.Experts(self.gp, partition=partition, nworkers=1,
+                                 rng=0)
+            model.add_data(self.X, np.zeros(len(self.X)))
+            assert model.ndata == 50
+            lZ = sum(expert.loglikelihood() for expert in model)
+            nt.assert_allclose(model.loglikelihood(), lZ)
+
+    def test_parallel(self):
+        model = meta.Experts(self.gp, n=4, nworkers=2, rng=0)
+        model.set_hyper(model.get_hyper() + 0.1)
+        self.model.set_hyper(self.model.get_hyper() + 0.1)
+        nt.assert_allclose(model.posterior(self.X),
+                           self.model.posterior(self.X))
+        nt.assert_allclose(model.loglikelihood(True)[1],
+                           self.model.loglikelihood(True)[1])
+
+        # the pools are reused between calls and aren't copied.
+        pools = model._pools
+        model.posterior(self.X)
+        assert model._pools is pools
+        nt.assert_allclose(model.copy().posterior(self.X),
+                           model.posterior(self.X))
+
+        # the experts held by the workers are sent any new data.
+        y = np.zeros(len(self.X))
+        model.add_data(self.X, y)
+        self.model.add_data(self.X, y)
+        nt.assert_allclose(model.posterior(self.X),
+                           self.model.posterior(self.X))
+        nt.assert_allclose(model.loglikelihood(), self.model.loglikelihood())
+
+    def test_grad_mu(self):
+        for method in ['poe', 'gpoe', 'bcm', 'rbcm']:
+            self.model._method = method
+            _, _, dmu, _ = self.model.posterior(self.X, grad=True)
+            fmu = lambda x: self.model.posterior(x[None])[0][0]
+            dmu_ = np.array([spop.approx_fprime(x, fmu, 1e-8)
+                             for x in self.X])
+            nt.assert_allclose(dmu, dmu_, rtol=1e-6, atol=1e-6)
+
+    def test_grad_s2(self):
+        for method in ['poe', 'gpoe', 'bcm', 'rbcm']:
+            self.model._method = method
+            _, _, _, ds2 = self.model.posterior(self.X, grad=True)
+            fs2 = lambda x: self.model.posterior(x[None])[1][0]
+            ds2_ = np.array([spop.approx_fprime(x, fs2, 1e-8)
+                             for x in self.X])
+            nt.assert_allclose(ds2, ds2_, rtol=1e-6, atol=1e-6)
@@ -0,0 +1,86 @@
+"""
+Tests of the utility functions.
+"""
+
+# pylint: disable=no-member
+# pylint: disable=missing-docstring
+
+# future imports
+from __future__ import division
+from __future__ import absolute_import
+from __future__ import print_function
+
+# global imports
+import numpy as np
+import numpy.testing as nt
+import scipy.linalg as sla
+
+# local imports
+from pygp.utils.linalg import cholupdate, pivoted_cholesky, pcg
+from pygp.utils.linalg import lanczos, lanczos_quadrature, kron_mvm
+
+
+def test_cholupdate():
+    rng = np.random.RandomState(0)
+    B = rng.randn(8, 8)
+    A = np.dot(B, B.T) + np.eye(8)
+    X = rng.randn(3, 8)
+
+    R1 = cholupdate(sla.cholesky(A), X)
+    R2 = sla.cholesky(A + np.dot(X.T, X))
+    nt.assert_allclose(R1, R2)
+
+
+def test_pivoted_cholesky():
+    rng = np.random.RandomState(0)
+    B = rng.randn(8, 3)
+    A = np.dot(B, B.T)
+
+    L = pivoted_cholesky(A.diagonal(), lambda i: A[:, i], 5)
+    nt.assert_equal(L.shape, (8, 3))
+    nt.assert_allclose(np.dot(L, L.T), A, atol=1e-10)
+
+
+def test_pcg():
+    rng = np.random.RandomState(0)
+    B = rng.randn(8, 8)
+    A = np.dot(B, B.T) + np.eye(8)
+    Z = rng.randn(8, 2)
+
+    X, T = pcg(lambda V: np.dot(A, V), Z, lanczos=True)
+    nt.assert_allclose(X, np.linalg.solve(A, Z))
+
+    # the quadrature is exact when Lanczos runs to completion.
+    w, V = np.linalg.eigh(A)
+    logA = np.dot(V * np.log(w), V.T)
+    nt.assert_allclose(
+        [np.dot(z, z) * lanczos_quadrature(Tj) for z, Tj in zip(Z.T, T)],
+        np.sum(Z * np.dot(logA, Z), axis=0))
+
+
+def test_lanczos():
+    rng = np.random.RandomState(0)
+    B = rng.randn(8, 8)
+    A = np.dot(B, B.T) + np.eye(8)
+    b = rng.randn(8)
+
+    # Q is orthonormal and tridiagonalizes A, starting from b.
+    Q, T = lanczos(lambda v: np.dot(A, v), b, 5)
+    nt.assert_allclose(np.dot(Q.T, Q), np.eye(5), atol=1e-10)
+    nt.assert_allclose(np.dot(Q.T, np.dot(A, Q)), T, atol=1e-10)
+    nt.assert_allclose(Q[:, 0], b / np.linalg.norm(b))
+
+    # the process stops early once the Krylov subspace is exhausted.
+    Q, T = lanczos(lambda v: np.dot(A, v), np.dot(A, np.eye(8)[0]), 20)
+    nt.assert_equal(Q.shape, (8, 8))
+    Q, T = lanczos(lambda v: v, b, 5)
+    nt.assert_equal(Q.shape, (8, 1))
+
+
+def test_kron_mvm():
+    rng = np.random.RandomState(0)
+    Ks = [rng.randn(3, 3), rng.randn(4, 4), rng.randn(2, 2)]
+    V = rng.randn(24, 5)
+    K = np.kron(np.kron(Ks[0], Ks[1]), Ks[2])
+    nt.assert_allclose(kron_mvm(Ks, V), np.dot(K, V))
+    nt.assert_allclose(kron_mvm(Ks, V[:, 0]), np.dot(K, V[:, 0]))